@@ -69,6 +69,9 @@ args = dict(
     entry_points={
         'gui_scripts': [
             '{0}={0}.main:main'.format(PACKAGE_NAME),
+        ],
+        'console_scripts': [
+            'uavcan_capture={0}.capture_cli:main'.format(PACKAGE_NAME),
         ]
     },
     include_package_data=True,
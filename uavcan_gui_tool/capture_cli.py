@@ -0,0 +1,268 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+"""
+Headless bus capture: records the frames received from a CAN interface into a capture file or to stdout.
+It does not need a display, and the per-frame work in the receiving loop is limited to packing the frame into
+a FRAME_RECORD; filtering and writing are done in batches by a separate thread, so it can keep up with a saturated
+bus. If the writer falls behind, whole batches are dropped and accounted for in the statistics.
+"""
+
+import logging
+import queue
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+
+import numpy
+import pyuavcan_v0
+
+from .capture_file import CaptureWriter
+from .frame_record import pack_frame, unpack_records
+from .value_ranges import parse_ranges, match_ranges
+
+logger = logging.getLogger(__name__)
+
+
+class CANIDFilter:
+    """
+    Accepts the CAN IDs that match any of the specifications: hex value (1E01550A), inclusive hex range (100-1FF)
+    or hex value with mask (00015500/00FFFF80). An empty list of specifications accepts everything.
+    """
+
+    def __init__(self, specs):
+        self._ranges = []
+        for spec in specs:
+            try:
+                self._ranges += parse_ranges(spec, 16)
+            except ValueError:
+                raise ValueError('Invalid CAN ID filter: %r' % spec)
+
+    def __bool__(self):
+        return bool(self._ranges)
+
+    def match(self, can_id):
+        """Accepts an array of CAN IDs, returns a boolean mask."""
+        if not self._ranges:
+            return numpy.ones(len(can_id), dtype=numpy.bool_)
+        return match_ranges(self._ranges, can_id)
+
+
+class HeadlessCapture:
+    """
+    Receives frames from the driver in the calling thread and writes them into a CaptureWriter from a worker thread.
+    """
+    BATCH_SIZE = 1000
+    BATCH_INTERVAL = 0.05
+    MAX_PENDING_BATCHES = 1000
+
+    def __init__(self, driver, writer, accept_filter=None, reject_filter=None):
+        self._driver = driver
+        self._writer = writer
+        self._accept_filter = accept_filter or CANIDFilter([])
+        self._reject_filter = reject_filter or CANIDFilter([])
+
+        self._queue = queue.Queue(self.MAX_PENDING_BATCHES)
+        self._thread = threading.Thread(target=self._write_loop, name='capture_writer', daemon=True)
+        self._stop = threading.Event()      # Set on shutdown if the queue has no room for the terminating None
+        self._error = None
+
+        self.num_received = 0
+        self.num_filtered = 0
+        self.num_dropped = 0
+
+    def _write_loop(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                records = unpack_records(data)
+                can_id = records['can_id']
+                mask = self._accept_filter.match(can_id)
+                if self._reject_filter:
+                    mask &= ~self._reject_filter.match(can_id)
+                self.num_filtered += len(records) - int(numpy.count_nonzero(mask))
+                self._writer.write(records[mask])
+                if self._stop.is_set() and self._queue.empty():
+                    break
+        except Exception as ex:
+            logger.error('Capture writer failed', exc_info=True)
+            self._error = ex
+
+    def _submit(self, batch):
+        try:
+            self._queue.put_nowait(b''.join(batch))
+        except queue.Full:
+            self.num_dropped += len(batch)
+
+    def _stop_writer(self):
+        # The writer thread may have died with the queue full, so the shutdown must not wait for room in the queue
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            self._stop.set()
+            try:
+                self._queue.put_nowait(None)        # In case the thread has drained the queue meanwhile
+            except queue.Full:
+                pass
+        self._thread.join()
+
+    def run(self, should_stop, on_idle):
+        """
+        Runs until should_stop() returns True. on_idle() is invoked at least every BATCH_INTERVAL seconds.
+        """
+        receive = self._driver.receive
+        batch = []
+        deadline = time.monotonic() + self.BATCH_INTERVAL
+        self._thread.start()
+        try:
+            while not should_stop():
+                frame = receive(self.BATCH_INTERVAL)
+                if frame is not None:
+                    batch.append(pack_frame('rx', frame))
+                    self.num_received += 1
+                if len(batch) >= self.BATCH_SIZE or time.monotonic() >= deadline:
+                    if batch:
+                        self._submit(batch)
+                        batch = []
+                    deadline = time.monotonic() + self.BATCH_INTERVAL
+                    if self._error is not None:
+                        raise self._error
+                    on_idle()
+        finally:
+            if batch:
+                self._submit(batch)
+            self._stop_writer()
+            self._writer.close()
+
+    @property
+    def error(self):
+        """The exception that stopped the writer thread, if any."""
+        return self._error
+
+    @property
+    def num_written(self):
+        return self._writer.num_records
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+
+def _make_parser():
+    parser = ArgumentParser(description='Headless UAVCAN bus capture. '
+                                        'Records the received CAN frames into a capture file that can be opened '
+                                        'in the bus monitor or replayed by the GUI tool.')
+    parser.add_argument('iface', nargs='?', help='CAN interface, e.g. can0 or /dev/ttyACM0')
+    parser.add_argument('-l', '--list', action='store_true', help='list the available interfaces and exit')
+    parser.add_argument('-o', '--output', default='-',
+                        help='capture file, or - to write to stdout (default); the file extension is .uavcancap')
+    parser.add_argument('-f', '--filter', action='append', default=[], metavar='ID',
+                        help='record only the matching CAN IDs (hex): value, range LOW-HIGH or VALUE/MASK; '
+                             'comma separated or repeated')
+    parser.add_argument('-x', '--exclude', action='append', default=[], metavar='ID',
+                        help='do not record the matching CAN IDs, same syntax as --filter')
+    parser.add_argument('-n', '--count', type=int, help='stop once this many frames have been recorded')
+    parser.add_argument('-d', '--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('-s', '--stats-interval', type=float, default=1.0,
+                        help='print statistics to stderr at this interval in seconds; 0 to disable')
+    parser.add_argument('--bitrate', type=int, help='CAN bus bit rate, if the interface needs to be configured')
+    parser.add_argument('--baudrate', type=int, help='serial port baud rate for SLCAN adapters')
+    parser.add_argument('--debug', action='store_true', help='enable debugging')
+    return parser
+
+
+def main(argv=None):
+    args = _make_parser().parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    if args.list:
+        from .setup_window import list_ifaces
+        for description, name in list_ifaces().items():
+            print(name if description == name else '%s\t%s' % (name, description))
+        return 0
+
+    if not args.iface:
+        print('Interface is not specified; use --list to see the available interfaces', file=sys.stderr)
+        return 1
+
+    try:
+        accept_filter = CANIDFilter(args.filter)
+        reject_filter = CANIDFilter(args.exclude)
+    except ValueError as ex:
+        print(ex, file=sys.stderr)
+        return 1
+
+    if args.output == '-' and sys.stdout.isatty():
+        print('Refusing to write binary data to a terminal; redirect stdout or use --output', file=sys.stderr)
+        return 1
+
+    iface_kwargs = {k: v for k, v in (('bitrate', args.bitrate), ('baudrate', args.baudrate)) if v is not None}
+    try:
+        driver = pyuavcan_v0.driver.make_driver(args.iface, **iface_kwargs)
+    except Exception as ex:
+        logger.error('Could not open %r: %s', args.iface, ex, exc_info=args.debug)
+        return 1
+
+    try:
+        if args.output == '-':
+            writer = CaptureWriter('<stdout>', stream=sys.stdout.buffer)
+        else:
+            writer = CaptureWriter(args.output)
+    except Exception as ex:
+        driver.close()
+        logger.error('Could not create the capture file: %s', ex, exc_info=args.debug)
+        return 1
+
+    logger.info('Capturing from %r into %r', args.iface, writer.path)
+
+    capture = HeadlessCapture(driver, writer, accept_filter, reject_filter)
+    started_at = time.monotonic()
+    stats = {'time': started_at, 'received': 0}
+
+    def should_stop():
+        if args.duration is not None and time.monotonic() - started_at >= args.duration:
+            return True
+        return args.count is not None and capture.num_written >= args.count
+
+    def print_stats(force=False):
+        now = time.monotonic()
+        dt = now - stats['time']
+        if not force and (not args.stats_interval or dt < args.stats_interval):
+            return
+        fps = (capture.num_received - stats['received']) / dt if dt > 0 else 0
+        stats['time'], stats['received'] = now, capture.num_received
+        print('%.1f s: received %d (%.0f FPS), written %d, filtered %d, dropped %d, queued %d batches' %
+              (now - started_at, capture.num_received, fps, capture.num_written, capture.num_filtered,
+               capture.num_dropped, capture.queue_depth), file=sys.stderr)
+
+    try:
+        capture.run(should_stop, print_stats)
+        if capture.error is not None:
+            raise capture.error
+    except KeyboardInterrupt:
+        if capture.error is not None:
+            logger.error('Capture failed: %s', capture.error, exc_info=args.debug)
+            return 1
+    except Exception as ex:
+        logger.error('Capture failed: %s', ex, exc_info=args.debug)
+        return 1
+    finally:
+        driver.close()
+        if args.stats_interval:
+            print_stats(force=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
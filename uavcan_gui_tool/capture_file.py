@@ -0,0 +1,204 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+"""
+Binary capture files.
+A capture file is a short header followed by an append-only sequence of FRAME_RECORD entries, so the file can be
+mapped into memory and viewed as a NumPy array of any size without parsing. Every INDEX_INTERVAL-th record
+is also listed in a sidecar time index file, which allows to locate a point in time without touching the records.
+"""
+
+import logging
+import mmap
+import os
+import struct
+
+import numpy
+
+from .frame_record import FRAME_RECORD_DTYPE
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'UAVCANv0CAPTURE\0'
+VERSION = 1
+
+# Magic, version, record size, index interval, padding up to the record alignment
+HEADER = struct.Struct('<16sHHI8x')
+
+INDEX_INTERVAL = 4096
+
+INDEX_DTYPE = numpy.dtype([
+    ('record', '<u8'),
+    ('ts_monotonic', '<f8'),
+    ('ts_real', '<f8'),
+])
+
+INDEX_FILE_SUFFIX = '.idx'
+
+FILE_EXTENSION = '.uavcancap'
+
+
+class CaptureFileError(Exception):
+    pass
+
+
+def get_index_path(path):
+    return path + INDEX_FILE_SUFFIX
+
+
+class CaptureWriter:
+    """
+    Streams frame records into a new capture file. The data is only buffered by the OS, so the file stays readable
+    while it is being written.
+    If a binary stream is supplied, e.g. sys.stdout.buffer, the capture is written into it instead and no index file
+    is produced; the path is then only used for display. The stream is not closed by close().
+    """
+
+    def __init__(self, path, index_interval=INDEX_INTERVAL, stream=None):
+        self._path = path
+        self._index_interval = int(index_interval)
+        self._num_records = 0
+        self._owns_file = stream is None
+        self._file = open(path, 'wb') if stream is None else stream
+        self._index_file = open(get_index_path(path), 'wb') if stream is None else None
+        self._file.write(HEADER.pack(MAGIC, VERSION, FRAME_RECORD_DTYPE.itemsize, self._index_interval))
+
+    def write(self, records):
+        """Accepts an array of FRAME_RECORD_DTYPE."""
+        num = len(records)
+        if num == 0:
+            return
+
+        self._file.write(numpy.ascontiguousarray(records, dtype=FRAME_RECORD_DTYPE).tobytes())
+
+        # Indexing every record whose number is a multiple of the interval
+        first = -(-self._num_records // self._index_interval) * self._index_interval
+        indexed = numpy.arange(first, self._num_records + num, self._index_interval, dtype=numpy.uint64)
+        if len(indexed) and self._index_file is not None:
+            entries = numpy.empty(len(indexed), dtype=INDEX_DTYPE)
+            local = (indexed - self._num_records).astype(numpy.int64)
+            entries['record'] = indexed
+            entries['ts_monotonic'] = records['ts_monotonic'][local]
+            entries['ts_real'] = records['ts_real'][local]
+            self._index_file.write(entries.tobytes())
+
+        self._num_records += num
+
+    def flush(self):
+        self._file.flush()
+        if self._index_file is not None:
+            self._index_file.flush()
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+        if self._index_file is not None:
+            self._index_file.close()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def num_records(self):
+        return self._num_records
+
+
+class CaptureReader:
+    """
+    Memory-mapped read-only view of a capture file. The records are exposed as a NumPy array of FRAME_RECORD_DTYPE
+    that is backed by the file, so opening a capture of any size takes constant time and memory.
+    An incomplete trailing record, e.g. if the file is still being written, is ignored.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise CaptureFileError('File is too short')
+
+            magic, version, record_size, self._index_interval = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise CaptureFileError('Not a capture file')
+            if version != VERSION or record_size != FRAME_RECORD_DTYPE.itemsize:
+                raise CaptureFileError('Unsupported capture file version %r' % version)
+
+            size = os.fstat(f.fileno()).st_size
+            num_records = (size - HEADER.size) // record_size
+            if num_records > 0:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._records = numpy.frombuffer(self._mmap, dtype=FRAME_RECORD_DTYPE,
+                                                 count=num_records, offset=HEADER.size)
+            else:
+                self._mmap = None
+                self._records = numpy.empty(0, dtype=FRAME_RECORD_DTYPE)
+
+        self._index = self._load_index()
+
+    def _load_index(self):
+        num_entries = -(-len(self._records) // self._index_interval)
+        try:
+            index = numpy.fromfile(get_index_path(self._path), dtype=INDEX_DTYPE)
+            if len(index) >= num_entries:
+                return index[:num_entries]
+            logger.info('Capture index of %r is incomplete, rebuilding', self._path)
+        except (OSError, ValueError):
+            logger.info('Capture index of %r could not be read, rebuilding', self._path, exc_info=True)
+
+        # Sampling every N-th record only touches a small fraction of the file
+        sampled = self._records[::self._index_interval]
+        index = numpy.empty(len(sampled), dtype=INDEX_DTYPE)
+        index['record'] = numpy.arange(len(sampled), dtype=numpy.uint64) * self._index_interval
+        index['ts_monotonic'] = sampled['ts_monotonic']
+        index['ts_real'] = sampled['ts_real']
+        return index
+
+    def find_time(self, ts, field='ts_monotonic'):
+        """Returns the number of the first record whose timestamp is not less than the specified one."""
+        if len(self._records) == 0:
+            return 0
+        entry = int(numpy.searchsorted(self._index[field], ts, side='right')) - 1
+        if entry < 0:
+            return 0
+        begin = int(self._index['record'][entry])
+        end = min(begin + self._index_interval, len(self._records))
+        return begin + int(numpy.searchsorted(self._records[field][begin:end], ts))
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def records(self):
+        return self._records
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def time_span(self):
+        """Returns (first ts_monotonic, last ts_monotonic), or None if the capture is empty."""
+        if len(self._records):
+            return float(self._records['ts_monotonic'][0]), float(self._records['ts_monotonic'][-1])
+
+    def __len__(self):
+        return len(self._records)
+
+    def close(self):
+        self._records = numpy.empty(0, dtype=FRAME_RECORD_DTYPE)
+        self._index = self._index[:0]
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                logger.debug('Capture file %r is still referenced, it will be closed by the GC', self._path)
+            self._mmap = None
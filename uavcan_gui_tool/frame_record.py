@@ -0,0 +1,64 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+"""
+Fixed-size binary representation of CAN frames.
+Frames are exchanged between processes in this form, so that a batch of frames can be moved with a single copy
+and viewed as a NumPy structured array on the other side without any per-frame parsing.
+"""
+
+import struct
+
+import numpy
+from pyuavcan_v0.driver import CANFrame
+
+FLAG_EXTENDED = 1
+FLAG_TX = 2
+
+# Monotonic timestamp, real timestamp, CAN ID, flags, DLC, payload, padding up to 32 bytes
+FRAME_RECORD = struct.Struct('<ddIBB8s2x')
+
+FRAME_RECORD_DTYPE = numpy.dtype([
+    ('ts_monotonic', '<f8'),
+    ('ts_real', '<f8'),
+    ('can_id', '<u4'),
+    ('flags', 'u1'),
+    ('dlc', 'u1'),
+    ('data', 'u1', (CANFrame.MAX_DATA_LENGTH,)),
+    ('reserved', 'V2'),
+])
+
+assert FRAME_RECORD.size == FRAME_RECORD_DTYPE.itemsize == 32
+
+
+def pack_frame(direction, frame):
+    """Returns the frame encoded as a FRAME_RECORD."""
+    flags = (FLAG_EXTENDED if frame.extended else 0) | (FLAG_TX if direction == 'tx' else 0)
+    data = bytes(frame.data)
+    return FRAME_RECORD.pack(frame.ts_monotonic, frame.ts_real, frame.id, flags, len(data), data)
+
+
+def pack_frames(items):
+    """Accepts an iterable of (direction, CANFrame), returns an array of FRAME_RECORD_DTYPE."""
+    return unpack_records(b''.join(pack_frame(direction, frame) for direction, frame in items))
+
+
+def unpack_records(buffer):
+    """Returns a read-only view of the buffer as an array of FRAME_RECORD_DTYPE; no data is copied."""
+    return numpy.frombuffer(buffer, dtype=FRAME_RECORD_DTYPE)
+
+
+def record_to_frame(record):
+    """Converts one element of a FRAME_RECORD_DTYPE array back to (direction, CANFrame)."""
+    flags = int(record['flags'])
+    frame = CANFrame(int(record['can_id']),
+                     bytes(record['data'][:record['dlc']]),
+                     bool(flags & FLAG_EXTENDED),
+                     ts_monotonic=float(record['ts_monotonic']),
+                     ts_real=float(record['ts_real']))
+    return ('tx' if flags & FLAG_TX else 'rx'), frame
@@ -0,0 +1,284 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import collections
+import logging
+import multiprocessing
+import pickle
+import queue
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+IPCChannelStats = collections.namedtuple('IPCChannelStats', [
+    'enqueued',             # Items written into the ring by the sender
+    'delivered',            # Items handed over to the receiver
+    'dropped',              # Items discarded by the sender because the ring was full
+    'queued',               # Items enqueued but not yet delivered
+    'ring_usage',           # Fraction of the ring capacity currently in use
+    'peak_ring_usage',      # Highest fraction of the ring capacity ever in use
+])
+
+
+class SharedMemoryRing:
+    """
+    Single-producer single-consumer ring buffer of variable-size messages located in shared memory.
+    The producer only advances the head and the consumer only advances the tail, hence no locking is needed.
+    The object can be passed to a child process; the child attaches to the same memory segment.
+    The header also holds the telemetry counters; each of them is modified by one side only.
+    """
+    _HEADER_SIZE = 64
+    _HEAD, _TAIL, _DROPPED, _ENQUEUED, _DELIVERED, _PEAK_USAGE = range(6)
+    _LENGTH_PREFIX = struct.Struct('<I')
+
+    def __init__(self, capacity):
+        self._capacity = int(capacity)
+        self._shm = shared_memory.SharedMemory(create=True, size=self._HEADER_SIZE + self._capacity)
+        self._owner = True
+        self._counters = self._map_counters()
+        self._counters[:] = 0
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'capacity': self._capacity}
+
+    def __setstate__(self, state):
+        self._capacity = state['capacity']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = False
+        self._counters = self._map_counters()
+
+    def _map_counters(self):
+        return numpy.ndarray((self._HEADER_SIZE // 8,), dtype=numpy.uint64, buffer=self._shm.buf)
+
+    def _copy_in(self, position, data):
+        offset = position % self._capacity
+        first = min(len(data), self._capacity - offset)
+        base = self._HEADER_SIZE
+        self._shm.buf[base + offset:base + offset + first] = data[:first]
+        if first < len(data):
+            self._shm.buf[base:base + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        offset = position % self._capacity
+        first = min(size, self._capacity - offset)
+        base = self._HEADER_SIZE
+        out = bytes(self._shm.buf[base + offset:base + offset + first])
+        if first < size:
+            out += bytes(self._shm.buf[base:base + size - first])
+        return out
+
+    def write(self, data):
+        """Returns False if there is not enough free space; the message is not written in that case."""
+        data = memoryview(data).cast('B')
+        head = int(self._counters[self._HEAD])
+        tail = int(self._counters[self._TAIL])
+        size = self._LENGTH_PREFIX.size + len(data)
+        if size > self._capacity - (head - tail):
+            return False
+
+        self._copy_in(head, self._LENGTH_PREFIX.pack(len(data)))
+        self._copy_in(head + self._LENGTH_PREFIX.size, data)
+        self._counters[self._HEAD] = head + size      # Publishing only after the payload is in place
+        self._counters[self._PEAK_USAGE] = max(int(self._counters[self._PEAK_USAGE]), head + size - tail)
+        return True
+
+    def read_all(self):
+        """Returns the list of all messages that are available for reading."""
+        head = int(self._counters[self._HEAD])
+        tail = int(self._counters[self._TAIL])
+        out = []
+        while tail < head:
+            size, = self._LENGTH_PREFIX.unpack(self._copy_out(tail, self._LENGTH_PREFIX.size))
+            out.append(self._copy_out(tail + self._LENGTH_PREFIX.size, size))
+            tail += self._LENGTH_PREFIX.size + size
+        self._counters[self._TAIL] = tail
+        return out
+
+    def add_dropped(self, count):
+        self._counters[self._DROPPED] += count
+
+    def add_enqueued(self, count):
+        self._counters[self._ENQUEUED] += count
+
+    def set_delivered(self, count):
+        self._counters[self._DELIVERED] = count
+
+    @property
+    def dropped(self):
+        return int(self._counters[self._DROPPED])
+
+    @property
+    def enqueued(self):
+        return int(self._counters[self._ENQUEUED])
+
+    @property
+    def delivered(self):
+        return int(self._counters[self._DELIVERED])
+
+    @property
+    def usage(self):
+        """Number of bytes currently occupied."""
+        return int(self._counters[self._HEAD]) - int(self._counters[self._TAIL])
+
+    @property
+    def peak_usage(self):
+        return int(self._counters[self._PEAK_USAGE])
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def close(self):
+        self._counters = None       # The buffer cannot be released while a view is alive
+        try:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+        except Exception:
+            logger.debug('Could not release shared memory', exc_info=True)
+
+
+class IPCChannel:
+    """
+    One-way channel from the parent process to a child process.
+    The sender accumulates items locally and flush() transfers the whole batch through a shared memory ring,
+    so the IPC costs are paid once per batch rather than once per item. The receiver is notified via a doorbell event.
+    If the receiver falls behind and the ring is full, the batch is dropped and accounted for; the sender never blocks.
+    Control commands are delivered through a regular queue, so that they are never dropped; so is the feedback
+    that the receiver can send back to the sender, e.g. to tell what data it is interested in.
+    Subclasses can override the batch encoding; by default, batches are pickled lists of objects.
+
+    Both sides keep the counters of the items passed through the channel in the shared memory, so either of them
+    can obtain the statistics at any time with get_stats() without any extra IPC.
+    """
+    DEFAULT_RING_CAPACITY = 8 * 1024 * 1024
+    DROP_WARNING_INTERVAL = 5
+
+    def __init__(self, ring_capacity=DEFAULT_RING_CAPACITY):
+        self._ring = SharedMemoryRing(ring_capacity)
+        self._doorbell = multiprocessing.Event()
+        self._commands = multiprocessing.Queue()
+        self._feedback = multiprocessing.Queue()
+        self._pending = []
+        self._received = collections.deque()
+        self._num_delivered = 0
+        self._num_dropped_since_warning = 0
+        self._last_drop_warning_at = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pending'] = []
+        state['_received'] = collections.deque()
+        return state
+
+    def _warn_dropped(self, count):
+        self._num_dropped_since_warning += count
+        if time.monotonic() - self._last_drop_warning_at >= self.DROP_WARNING_INTERVAL:
+            logger.warning('IPC receiver is falling behind, %d items dropped (%d total)',
+                           self._num_dropped_since_warning, self._ring.dropped)
+            self._num_dropped_since_warning = 0
+            self._last_drop_warning_at = time.monotonic()
+
+    def encode_batch(self, items):
+        return pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode_batch(self, data):
+        return pickle.loads(data)
+
+    # Sender side
+
+    def send_nonblocking(self, obj):
+        """The object will be sent with the next flush()."""
+        self._pending.append(obj)
+
+    def flush(self):
+        if not self._pending:
+            return
+        items, self._pending = self._pending, []
+        if self._ring.write(self.encode_batch(items)):
+            self._ring.add_enqueued(len(items))
+            self._doorbell.set()
+        else:
+            self._ring.add_dropped(len(items))
+            self._warn_dropped(len(items))
+
+    def send_command(self, command):
+        self._commands.put_nowait(command)
+
+    def receive_feedback(self):
+        """Returns the next feedback object from the receiver or None."""
+        try:
+            return self._feedback.get_nowait()
+        except queue.Empty:
+            pass
+
+    # Receiver side
+
+    def send_feedback(self, obj):
+        self._feedback.put_nowait(obj)
+
+    def receive_command(self):
+        """Returns the next command or None."""
+        try:
+            return self._commands.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _read_batches(self):
+        if not self._doorbell.is_set():
+            return []
+        self._doorbell.clear()
+        return [self.decode_batch(x) for x in self._ring.read_all()]
+
+    def receive_batches(self):
+        """Returns the list of all decoded batches that have arrived since the last call."""
+        batches = self._read_batches()
+        if batches:
+            self._num_delivered += sum(len(x) for x in batches)
+            self._ring.set_delivered(self._num_delivered)
+        return batches
+
+    def pump(self):
+        """Moves the arrived items from the shared memory into the local queue, so that the ring doesn't overflow."""
+        for batch in self._read_batches():
+            self._received.extend(batch)
+        self._ring.set_delivered(self._num_delivered)     # Publishing the items consumed one by one since last time
+
+    def receive_nonblocking(self):
+        """Returns: (True, object) if successful, (False, None) if no data to read """
+        if not self._received:
+            self.pump()
+        try:
+            obj = self._received.popleft()
+        except IndexError:
+            return False, None
+        self._num_delivered += 1
+        return True, obj
+
+    @property
+    def num_dropped(self):
+        return self._ring.dropped
+
+    def get_stats(self):
+        """Returns IPCChannelStats. Items pending in the local queue of the receiver are counted as queued."""
+        enqueued = self._ring.enqueued
+        delivered = max(self._ring.delivered, self._num_delivered)    # The receiver knows better than the ring
+        return IPCChannelStats(enqueued=enqueued,
+                               delivered=delivered,
+                               dropped=self._ring.dropped,
+                               queued=max(0, enqueued - delivered),
+                               ring_usage=self._ring.usage / self._ring.capacity,
+                               peak_ring_usage=self._ring.peak_usage / self._ring.capacity)
+
+    def close(self):
+        self._ring.close()
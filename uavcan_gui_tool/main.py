@@ -85,6 +85,8 @@ from .widgets.node_properties import NodePropertiesWindow
 from .widgets.console import ConsoleManager, InternalObjectDescriptor
 from .widgets.subscriber import SubscriberWindow
 from .widgets.plotter import PlotterManager
+from .widgets.ipc_stats import IPCStatsWindow
+from .widgets.replay import ReplayWindow
 from .widgets.about_window import AboutWindow
 from .widgets.can_adapter_control_panel import spawn_window as spawn_can_adapter_control_panel
 
@@ -97,7 +99,7 @@ class MainWindow(QMainWindow):
     MAX_SUCCESSIVE_NODE_ERRORS = 1000
 
     # noinspection PyTypeChecker,PyCallByClass,PyUnresolvedReferences
-    def __init__(self, node, iface_name):
+    def __init__(self, node, iface_name, bitrate=None):
         # Parent
         super(MainWindow, self).__init__()
         self.setWindowTitle('UAVCAN GUI Tool')
@@ -131,7 +133,7 @@ class MainWindow(QMainWindow):
         self._file_server_widget = FileServerWidget(self, node)
 
         self._plotter_manager = PlotterManager(self._node)
-        self._bus_monitor_manager = BusMonitorManager(self._node, iface_name)
+        self._bus_monitor_manager = BusMonitorManager(self._node, iface_name, bitrate)
         # Console manager depends on other stuff via context, initialize it last
         self._console_manager = ConsoleManager(self._make_console_context)
 
@@ -169,17 +171,29 @@ class MainWindow(QMainWindow):
         new_plotter_action.setStatusTip('Open new graph plotter window')
         new_plotter_action.triggered.connect(self._plotter_manager.spawn_plotter)
 
+        show_replay_action = QAction(get_icon('play-circle'), 'Capture &Replay', self)
+        show_replay_action.setShortcut(QKeySequence('Ctrl+Shift+R'))
+        show_replay_action.setStatusTip('Replay a CAN capture file through the local node')
+        show_replay_action.triggered.connect(lambda: ReplayWindow.spawn(self, self._node))
+
         show_can_adapter_controls_action = QAction(get_icon('plug'), 'CAN &Adapter Control Panel', self)
         show_can_adapter_controls_action.setShortcut(QKeySequence('Ctrl+Shift+A'))
         show_can_adapter_controls_action.setStatusTip('Open CAN adapter control panel (if supported by the adapter)')
         show_can_adapter_controls_action.triggered.connect(self._try_spawn_can_adapter_control_panel)
 
+        show_ipc_stats_action = QAction(get_icon('dashboard'), '&IPC Statistics', self)
+        show_ipc_stats_action.setStatusTip('Show how much data the bus monitor and plotter windows receive and lose')
+        show_ipc_stats_action.triggered.connect(lambda: IPCStatsWindow(self, self._get_ipc_stats).show())
+
         tools_menu = self.menuBar().addMenu('&Tools')
         tools_menu.addAction(show_bus_monitor_action)
         tools_menu.addAction(show_console_action)
         tools_menu.addAction(new_subscriber_action)
         tools_menu.addAction(new_plotter_action)
+        tools_menu.addAction(show_replay_action)
         tools_menu.addAction(show_can_adapter_controls_action)
+        tools_menu.addSeparator()
+        tools_menu.addAction(show_ipc_stats_action)
 
         #
         # Panels menu
@@ -245,6 +259,9 @@ class MainWindow(QMainWindow):
                                                           make_vbox(self._dynamic_node_id_allocation_widget,
                                                                     stretch_index=1))))
 
+    def _get_ipc_stats(self):
+        return self._bus_monitor_manager.get_ipc_stats() + self._plotter_manager.get_ipc_stats()
+
     def _try_spawn_can_adapter_control_panel(self):
         try:
             spawn_can_adapter_control_panel(self, self._node, self._iface_name)
@@ -571,6 +588,7 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, qcloseevent):
         self._plotter_manager.close()
+        self._bus_monitor_manager.close()
         self._console_manager.close()
         self._active_data_type_detector.close()
         super(MainWindow, self).closeEvent(qcloseevent)
@@ -633,7 +651,7 @@ def main():
             break
 
     logger.info('Creating main window; iface %r', iface)
-    window = MainWindow(node, iface)
+    window = MainWindow(node, iface, iface_kwargs.get('bitrate'))
     window.show()
 
     try:
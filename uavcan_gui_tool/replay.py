@@ -0,0 +1,168 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import logging
+import time
+
+import numpy
+import pyuavcan_v0
+from pyuavcan_v0.driver import CANFrame
+from pyuavcan_v0.transport import Transfer, TransferManager, Frame
+
+from .frame_record import FLAG_EXTENDED, FLAG_TX
+
+logger = logging.getLogger(__name__)
+
+
+class CaptureReplay:
+    """
+    Feeds the frames of a capture into a live node as if they were coming from the bus:
+    the CAN IO hooks of the driver, the transfer hooks of the node and, optionally, the message handlers are invoked.
+    Services are never delivered to the handlers, so the local node never responds to the replayed requests.
+
+    The replay is driven by periodic calls to poll(). The speed is a multiplier of the recorded pace;
+    None means as fast as possible, limited only by the number of frames processed per poll.
+    If retime is enabled, the monotonic timestamps are shifted so that the replay appears to begin now,
+    which is what the live consumers expect; the real timestamps are always preserved.
+    """
+    DEFAULT_MAX_FRAMES_PER_POLL = 5000
+
+    def __init__(self, node, records, speed=1.0, retime=True, deliver_messages=True,
+                 max_frames_per_poll=DEFAULT_MAX_FRAMES_PER_POLL):
+        """
+        :param node:        The node whose hooks and handlers will receive the frames.
+        :param records:     Array of FRAME_RECORD_DTYPE, e.g. CaptureReader.records.
+        """
+        self._node = node
+        self._records = records
+        self._speed = speed
+        self._retime = retime
+        self._deliver_messages = deliver_messages
+        self._max_frames_per_poll = int(max_frames_per_poll)
+
+        self._transfer_managers = {'rx': TransferManager(), 'tx': TransferManager()}
+
+        self._position = 0
+        self._paused = True
+        self._anchor_ts = 0.0             # Capture time that corresponds to the anchor wall time
+        self._anchor_wall = 0.0
+        self._ts_offset = None if retime else 0.0
+
+        self.num_frames = 0
+        self.num_transfers = 0
+        self.num_errors = 0
+
+    def _reanchor(self):
+        self._anchor_wall = time.monotonic()
+        if self._position < len(self._records):
+            self._anchor_ts = float(self._records['ts_monotonic'][self._position])
+        if self._retime:
+            # The offset never decreases, so the replayed timestamps don't go backwards after a pause
+            offset = self._anchor_wall - self._anchor_ts
+            self._ts_offset = offset if self._ts_offset is None else max(self._ts_offset, offset)
+
+    def _get_end(self):
+        end = min(self._position + self._max_frames_per_poll, len(self._records))
+        if self._speed is None:
+            return end
+
+        target_ts = self._anchor_ts + (time.monotonic() - self._anchor_wall) * self._speed
+        ts = self._records['ts_monotonic'][self._position:end]
+        return self._position + int(numpy.searchsorted(ts, target_ts, side='right'))
+
+    # noinspection PyProtectedMember
+    def _dispatch_transfer(self, direction, frame):
+        transfer_frames = self._transfer_managers[direction].receive_frame(
+            Frame(frame.id, frame.data, frame.ts_monotonic, frame.ts_real))
+        if not transfer_frames:
+            return
+
+        transfer = Transfer()
+        transfer.from_frames(transfer_frames)
+        self.num_transfers += 1
+
+        self._node._transfer_hook_dispatcher.call_hooks(direction, transfer)
+        if direction == 'rx' and self._deliver_messages and not transfer.service_not_message:
+            self._node._handler_dispatcher.call_handlers(transfer)
+
+    # noinspection PyProtectedMember
+    def poll(self):
+        """Replays the frames that are due by now. Returns the number of replayed frames."""
+        if self._paused or self.finished:
+            return 0
+
+        begin, end = self._position, self._get_end()
+        if begin >= end:
+            return 0
+
+        chunk = self._records[begin:end]
+        driver = self._node.can_driver
+        ts_monotonic = chunk['ts_monotonic'] + self._ts_offset
+        for can_id, flags, dlc, data, ts_mono, ts_real in zip(chunk['can_id'].tolist(),
+                                                               chunk['flags'].tolist(),
+                                                               chunk['dlc'].tolist(),
+                                                               chunk['data'].tolist(),
+                                                               ts_monotonic.tolist(),
+                                                               chunk['ts_real'].tolist()):
+            extended = bool(flags & FLAG_EXTENDED)
+            direction = 'tx' if flags & FLAG_TX else 'rx'
+            frame = CANFrame(can_id, bytes(data[:dlc]), extended, ts_monotonic=ts_mono, ts_real=ts_real)
+
+            driver._call_io_hooks(direction, frame)
+            if extended and dlc > 0:
+                try:
+                    self._dispatch_transfer(direction, frame)
+                except (pyuavcan_v0.transport.TransferError, ValueError):
+                    self.num_errors += 1
+                    logger.debug('Could not reassemble a replayed transfer', exc_info=True)
+
+        self._position = end
+        self.num_frames += end - begin
+        return end - begin
+
+    def start(self):
+        if self._paused:
+            self._paused = False
+            self._reanchor()
+
+    def pause(self):
+        self._paused = True
+
+    def seek(self, position):
+        """Moves to the specified record number. Partially received transfers are discarded."""
+        self._position = max(0, min(int(position), len(self._records)))
+        for tm in self._transfer_managers.values():
+            tm.active_transfers.clear()
+            tm.active_transfer_timestamps.clear()
+        if not self._paused:
+            self._reanchor()
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, value):
+        self._speed = value
+        if not self._paused:
+            self._reanchor()
+
+    @property
+    def paused(self):
+        return self._paused
+
+    @property
+    def finished(self):
+        return self._position >= len(self._records)
+
+    @property
+    def position(self):
+        return self._position
+
+    def __len__(self):
+        return len(self._records)
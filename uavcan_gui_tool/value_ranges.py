@@ -0,0 +1,47 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+"""
+Lists of integer ranges, such as the CAN ID filters: comma separated items, each of which is a single value (100),
+an inclusive range (100-1FF) or a value with mask (00015500/00FFFF80). Shared by the bus monitor filters and
+the command-line tools, so that the syntax is the same everywhere.
+"""
+
+import numpy
+
+
+def parse_ranges(value, base, special=None):
+    """
+    Returns a list of ranges parsed from the text; the numbers are in the specified base.
+    The optional dict special maps lowercase keywords to ranges, e.g. {'anon': ('range', 0, 0)}.
+    Raises ValueError if the text is malformed.
+    """
+    out = []
+    for item in value.split(','):
+        if special and item.lower() in special:
+            out.append(special[item.lower()])
+        elif '-' in item:
+            low, high = item.split('-', 1)
+            out.append(('range', int(low, base), int(high, base)))
+        elif '/' in item:
+            val, mask = item.split('/', 1)
+            out.append(('mask', int(val, base), int(mask, base)))
+        else:
+            out.append(('range', int(item, base), int(item, base)))
+    return out
+
+
+def match_ranges(ranges, values):
+    """Accepts an array of integers, returns a boolean mask of the values that fall into any of the ranges."""
+    mask = numpy.zeros(len(values), dtype=numpy.bool_)
+    for kind, a, b in ranges:
+        if kind == 'range':
+            mask |= (values >= a) & (values <= b)
+        else:
+            mask |= (values & b) == (a & b)
+    return mask
@@ -6,6 +6,8 @@
 # Author: Pavel Kirienko <pavel.kirienko@zubax.com>
 #
 
+import bisect
+import itertools
 import os
 import queue
 import re
@@ -17,7 +19,9 @@ import qtawesome
 from PyQt5.QtCore import Qt, QTimer, QStringListModel
 from PyQt5.QtGui import QColor, QKeySequence, QFont, QFontInfo, QIcon
 from PyQt5.QtWidgets import QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView, QApplication, QWidget, \
-    QComboBox, QCompleter, QPushButton, QHBoxLayout, QVBoxLayout, QMessageBox
+    QComboBox, QCompleter, QPushButton, QHBoxLayout, QVBoxLayout, QMessageBox, QLabel
+
+from .search_index import TrigramIndex
 
 logger = getLogger(__name__)
 
@@ -56,6 +60,9 @@ class BasicTable(QTableWidget):
             self.searchable = searchable
             self.filterable = filterable if filterable is not None else self.searchable
 
+    SEARCH_INDEXING_BATCH = 2000
+    SEARCH_INDEXING_INTERVAL_MS = 100
+
     def __init__(self, parent, columns, multi_line_rows=False, font=None):
         super(BasicTable, self).__init__(parent)
 
@@ -63,6 +70,18 @@ class BasicTable(QTableWidget):
 
         self.filter = None
 
+        # The search index is built in the background once the first search is requested
+        self._search_index = None
+        self._num_indexed_rows = 0
+        self._search_cache = None
+
+        self._indexing_timer = QTimer(self)
+        self._indexing_timer.setSingleShot(False)
+        self._indexing_timer.timeout.connect(self._index_pending_rows)
+
+        self.model().rowsInserted.connect(self._on_rows_inserted)
+        self.model().rowsRemoved.connect(self._reset_search_index)
+
         self.on_enter_pressed = lambda list_of_row_col_pairs: None
 
         self.setShowGrid(False)
@@ -90,6 +109,35 @@ class BasicTable(QTableWidget):
         super(BasicTable, self).clear()
         self.setHorizontalHeaderLabels([x.name for x in self.columns])
         self.setRowCount(0)
+        self._reset_search_index()
+
+    def _reset_search_index(self):
+        self._search_cache = None
+        self._num_indexed_rows = 0
+        if self._search_index is not None:
+            self._search_index.clear()
+            self._schedule_indexing()
+
+    def _on_rows_inserted(self, _parent, first, _last):
+        self._search_cache = None
+        if first < self._num_indexed_rows:      # Existing rows have been shifted
+            self._reset_search_index()
+        else:
+            self._schedule_indexing()
+
+    def _schedule_indexing(self):
+        """The timer runs only while the search index exists and lags behind the table."""
+        if self._search_index is not None and self._num_indexed_rows < self.rowCount() and \
+                not self._indexing_timer.isActive():
+            self._indexing_timer.start(self.SEARCH_INDEXING_INTERVAL_MS)
+
+    def _index_pending_rows(self):
+        end = min(self.rowCount(), self._num_indexed_rows + self.SEARCH_INDEXING_BATCH)
+        for row in range(self._num_indexed_rows, end):
+            self._search_index.add(row, self.get_row_as_string(row, lambda c: c.searchable))
+        self._num_indexed_rows = end
+        if self._num_indexed_rows >= self.rowCount():
+            self._indexing_timer.stop()
 
     def get_row_as_string(self, row, column_predicate=None):
         first = True
@@ -126,6 +174,10 @@ class BasicTable(QTableWidget):
 
         self.setRowHidden(row, not self.apply_filter_to_row(row))
 
+        self._search_cache = None
+        if self._search_index is not None and row < self._num_indexed_rows:
+            self._search_index.add(row, self.get_row_as_string(row, lambda c: c.searchable))
+
     def keyPressEvent(self, qkeyevent):
         if qkeyevent.matches(QKeySequence.Copy):
             selected_rows = [x.row() for x in self.selectionModel().selectedRows()]
@@ -144,42 +196,61 @@ class BasicTable(QTableWidget):
             if self.hasFocus():
                 self.on_enter_pressed([(x.row(), x.column()) for x in self.selectedIndexes()])
 
+    def find_matches(self, matcher):
+        """
+        Returns the sorted list of the visible rows that match the SearchMatcher.
+        Only the candidates returned by the search index are checked; the rows that are not indexed yet are scanned.
+        The result is cached until the table is modified.
+        """
+        key = matcher.pattern, matcher.use_regex, matcher.case_sensitive, matcher.inverse
+        if self._search_cache is not None and self._search_cache[0] == key:
+            return self._search_cache[1]
+
+        if self._search_index is None:
+            self._search_index = TrigramIndex()
+            self._index_pending_rows()
+            self._schedule_indexing()
+
+        candidates = self._search_index.lookup(matcher)
+        if candidates is None:
+            rows = range(self.rowCount())
+        else:
+            rows = itertools.chain(candidates.tolist(), range(self._num_indexed_rows, self.rowCount()))
+
+        matches = [row for row in rows
+                   if not self.isRowHidden(row) and matcher.match(self.get_row_as_string(row, lambda c: c.searchable))]
+        self._search_cache = key, matches
+        return matches
+
     def search(self, direction, matcher):
-        if self.rowCount() == 0:
+        matches = self.find_matches(matcher)
+        if not matches:
             return
 
         # Determining the start location
         selected_rows = [x.row() for x in self.selectionModel().selectedRows()]
         if selected_rows:
             # If at least one row is selected, search from there
-            search_from_row = selected_rows[-1] if direction == 'up' else selected_rows[0]
+            search_from_row = min(selected_rows) if direction == 'up' else max(selected_rows)
         else:
             # If nothing is selected, search from beginning
-            search_from_row = (self.rowCount() - 1) if direction == 'up' else 0
+            search_from_row = self.rowCount() if direction == 'up' else -1
 
-        search_from_row = max(0, search_from_row)
         logger.debug('Table search from %r, %r', search_from_row, direction)
 
-        self.clearSelection()
+        if direction == 'up':
+            row = matches[bisect.bisect_left(matches, search_from_row) - 1]     # Wraps around to the last match
+        else:
+            row = matches[bisect.bisect_right(matches, search_from_row) % len(matches)]
 
-        # Searching
-        current_row = search_from_row + (-1 if direction == 'up' else 1)
-        while current_row != search_from_row:
-            if not self.isRowHidden(current_row):
-                text = self.get_row_as_string(current_row, lambda c: c.searchable)
-                if matcher.match(text):
-                    self.selectRow(current_row)
-                    self.scrollTo(self.model().index(current_row, 0))
-                    return current_row
-
-            current_row += -1 if direction == 'up' else 1
-            if current_row >= self.rowCount():
-                current_row = 0
-            if current_row < 0:
-                current_row = self.rowCount() - 1
+        self.clearSelection()
+        self.selectRow(row)
+        self.scrollTo(self.model().index(row, 0))
+        return row
 
     def set_filter(self, matcher):
         self.filter = matcher
+        self._search_cache = None
         self.setUpdatesEnabled(False)
 
         for row in range(self.rowCount()):
@@ -188,6 +259,17 @@ class BasicTable(QTableWidget):
         self.setUpdatesEnabled(True)
 
 
+class NumericTableItem(QTableWidgetItem):
+    """Right-aligned table item that is sorted by its numeric value rather than by the formatted text."""
+    def __init__(self, value, fmt):
+        super(NumericTableItem, self).__init__(fmt % value)
+        self.value = value
+        self.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+
+    def __lt__(self, other):
+        return self.value < other.value
+
+
 class CommitableComboBoxWithHistory(QComboBox):
     def __init__(self, parent):
         super(CommitableComboBoxWithHistory, self).__init__(parent)
@@ -297,10 +379,17 @@ class SearchBar(QWidget):
         self._button_search_up = make_icon_button('caret-up', 'Search up', self,
                                                   on_clicked=partial(self._do_search, 'up'))
 
+        self._match_count = QLabel(self)
+        self._match_count.setToolTip('Number of matches')
+
         self.on_search = lambda *_: None
 
+        # Optional; accepts a SearchMatcher and returns the total number of matches
+        self.on_count = None
+
         layout = QHBoxLayout(self)
         layout.addWidget(self._bar, 1)
+        layout.addWidget(self._match_count)
         layout.addWidget(self._button_search_down)
         layout.addWidget(self._button_search_up)
         layout.addWidget(self._use_regex)
@@ -333,7 +422,10 @@ class SearchBar(QWidget):
         matcher = SearchMatcher(text, self._use_regex.isChecked(), self._case_sensitive.isChecked())
         try:
             result = self.on_search(direction, matcher)
+            if self.on_count is not None:
+                self._match_count.setText('%d matches' % self.on_count(matcher))
         except SearchMatcher.BadPatternException as ex:
+            self._match_count.clear()
             flash(self, 'Invalid search pattern: %s', ex, duration=10)
         else:
             if result is None:
@@ -342,7 +434,7 @@ class SearchBar(QWidget):
 
 class FilterBar(QWidget):
     class Filter(QWidget):
-        def __init__(self, parent, pattern_completion_model):
+        def __init__(self, parent, pattern_completion_model, pattern_tool_tip=None):
             super(FilterBar.Filter, self).__init__(parent)
 
             self.on_commit = lambda: None
@@ -353,6 +445,8 @@ class FilterBar(QWidget):
 
             self._bar = SearchBarComboBox(self, pattern_completion_model)
             self._bar.on_commit = self._on_commit
+            if pattern_tool_tip:
+                self._bar.setToolTip(pattern_tool_tip)
             self._bar.setFocus(Qt.OtherFocusReason)
 
             self._apply_button = make_icon_button('check', 'Apply this filter expression [Enter]', self,
@@ -393,9 +487,11 @@ class FilterBar(QWidget):
                                     inverse=self._inverse_button.isChecked())
             return matcher
 
-    def __init__(self, parent):
+    def __init__(self, parent, pattern_tool_tip=None):
         super(FilterBar, self).__init__(parent)
 
+        self._pattern_tool_tip = pattern_tool_tip
+
         self.add_filter_button = make_icon_button('filter', 'Add filter', self, on_clicked=self._on_add_filter)
 
         self.on_filter = lambda *_: None
@@ -423,7 +519,7 @@ class FilterBar(QWidget):
             self.on_filter(None)
 
     def _on_add_filter(self):
-        new_filter = self.Filter(self, self._pattern_completion_model)
+        new_filter = self.Filter(self, self._pattern_completion_model, self._pattern_tool_tip)
         new_filter.on_remove = self._on_remove_filter
         new_filter.on_commit = self._do_filter
 
@@ -477,6 +573,7 @@ class RealtimeLogWidget(QWidget):
 
         self._search_bar = SearchBar(self)
         self._search_bar.on_search = self._search
+        self._search_bar.on_count = lambda matcher: len(self._table.find_matches(matcher))
 
         self._filter_bar = FilterBar(self)
         self._filter_bar.on_filter = self._table.set_filter
@@ -521,7 +618,7 @@ class RealtimeLogWidget(QWidget):
 
     def _search(self, *args, **kwargs):
         self._pause.setChecked(True)
-        self._table.search(*args, **kwargs)
+        return self._table.search(*args, **kwargs)
 
     def _clear(self):
         self._table.setRowCount(0)
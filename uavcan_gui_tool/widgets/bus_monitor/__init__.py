@@ -9,13 +9,15 @@
 import logging
 import multiprocessing
 import os
-import queue
 import sys
 
+import numpy
 from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication
 
 from .window import BusMonitorWindow
+from ...frame_record import FRAME_RECORD_DTYPE, pack_frame, unpack_records
+from ... import ipc
 
 logger = logging.getLogger(__name__)
 
@@ -28,33 +30,21 @@ except AttributeError:
     PARENT_PID = os.getppid()
 
 
-class IPCChannel:
+class IPCChannel(ipc.IPCChannel):
     """
-    This class is built as an abstraction over the underlying IPC communication channel.
+    Frames are sent as packed FRAME_RECORD byte strings; the receiver gets them as FRAME_RECORD_DTYPE arrays.
     """
-    def __init__(self):
-        # Queue is slower than pipe, but it allows to implement non-blocking sending easier,
-        # and the buffer can be arbitrarily large.
-        self._q = multiprocessing.Queue()
+    def encode_batch(self, items):
+        return b''.join(items)
 
-    def send_nonblocking(self, obj):
-        try:
-            self._q.put_nowait(obj)
-        except queue.Full:
-            pass
-
-    def receive_nonblocking(self):
-        """Returns: (True, object) if successful, (False, None) if no data to read """
-        try:
-            return True, self._q.get_nowait()
-        except queue.Empty:
-            return False, None
+    def decode_batch(self, data):
+        return unpack_records(data)
 
 
 IPC_COMMAND_STOP = 'stop'
 
 
-def _process_entry_point(channel, iface_name):
+def _process_entry_point(channel, iface_name, bitrate):
     logger.info('Bus monitor process started with PID %r', os.getpid())
     app = QApplication(sys.argv)  # Inheriting args from the parent process
 
@@ -69,16 +59,17 @@ def _process_entry_point(channel, iface_name):
     exit_check_timer.timeout.connect(exit_if_should)
     exit_check_timer.start(2000)
 
-    def get_frame():
-        received, obj = channel.receive_nonblocking()
-        if received:
-            if obj == IPC_COMMAND_STOP:
-                logger.info('Bus monitor process has received a stop request, goodbye')
-                app.exit(0)
-            else:
-                return obj
+    def get_frames():
+        if channel.receive_command() == IPC_COMMAND_STOP:
+            logger.info('Bus monitor process has received a stop request, goodbye')
+            app.exit(0)
+
+        batches = channel.receive_batches()
+        if not batches:
+            return numpy.empty(0, dtype=FRAME_RECORD_DTYPE)
+        return numpy.concatenate(batches)
 
-    win = BusMonitorWindow(get_frame, iface_name)
+    win = BusMonitorWindow(get_frames, iface_name, channel.get_stats, bitrate=bitrate)
     win.show()
 
     logger.info('Bus monitor process %r initialized successfully, now starting the event loop', os.getpid())
@@ -87,22 +78,33 @@ def _process_entry_point(channel, iface_name):
 
 # TODO: Duplicates PlotterManager; refactor into an abstract process factory
 class BusMonitorManager:
-    def __init__(self, node, can_iface_name):
+    FLUSH_INTERVAL_MS = 10
+
+    def __init__(self, node, can_iface_name, bitrate=None):
         self._node = node
         self._can_iface_name = can_iface_name
+        self._bitrate = bitrate
         self._inferiors = []  # process object, channel
         self._hook_handle = None
+        self._flush_timer = None
 
     def _frame_hook(self, direction, frame):
+        record = pack_frame(direction, frame)
+        for _, channel in self._inferiors:
+            channel.send_nonblocking(record)
+
+    def _flush(self):
         for proc, channel in self._inferiors[:]:
             if proc.is_alive():
                 try:
-                    channel.send_nonblocking((direction, frame))
+                    channel.flush()
                 except Exception:
                     logger.error('Failed to send data to process %r', proc, exc_info=True)
             else:
-                logger.info('Bus monitor process %r appears to be dead, removing', proc)
+                logger.info('Bus monitor process %r appears to be dead, removing; IPC statistics: %r',
+                            proc, channel.get_stats())
                 self._inferiors.remove((proc, channel))
+                channel.close()
 
     def spawn_monitor(self):
         channel = IPCChannel()
@@ -110,8 +112,14 @@ class BusMonitorManager:
         if self._hook_handle is None:
             self._hook_handle = self._node.can_driver.add_io_hook(self._frame_hook)
 
+        if self._flush_timer is None:
+            self._flush_timer = QTimer()
+            self._flush_timer.setSingleShot(False)
+            self._flush_timer.timeout.connect(self._flush)
+            self._flush_timer.start(self.FLUSH_INTERVAL_MS)
+
         proc = multiprocessing.Process(target=_process_entry_point, name='bus_monitor',
-                                       args=(channel, self._can_iface_name))
+                                       args=(channel, self._can_iface_name, self._bitrate))
         proc.daemon = True
         proc.start()
 
@@ -119,15 +127,24 @@ class BusMonitorManager:
 
         logger.info('Spawned new bus monitor process %r', proc)
 
+    def get_ipc_stats(self):
+        """Returns a list of tuples (window name, PID, IPCChannelStats) for every live window."""
+        return [('Bus monitor', proc.pid, channel.get_stats()) for proc, channel in self._inferiors if proc.is_alive()]
+
     def close(self):
         try:
             self._hook_handle.remove()
         except Exception:
             pass
 
+        try:
+            self._flush_timer.stop()
+        except Exception:
+            pass
+
         for _, channel in self._inferiors:
             try:
-                channel.send_nonblocking(IPC_COMMAND_STOP)
+                channel.send_command(IPC_COMMAND_STOP)
             except Exception:
                 pass
 
@@ -137,8 +154,9 @@ class BusMonitorManager:
             except Exception:
                 pass
 
-        for proc, _ in self._inferiors:
+        for proc, channel in self._inferiors:
             try:
                 proc.terminate()
             except Exception:
                 pass
+            channel.close()
@@ -0,0 +1,130 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+from collections import namedtuple
+
+import numpy
+import pyuavcan_v0
+from PyQt5.QtGui import QColor
+
+from .. import map_7bit_to_color
+
+
+CANIDInfo = namedtuple('CANIDInfo', [
+    'text',                     # CAN ID formatted for display
+    'priority',
+    'service_not_message',
+    'src',                      # Node ID, 'Anon' or 'N/A'
+    'dst',                      # Node ID, '' for messages or 'N/A'
+    'data_type',                # Full data type name
+    'can_id_color',
+    'src_color',
+    'dst_color',
+    'data_type_color',
+])
+
+_MAX_CACHE_SIZE = 100000
+
+_cache = {}                     # (CAN ID, extended) : CANIDInfo
+
+
+def _colorize_priority(priority):
+    mask = 0b11111
+    col = QColor()
+    col.setRgb(0xFF, 0xFF - (mask - priority) * 6, 0xFF)
+    return col
+
+
+def _colorize_node_id(node_id):
+    return map_7bit_to_color(node_id) if isinstance(node_id, int) else None
+
+
+def _colorize_data_type(data_type_name):
+    color_hash = sum(data_type_name.encode('ascii')) & 0xF7
+    return map_7bit_to_color(color_hash)
+
+
+def _parse(can_id, extended):
+    if not extended:
+        return CANIDInfo(text=('%03X' % can_id).rjust(8), priority=None, service_not_message=False,
+                         src='N/A', dst='N/A', data_type='N/A',
+                         can_id_color=None, src_color=None, dst_color=None,
+                         data_type_color=_colorize_data_type('N/A'))
+
+    priority = (can_id >> 24) & 0x1F
+    source_node_id = can_id & 0x7F
+
+    service_not_message = bool((can_id >> 7) & 1)
+    if service_not_message:
+        destination_node_id = (can_id >> 8) & 0x7F
+        service_type_id = (can_id >> 16) & 0xFF
+        try:
+            data_type_name = pyuavcan_v0.DATATYPES[
+                (service_type_id, pyuavcan_v0.dsdl.CompoundType.KIND_SERVICE)].full_name
+        except KeyError:
+            data_type_name = '<unknown service %d>' % service_type_id
+    else:
+        message_type_id = (can_id >> 8) & 0xFFFF
+        if source_node_id == 0:
+            source_node_id = 'Anon'
+            message_type_id &= 0b11
+        destination_node_id = ''
+        try:
+            data_type_name = pyuavcan_v0.DATATYPES[
+                (message_type_id, pyuavcan_v0.dsdl.CompoundType.KIND_MESSAGE)].full_name
+        except KeyError:
+            data_type_name = '<unknown message %d>' % message_type_id
+
+    return CANIDInfo(text='%08X' % can_id,
+                     priority=priority,
+                     service_not_message=service_not_message,
+                     src=source_node_id,
+                     dst=destination_node_id,
+                     data_type=data_type_name,
+                     can_id_color=_colorize_priority(priority),
+                     src_color=_colorize_node_id(source_node_id),
+                     dst_color=_colorize_node_id(destination_node_id),
+                     data_type_color=_colorize_data_type(data_type_name))
+
+
+def decode_can_id(can_id, extended=True):
+    """
+    Returns a CANIDInfo describing the CAN ID. The results are cached, since a bus normally carries only a few
+    hundred distinct CAN IDs. The returned objects are shared, they must not be modified.
+    """
+    key = can_id, extended
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+
+    if len(_cache) >= _MAX_CACHE_SIZE:
+        _cache.clear()
+
+    info = _parse(can_id, extended)
+    _cache[key] = info
+    return info
+
+
+def split_can_ids(can_ids):
+    """
+    Vectorised counterpart of decode_can_id() for an array of extended CAN IDs. Returns a tuple of int64 arrays
+    (priority, data type key, source node ID), where the data type key is the data type ID with bit 16 set
+    for services; the type IDs of anonymous messages are truncated to 2 bits.
+    """
+    can_ids = numpy.asarray(can_ids, dtype=numpy.int64)
+    src = can_ids & 0x7F
+    service_not_message = (can_ids >> 7) & 1
+    type_id = numpy.where(service_not_message, (can_ids >> 16) & 0xFF,
+                          numpy.where(src == 0, (can_ids >> 8) & 0b11, (can_ids >> 8) & 0xFFFF))
+    return (can_ids >> 24) & 0x1F, (service_not_message << 16) | type_id, src
+
+
+def invalidate_can_id_cache():
+    """Must be invoked when the set of known data types changes, e.g. after custom DSDL definitions are loaded."""
+    _cache.clear()
@@ -0,0 +1,246 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import re
+
+import numpy
+from pyuavcan_v0.driver import CANFrame
+
+from .can_id import decode_can_id
+from .. import SearchMatcher
+from ...frame_record import FLAG_EXTENDED, FLAG_TX
+from ...value_ranges import parse_ranges, match_ranges
+
+FILTER_SYNTAX_HELP = '''Filter expression: either plain text, which is matched against the rendered rows, or
+whitespace-separated predicates that must all hold, which is much faster on large captures:
+  id=1E01550A  id=100-1FF  id=00015500/00FFFF80  (hex; value, inclusive range, value/mask; comma separated list)
+  src=10  src=10-20,42  src=anon  dst=125  (decimal node IDs; messages have no destination)
+  type=NodeStatus  (data type name, substring or regular expression as configured)
+  dir=rx  dir=tx
+  data=05??00  data@6=C1  data~4142  (hex payload bytes, ?? matches any byte; = matches at the offset, ~ anywhere)
+Use != instead of = to negate a predicate.'''
+
+_TERM_REGEX = re.compile(r'^(id|src|dst|type|dir|data)(?:@(\d+))?(!=|=|~)(.+)$', re.IGNORECASE)
+
+
+class _Predicate:
+    def __init__(self, key, offset, operator, value, use_regex, case_sensitive):
+        self.key = key
+        self.negate = operator == '!='
+        self.anywhere = operator == '~'
+        self.offset = int(offset or 0)
+        if self.anywhere and key != 'data':
+            raise ValueError('Operator ~ is only applicable to data')
+        if offset is not None and key != 'data':
+            raise ValueError('Offset is only applicable to data')
+        self._parse = getattr(self, '_parse_' + key)
+        self._evaluate = getattr(self, '_evaluate_' + key)
+        self._parse(value, use_regex, case_sensitive)
+
+    def _parse_id(self, value, *_):
+        self._ranges = parse_ranges(value, 16)
+
+    def _evaluate_id(self, columns):
+        return match_ranges(self._ranges, columns['can_id'])
+
+    def _parse_src(self, value, *_):
+        self._ranges = parse_ranges(value, 10, {'anon': ('range', 0, 0)})
+
+    def _evaluate_src(self, columns):
+        return match_ranges(self._ranges, columns['can_id'] & 0x7F) & columns['extended']
+
+    def _parse_dst(self, value, *_):
+        self._ranges = parse_ranges(value, 10)
+
+    def _evaluate_dst(self, columns):
+        can_id = columns['can_id']
+        is_service = (can_id & 0x80) != 0
+        return match_ranges(self._ranges, (can_id >> 8) & 0x7F) & is_service & columns['extended']
+
+    def _parse_type(self, value, use_regex, case_sensitive):
+        self._matcher = SearchMatcher(value, use_regex=use_regex, case_sensitive=case_sensitive)
+        self._matcher.match('')                         # Validating the pattern early
+
+    def _evaluate_type(self, columns):
+        # The data type is a function of the CAN ID, so every distinct ID needs to be checked only once
+        keys = columns['can_id'].astype(numpy.int64) | (columns['extended'].astype(numpy.int64) << 32)
+        unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+        unique_mask = numpy.fromiter((self._matcher.match(decode_can_id(int(k) & 0xFFFFFFFF, bool(k >> 32)).data_type)
+                                      for k in unique_keys.tolist()), dtype=numpy.bool_, count=len(unique_keys))
+        return unique_mask[inverse.reshape(-1)]
+
+    def _parse_dir(self, value, *_):
+        value = value.lower()
+        if value not in ('rx', 'tx'):
+            raise ValueError('Direction must be either rx or tx')
+        self._tx = value == 'tx'
+
+    def _evaluate_dir(self, columns):
+        return columns['is_tx'] == self._tx
+
+    def _parse_data(self, value, *_):
+        value = re.sub(r'[\s:.]', '', value)
+        if len(value) % 2 != 0:
+            raise ValueError('Payload pattern must consist of whole bytes')
+        pattern = [value[i:i + 2] for i in range(0, len(value), 2)]
+        self._wildcards = numpy.array([x == '??' for x in pattern], dtype=numpy.bool_)
+        self._pattern = numpy.array([0 if x == '??' else int(x, 16) for x in pattern], dtype=numpy.uint8)
+        if len(self._pattern) + self.offset > CANFrame.MAX_DATA_LENGTH:
+            raise ValueError('Payload pattern does not fit into a CAN frame')
+
+    def _evaluate_data(self, columns):
+        data, dlc = columns['data'], columns['dlc']
+        size = len(self._pattern)
+        offsets = range(CANFrame.MAX_DATA_LENGTH - size + 1) if self.anywhere else [self.offset]
+        mask = numpy.zeros(len(dlc), dtype=numpy.bool_)
+        for offset in offsets:
+            match = dlc >= offset + size
+            for i in numpy.flatnonzero(~self._wildcards).tolist():
+                match &= data[:, offset + i] == self._pattern[i]
+            mask |= match
+        return mask
+
+    def evaluate(self, columns):
+        mask = self._evaluate(columns)
+        return ~mask if self.negate else mask
+
+
+class StructuredFilter:
+    """Conjunction of predicates over the frame columns, evaluated as NumPy masks."""
+
+    def __init__(self, predicates, inverse):
+        self._predicates = predicates
+        self._inverse = inverse
+
+    @staticmethod
+    def parse(matcher):
+        """
+        Returns a StructuredFilter if the pattern of the SearchMatcher is a structured expression, otherwise None.
+        Raises SearchMatcher.BadPatternException if the expression is structured but malformed.
+        """
+        terms = matcher.pattern.split()
+        parsed = [_TERM_REGEX.match(t) for t in terms]
+        if not terms or not all(parsed):
+            return None
+
+        predicates = []
+        for term, m in zip(terms, parsed):
+            key, offset, operator, value = m.groups()
+            try:
+                predicates.append(_Predicate(key.lower(), offset, operator, value,
+                                             matcher.use_regex, matcher.case_sensitive))
+            except Exception as ex:
+                raise SearchMatcher.BadPatternException('%s: %s' % (term, ex))
+        return StructuredFilter(predicates, matcher.inverse)
+
+    def evaluate(self, columns):
+        mask = numpy.ones(len(columns), dtype=numpy.bool_)
+        for p in self._predicates:
+            mask &= p.evaluate(columns)
+        return ~mask if self._inverse else mask
+
+
+class FilterColumns:
+    """
+    Columns of a range of frames in the form accepted by StructuredFilter.evaluate().
+    Each column is gathered from the store only when a predicate needs it.
+    """
+
+    def __init__(self, store, begin, end):
+        self._store = store
+        self._slots = store.slots(begin, end)
+        self._cache = {}
+
+    def _get(self, name):
+        store, slots = self._store, self._slots
+        if name == 'can_id':
+            return store.can_id[slots].astype(numpy.int64)
+        if name == 'extended':
+            return store.extended[slots] != 0
+        if name == 'dlc':
+            return store.dlc[slots]
+        if name == 'data':
+            return store.data[slots]
+        if name == 'is_tx':
+            return store.direction[slots] != 0
+        raise KeyError(name)
+
+    def __getitem__(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            column = self._get(name)
+            self._cache[name] = column
+            return column
+
+    def __len__(self):
+        return len(self._slots)
+
+
+class RecordColumns:
+    """Columns of an array of FRAME_RECORD_DTYPE in the form accepted by StructuredFilter.evaluate()."""
+
+    def __init__(self, records):
+        self._records = records
+
+    def __getitem__(self, name):
+        records = self._records
+        if name == 'can_id':
+            return records['can_id'].astype(numpy.int64)
+        if name == 'extended':
+            return (records['flags'] & FLAG_EXTENDED) != 0
+        if name == 'dlc':
+            return records['dlc']
+        if name == 'data':
+            return records['data']
+        if name == 'is_tx':
+            return (records['flags'] & FLAG_TX) != 0
+        raise KeyError(name)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class FrameFilter:
+    """
+    Applies a chain of filter expressions to a FrameStore. Structured expressions are evaluated as NumPy masks over
+    the whole range at once; plain text expressions fall back to matching the rendered rows that are still left.
+    """
+
+    def __init__(self, chain):
+        self._structured = []
+        self._text = []
+        for m in chain.matchers:
+            f = StructuredFilter.parse(m)
+            if f is None:
+                m.match('')                             # Validating the pattern early
+                self._text.append(m)
+            else:
+                self._structured.append(f)
+
+    def apply(self, store, begin, end, render_row):
+        """
+        Returns the array of sequence numbers in the range [begin, end) that pass the filter.
+        render_row(seq) must return the text representation of the frame for plain text matching.
+        """
+        begin = max(begin, store.begin)
+        end = max(begin, min(end, store.end))
+
+        seqs = numpy.arange(begin, end, dtype=numpy.int64)
+        if self._structured and len(seqs):
+            columns = FilterColumns(store, begin, end)
+            mask = numpy.ones(len(seqs), dtype=numpy.bool_)
+            for f in self._structured:
+                mask &= f.evaluate(columns)
+            seqs = seqs[mask]
+
+        if self._text:
+            out = [seq for seq in seqs.tolist() if all(m.match(render_row(seq)) for m in self._text)]
+            seqs = numpy.array(out, dtype=numpy.int64)
+
+        return seqs
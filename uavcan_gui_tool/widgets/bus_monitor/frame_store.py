@@ -0,0 +1,202 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import numpy
+from pyuavcan_v0.driver import CANFrame
+
+from ...frame_record import FLAG_EXTENDED, FLAG_TX
+
+
+class FrameStore:
+    """
+    Preallocated columnar storage for captured CAN frames.
+    Every frame is addressed by its sequence number, which grows monotonically starting from zero and is never reused.
+    Once the capacity is exhausted, every new frame evicts the oldest one; evicted sequence numbers become invalid.
+    """
+    DEFAULT_CAPACITY = 1000000
+
+    DIRECTIONS = 'rx', 'tx'     # Direction column stores indexes into this tuple
+
+    read_only = False
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._capacity = 0
+        self._begin = 0
+        self._end = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        capacity = int(capacity)
+        if capacity < 1:
+            raise ValueError('Invalid capacity: %r' % capacity)
+        self._capacity = capacity
+        self.ts_monotonic = numpy.zeros(capacity, dtype=numpy.float64)
+        self.ts_real = numpy.zeros(capacity, dtype=numpy.float64)
+        self.can_id = numpy.zeros(capacity, dtype=numpy.uint32)
+        self.extended = numpy.zeros(capacity, dtype=numpy.bool_)
+        self.dlc = numpy.zeros(capacity, dtype=numpy.uint8)
+        self.data = numpy.zeros((capacity, CANFrame.MAX_DATA_LENGTH), dtype=numpy.uint8)
+        self.direction = numpy.zeros(capacity, dtype=numpy.uint8)
+
+    def _columns(self):
+        return self.ts_monotonic, self.ts_real, self.can_id, self.extended, self.dlc, self.data, self.direction
+
+    def _write(self, first_seq, columns):
+        """Writes the columns into the storage starting from the specified sequence number, wrapping around."""
+        num = len(columns[0])
+        start = first_seq % self._capacity
+        head = min(num, self._capacity - start)
+        for dest, src in zip(self._columns(), columns):
+            dest[start:start + head] = src[:head]
+            if head < num:
+                dest[:num - head] = src[head:]
+
+    def _append_columns(self, columns):
+        num = len(columns[0])
+        if num == 0:
+            return self._end
+
+        if num > self._capacity:                    # Only the newest frames would survive anyway
+            self._end += num - self._capacity
+            columns = [c[num - self._capacity:] for c in columns]
+            num = self._capacity
+
+        first_seq = self._end
+        self._write(first_seq, columns)
+        self._end += num
+        self._begin = max(self._begin, self._end - self._capacity)
+        return first_seq
+
+    def extend(self, records):
+        """
+        Appends an array of FRAME_RECORD_DTYPE, evicting the oldest frames if necessary.
+        Returns the sequence number of the first appended frame.
+        """
+        columns = [
+            records['ts_monotonic'],
+            records['ts_real'],
+            records['can_id'],
+            (records['flags'] & FLAG_EXTENDED) != 0,
+            records['dlc'],
+            records['data'],
+            (records['flags'] & FLAG_TX) != 0,
+        ]
+        return self._append_columns(columns)
+
+    def clear(self):
+        """Drops all frames. Sequence numbers are not reset."""
+        self._begin = self._end
+
+    def set_capacity(self, capacity):
+        """Reallocates the storage, keeping as many of the newest frames as the new capacity permits."""
+        capacity = int(capacity)
+        if capacity == self._capacity:
+            return
+        keep = min(len(self), capacity)
+        first_seq = self._end - keep
+        columns = [c[self.slots(first_seq, self._end)] for c in self._columns()]
+        self._allocate(capacity)
+        self._write(first_seq, columns)
+        self._begin = first_seq
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def begin(self):
+        """Sequence number of the oldest frame in the store."""
+        return self._begin
+
+    @property
+    def end(self):
+        """Sequence number that will be assigned to the next frame."""
+        return self._end
+
+    def __len__(self):
+        return self._end - self._begin
+
+    def __contains__(self, seq):
+        return self._begin <= seq < self._end
+
+    def slot(self, seq):
+        if seq not in self:
+            raise IndexError('Frame %r is not in the store [%r, %r)' % (seq, self._begin, self._end))
+        return seq % self._capacity
+
+    def slots(self, begin, end):
+        """Returns an array of storage indexes for the specified range of sequence numbers, oldest first."""
+        begin = max(begin, self._begin)
+        end = max(begin, min(end, self._end))
+        return numpy.arange(begin, end, dtype=numpy.int64) % self._capacity
+
+    def get_data(self, seq):
+        slot = self.slot(seq)
+        return bytes(self.data[slot, :self.dlc[slot]])
+
+    def get_direction(self, seq):
+        return self.DIRECTIONS[self.direction[self.slot(seq)]]
+
+    def get_frame(self, seq):
+        """Returns (direction, CANFrame) for the specified sequence number; raises IndexError if it was evicted."""
+        slot = self.slot(seq)
+        frame = CANFrame(int(self.can_id[slot]),
+                         bytes(self.data[slot, :self.dlc[slot]]),
+                         bool(self.extended[slot]),
+                         ts_monotonic=float(self.ts_monotonic[slot]),
+                         ts_real=float(self.ts_real[slot]))
+        return self.DIRECTIONS[self.direction[slot]], frame
+
+
+class _FlagColumn:
+    """Read-only column that is derived from the flags field on access, so that nothing has to be precomputed."""
+
+    def __init__(self, flags, mask):
+        self._flags = flags
+        self._mask = mask
+
+    def __getitem__(self, item):
+        return ((self._flags[item] & self._mask) != 0).astype(numpy.uint8)
+
+    def __len__(self):
+        return len(self._flags)
+
+
+class CaptureFrameStore(FrameStore):
+    """
+    Read-only FrameStore over an array of FRAME_RECORD_DTYPE, typically a memory-mapped capture file.
+    The columns are views of the underlying records; the sequence number of a frame is its index in the capture.
+    """
+    read_only = True
+
+    def __init__(self, records):
+        # noinspection PyMissingConstructor
+        self._records = records
+        self._capacity = max(1, len(records))
+        self._begin = 0
+        self._end = len(records)
+        self.ts_monotonic = records['ts_monotonic']
+        self.ts_real = records['ts_real']
+        self.can_id = records['can_id']
+        self.extended = _FlagColumn(records['flags'], FLAG_EXTENDED)
+        self.dlc = records['dlc']
+        self.data = records['data']
+        self.direction = _FlagColumn(records['flags'], FLAG_TX)
+
+    def extend(self, records):
+        raise TypeError('Capture store is read-only')
+
+    def clear(self):
+        raise TypeError('Capture store is read-only')
+
+    def set_capacity(self, capacity):
+        raise TypeError('Capture store is read-only')
+
+    @property
+    def records(self):
+        return self._records
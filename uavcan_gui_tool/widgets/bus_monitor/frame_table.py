@@ -0,0 +1,511 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import os
+from logging import getLogger
+
+import numpy
+from PyQt5.QtCore import Qt, QTimer, QAbstractTableModel, QModelIndex, QItemSelectionModel
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import QTableView, QAbstractItemView, QHeaderView, QApplication, QWidget, QHBoxLayout, \
+    QVBoxLayout, QSpinBox, QLabel
+
+from .frame_filter import FrameFilter, FILTER_SYNTAX_HELP
+from .frame_store import FrameStore
+from .. import get_icon, make_icon_button, SearchBar, FilterBar, LabelWithIcon, BasicTable
+
+logger = getLogger(__name__)
+
+
+class FrameColumn(BasicTable.Column):
+    """
+    Column of FrameTableModel. The optional match function accepts (store, slots, matcher) and returns a boolean mask
+    of the frames whose rendered cells match the SearchMatcher; it allows to search without rendering every row.
+    """
+
+    def __init__(self, name, renderer, match=None, **kwargs):
+        super(FrameColumn, self).__init__(name, renderer, **kwargs)
+        self.match = match
+
+
+class FrameTableModel(QAbstractTableModel):
+    """
+    Exposes the frames kept in a FrameStore to Qt views.
+    Nothing is rendered until the view asks for it, so the cost of a redraw depends only on the number of visible rows.
+    The model follows the store lazily: call sync() to pick up new frames and drop the evicted ones.
+    """
+    ROW_CACHE_SIZE = 1000
+
+    def __init__(self, parent, store, columns):
+        super(FrameTableModel, self).__init__(parent)
+        self._store = store
+        self._columns = columns
+
+        # Range of sequence numbers that the model has seen so far
+        self._begin = store.begin
+        self._end = store.begin
+
+        # Sorted array of sequence numbers of the displayed rows; None means that every frame is displayed
+        self._row_seqs = None
+        self._filter = None
+
+        # Sorted sequence numbers of the frames that match the last search query, extended as new frames arrive
+        self._search_key = None
+        self._search_seqs = numpy.empty(0, dtype=numpy.int64)
+        self._search_end = 0
+
+        self._row_cache = {}
+        self._mark_icon = get_icon('circle')
+        self.marked = set()
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._row_seqs is not None:
+            return len(self._row_seqs)
+        return self._end - self._begin
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self._columns[section].name
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        seq = self.seq_at(index.row())
+
+        if role == Qt.DecorationRole:
+            if index.column() == 0 and seq in self.marked:
+                return self._mark_icon
+            return None
+
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignVCenter | Qt.AlignLeft
+
+        if role in (Qt.DisplayRole, Qt.BackgroundRole):
+            cells = self._render_row(seq)
+            if cells is None:
+                return None
+            text, color = cells[index.column()]
+            return text if role == Qt.DisplayRole else color
+
+    def _render_cell(self, column, seq):
+        value = column.render(self._store, seq)
+        if isinstance(value, tuple):
+            value, color = value
+        else:
+            color = None
+        return str(value), color
+
+    def _render_row(self, seq):
+        try:
+            return self._row_cache[seq]
+        except KeyError:
+            pass
+
+        if seq not in self._store:
+            return None
+
+        if len(self._row_cache) >= self.ROW_CACHE_SIZE:
+            self._row_cache.clear()
+
+        cells = [self._render_cell(c, seq) for c in self._columns]
+        self._row_cache[seq] = cells
+        return cells
+
+    def invalidate_rendering(self):
+        """Must be invoked when the output of the renderers changes, e.g. when new data types become known."""
+        self._row_cache.clear()
+        self._search_key = None
+        if self.rowCount() > 0:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, len(self._columns) - 1))
+
+    def seq_at(self, row):
+        if self._row_seqs is not None:
+            return int(self._row_seqs[row])
+        return self._begin + row
+
+    def row_of(self, seq):
+        """Returns the row index that displays the specified frame, or None if the frame is not displayed."""
+        if self._row_seqs is not None:
+            row = int(numpy.searchsorted(self._row_seqs, seq))
+            if row < len(self._row_seqs) and self._row_seqs[row] == seq:
+                return row
+            return None
+        if self._begin <= seq < self._end:
+            return seq - self._begin
+
+    def get_row_as_string(self, row, column_predicate=None):
+        seq = self.seq_at(row)
+        if seq not in self._store:
+            return ''
+        return '\t'.join(self._render_cell(c, seq)[0] for c in self._columns
+                         if column_predicate is None or column_predicate(c))
+
+    def _render_filterable(self, seq):
+        return '\t'.join(self._render_cell(c, seq)[0] for c in self._columns if c.filterable)
+
+    def _match_filter(self, begin, end):
+        """Returns the sequence numbers from the specified range that pass the current filter."""
+        return self._filter.apply(self._store, begin, end, self._render_filterable)
+
+    def sync(self):
+        """Picks up the changes in the store. Returns the number of the newly added rows."""
+        store = self._store
+
+        # Dropping the rows that have been evicted or cleared from the store
+        if self._row_seqs is not None:
+            num_evicted = int(numpy.searchsorted(self._row_seqs, store.begin))
+        else:
+            num_evicted = max(0, min(store.begin, self._end) - self._begin)
+
+        if num_evicted > 0:
+            self.beginRemoveRows(QModelIndex(), 0, num_evicted - 1)
+            if self._row_seqs is not None:
+                self._row_seqs = self._row_seqs[num_evicted:]
+            self._begin = max(self._begin, min(store.begin, self._end))
+            self.marked = {x for x in self.marked if x >= store.begin}
+            self.endRemoveRows()
+
+        # Adding new rows
+        new_begin = max(self._end, store.begin)
+        if new_begin >= store.end:
+            return 0
+
+        if self.rowCount() == 0:
+            self._begin = new_begin
+
+        if self._row_seqs is not None:
+            new_seqs = self._match_filter(new_begin, store.end)
+            num_added = len(new_seqs)
+        else:
+            new_seqs = None
+            num_added = store.end - new_begin
+
+        if num_added > 0:
+            first_row = self.rowCount()
+            self.beginInsertRows(QModelIndex(), first_row, first_row + num_added - 1)
+            if new_seqs is not None:
+                self._row_seqs = numpy.concatenate((self._row_seqs, new_seqs))
+            self._end = store.end
+            self.endInsertRows()
+        else:
+            self._end = store.end
+
+        return num_added
+
+    def set_filter(self, matcher_chain):
+        """Accepts a SearchMatcherChain or None; raises SearchMatcher.BadPatternException if it is malformed."""
+        frame_filter = FrameFilter(matcher_chain) if matcher_chain is not None else None
+        self.beginResetModel()
+        self._filter = frame_filter
+        if frame_filter is None:
+            self._row_seqs = None
+        else:
+            self._row_seqs = self._match_filter(self._begin, self._end)
+        self._row_cache.clear()
+        self.endResetModel()
+
+    def toggle_mark(self, row):
+        seq = self.seq_at(row)
+        if seq in self.marked:
+            self.marked.remove(seq)
+            marked = False
+        else:
+            self.marked.add(seq)
+            marked = True
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index)
+        return marked
+
+    def _match_searchable(self, begin, end, matcher):
+        """Returns the sequence numbers from the specified range where any of the searchable cells matches."""
+        store = self._store
+        begin = max(begin, store.begin)
+        end = max(begin, min(end, store.end))
+        slots = store.slots(begin, end)
+
+        mask = numpy.zeros(len(slots), dtype=numpy.bool_)
+        slow_columns = []
+        for c in self._columns:
+            if not c.searchable:
+                continue
+            if getattr(c, 'match', None) is not None:
+                mask |= c.match(store, slots, matcher)
+            else:
+                slow_columns.append(c)
+
+        seqs = numpy.arange(begin, end, dtype=numpy.int64)
+        for i in numpy.flatnonzero(~mask).tolist() if slow_columns else []:
+            mask[i] = any(matcher.match(self._render_cell(c, int(seqs[i]))[0]) for c in slow_columns)
+
+        return seqs[mask]
+
+    def find_matches(self, matcher):
+        """
+        Returns the sorted array of the displayed rows that match the SearchMatcher.
+        The matches are remembered, so that repeated queries only have to check the frames that arrived since then.
+        """
+        key = matcher.pattern, matcher.use_regex, matcher.case_sensitive, matcher.inverse
+        if key != self._search_key:
+            self._search_key = key
+            self._search_seqs = numpy.empty(0, dtype=numpy.int64)
+            self._search_end = self._begin
+
+        if self._search_end < self._end:
+            new_seqs = self._match_searchable(max(self._search_end, self._begin), self._end, matcher)
+            self._search_seqs = numpy.concatenate((self._search_seqs, new_seqs))
+            self._search_end = self._end
+
+        self._search_seqs = self._search_seqs[int(numpy.searchsorted(self._search_seqs, self._begin)):]
+
+        if self._row_seqs is None:
+            return self._search_seqs - self._begin
+
+        rows = numpy.searchsorted(self._row_seqs, self._search_seqs)
+        valid = rows < len(self._row_seqs)
+        valid[valid] = self._row_seqs[rows[valid]] == self._search_seqs[valid]
+        return rows[valid]
+
+    def search(self, direction, matcher, from_row):
+        """Returns the index of the next row that matches, wrapping around; None if nothing is found."""
+        rows = self.find_matches(matcher)
+        if len(rows) == 0:
+            return
+
+        if direction == 'up':
+            return int(rows[int(numpy.searchsorted(rows, from_row, side='left')) - 1])
+        else:
+            return int(rows[int(numpy.searchsorted(rows, from_row, side='right')) % len(rows)])
+
+
+class FrameTableView(QTableView):
+    def __init__(self, parent, model, font=None):
+        super(FrameTableView, self).__init__(parent)
+        self.setModel(model)
+
+        self.setShowGrid(False)
+        self.setWordWrap(False)
+        self.verticalHeader().setVisible(False)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(20)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
+
+        for idx, col in enumerate(model.columns):
+            self.horizontalHeader().setSectionResizeMode(idx, col.resize_mode)
+
+        if font:
+            self.setFont(font)
+
+    def get_selected_rows(self):
+        return sorted(x.row() for x in self.selectionModel().selectedRows())
+
+    def keyPressEvent(self, qkeyevent):
+        if qkeyevent.matches(QKeySequence.Copy):
+            selected_rows = self.get_selected_rows()
+            logger.info('Copy to clipboard requested [%r rows]' % len(selected_rows))
+
+            out_string = ''
+            for row in selected_rows:
+                out_string += self.model().get_row_as_string(row) + os.linesep
+
+            if out_string:
+                QApplication.clipboard().setText(out_string)
+        else:
+            super(FrameTableView, self).keyPressEvent(qkeyevent)
+
+    def select_row(self, row):
+        index = self.model().index(row, 0)
+        self.selectionModel().select(index, QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows)
+        self.scrollTo(index)
+
+
+class FrameLogWidget(QWidget):
+    """
+    Counterpart of RealtimeLogWidget for the bus monitor: the rows are kept in a bounded FrameStore
+    instead of a QTableWidget, so the memory footprint is fixed and the rendering cost doesn't depend on the row count.
+    If a read-only store is supplied, e.g. a capture file, its contents are displayed and the capture controls
+    are hidden.
+    """
+    MAX_CAPACITY = 10000000
+
+    def __init__(self, parent, columns, capacity=FrameStore.DEFAULT_CAPACITY, font=None, pre_redraw_hook=None,
+                 store=None):
+        super(FrameLogWidget, self).__init__(parent)
+
+        self.on_selection_changed = None
+
+        self.pre_redraw_hook = pre_redraw_hook or (lambda: None)
+
+        self._store = store if store is not None else FrameStore(capacity)
+        self._model = FrameTableModel(self, self._store, columns)
+
+        self._table = FrameTableView(self, self._model, font=font)
+        self._table.selectionModel().selectionChanged.connect(self._call_on_selection_changed)
+
+        self._clear_button = make_icon_button('trash-o', 'Clear', self, on_clicked=self.clear)
+
+        self._pause = make_icon_button('pause', 'Pause updates; data received while paused will not be lost '
+                                       'unless the capacity is exceeded', self, checkable=True)
+
+        self._start_button = make_icon_button('video-camera', 'Start/stop capturing', self,
+                                              checkable=True,
+                                              on_clicked=self._on_start_button_clicked)
+
+        self._search_bar = SearchBar(self)
+        self._search_bar.on_search = self._search
+        self._search_bar.on_count = lambda matcher: len(self._model.find_matches(matcher))
+
+        self._filter_bar = FilterBar(self, pattern_tool_tip=FILTER_SYNTAX_HELP)
+        self._filter_bar.on_filter = self._model.set_filter
+
+        self._capacity_spinbox = QSpinBox(self)
+        self._capacity_spinbox.setToolTip('Maximum number of frames to keep; the oldest frames will be discarded')
+        self._capacity_spinbox.setMinimum(1000)
+        self._capacity_spinbox.setMaximum(self.MAX_CAPACITY)
+        self._capacity_spinbox.setSingleStep(100000)
+        self._capacity_spinbox.setValue(min(self._store.capacity, self.MAX_CAPACITY))
+        self._capacity_spinbox.editingFinished.connect(self._update_capacity)
+
+        self._row_count = LabelWithIcon(get_icon('list'), '0', self)
+        self._row_count.setToolTip('Row count')
+
+        if self._store.read_only:
+            self._model.sync()
+            self._row_count.setText(str(self._model.rowCount()))
+            for w in (self._start_button, self._pause, self._clear_button, self._capacity_spinbox):
+                w.hide()
+
+        self._redraw_timer = QTimer(self)
+        self._redraw_timer.setSingleShot(False)
+        self._redraw_timer.timeout.connect(self._redraw)
+        self._redraw_timer.start(100)
+
+        layout = QVBoxLayout(self)
+
+        controls_layout = QHBoxLayout(self)
+        controls_layout.addWidget(self._start_button)
+        controls_layout.addWidget(self._pause)
+        controls_layout.addWidget(self._clear_button)
+        controls_layout.addWidget(self._search_bar.show_search_bar_button)
+        controls_layout.addWidget(self._filter_bar.add_filter_button)
+
+        self._custom_area_layout = QHBoxLayout(self)
+        self._custom_area_layout.setContentsMargins(0, 0, 0, 0)
+        controls_layout.addLayout(self._custom_area_layout, 1)
+        controls_layout.addStretch()
+
+        if not self._store.read_only:
+            controls_layout.addWidget(QLabel('Capacity:', self))
+        controls_layout.addWidget(self._capacity_spinbox)
+        controls_layout.addWidget(self._row_count)
+
+        layout.addLayout(controls_layout)
+        layout.addWidget(self._search_bar)
+        layout.addWidget(self._filter_bar)
+        layout.addWidget(self._table, 1)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+    def keyPressEvent(self, qkeyevent):
+        super(FrameLogWidget, self).keyPressEvent(qkeyevent)
+        if qkeyevent.matches(QKeySequence.Find):
+            self._search_bar.show()
+
+    def _search(self, direction, matcher):
+        self._pause.setChecked(True)
+
+        selected_rows = self._table.get_selected_rows()
+        if selected_rows:
+            from_row = selected_rows[0] if direction == 'up' else selected_rows[-1]
+        else:
+            from_row = self._model.rowCount() if direction == 'up' else -1
+
+        self._table.clearSelection()
+        row = self._model.search(direction, matcher, from_row)
+        if row is not None:
+            self._table.select_row(row)
+        return row
+
+    def clear(self):
+        self._store.clear()
+        self._model.sync()
+        self._row_count.setText(str(self._model.rowCount()))
+
+    def _update_capacity(self):
+        capacity = self._capacity_spinbox.value()
+        if capacity != self._store.capacity:
+            logger.info('Changing frame store capacity from %r to %r', self._store.capacity, capacity)
+            self._store.set_capacity(capacity)
+            self._model.sync()
+
+    def _call_on_selection_changed(self):
+        if not self.on_selection_changed:
+            return
+
+        selected_rows = self._table.get_selected_rows()
+        self.on_selection_changed(selected_rows)
+
+    def _redraw(self):
+        self.pre_redraw_hook()
+
+        if self.started and not self.paused:
+            if self._model.sync() > 0:
+                self._table.scrollToBottom()
+            self._row_count.setText(str(self._model.rowCount()))
+
+    def _on_start_button_clicked(self):
+        self._pause.setChecked(False)
+
+    def start(self):
+        """Starts capturing and un-pauses updates."""
+        self._start_button.setChecked(True)
+        self._pause.setChecked(False)
+
+    def add_frames(self, records):
+        """Accepts an array of FRAME_RECORD_DTYPE; the frames are discarded unless capturing is started."""
+        if self.started and len(records):
+            self._store.extend(records)
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def table(self):
+        return self._table
+
+    @property
+    def paused(self):
+        return self._pause.isChecked()
+
+    @property
+    def started(self):
+        return self._start_button.isChecked()
+
+    @property
+    def custom_area_layout(self):
+        return self._custom_area_layout
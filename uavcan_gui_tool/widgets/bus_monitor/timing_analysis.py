@@ -0,0 +1,320 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import math
+from logging import getLogger
+
+import numpy
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QDialog, QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView, QSplitter, \
+    QVBoxLayout, QHBoxLayout, QLabel
+
+from .can_id import decode_can_id, split_can_ids
+from .. import get_monospace_font, make_icon_button, NumericTableItem
+from ...frame_record import FLAG_EXTENDED
+from ...thirdparty.pyqtgraph import PlotWidget, BarGraphItem
+
+logger = getLogger(__name__)
+
+
+class TimingAnalyzer:
+    """
+    Inter-arrival statistics of the transfers per (data type, source node) stream, based on the driver timestamps.
+    The arrival time of a transfer is the timestamp of its first frame.
+
+    Every stream keeps a fixed-size logarithmic histogram of the intervals, which doubles as a quantile sketch with
+    bounded relative error (the same idea as DDSketch), plus the exact min, max, mean and standard deviation.
+    The memory footprint per stream is constant, and the batches of frames are processed in NumPy.
+    """
+    MIN_INTERVAL = 1e-5
+    MAX_INTERVAL = 100.0
+    RELATIVE_ACCURACY = 0.01
+
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    # Bin 0 holds the intervals below MIN_INTERVAL, the last bin holds the intervals above MAX_INTERVAL
+    NUM_BINS = int(math.ceil(math.log(MAX_INTERVAL / MIN_INTERVAL) / math.log(GAMMA))) + 2
+
+    def __init__(self):
+        self._stream_index = {}         # Stream key : stream number
+        self._allocate(0)
+
+    def _allocate(self, capacity):
+        def grow(array, fill):
+            out = numpy.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            out[:len(array)] = array
+            return out
+
+        if capacity == 0:
+            self._can_ids = numpy.zeros(0, dtype=numpy.int64)
+            self._last_ts = numpy.zeros(0, dtype=numpy.float64)
+            self._count = numpy.zeros(0, dtype=numpy.int64)
+            self._mean = numpy.zeros(0, dtype=numpy.float64)
+            self._m2 = numpy.zeros(0, dtype=numpy.float64)
+            self._min = numpy.zeros(0, dtype=numpy.float64)
+            self._max = numpy.zeros(0, dtype=numpy.float64)
+            self._histograms = numpy.zeros((0, self.NUM_BINS), dtype=numpy.int64)
+        else:
+            self._can_ids = grow(self._can_ids, 0)
+            self._last_ts = grow(self._last_ts, numpy.nan)
+            self._count = grow(self._count, 0)
+            self._mean = grow(self._mean, 0)
+            self._m2 = grow(self._m2, 0)
+            self._min = grow(self._min, numpy.inf)
+            self._max = grow(self._max, -numpy.inf)
+            self._histograms = grow(self._histograms, 0)
+
+    def _get_streams(self, keys, can_ids):
+        streams = numpy.empty(len(keys), dtype=numpy.int64)
+        for i, key in enumerate(keys.tolist()):
+            try:
+                streams[i] = self._stream_index[key]
+            except KeyError:
+                streams[i] = self._stream_index[key] = len(self._stream_index)
+        if len(self._stream_index) > len(self._count):
+            self._allocate(max(16, 2 * len(self._stream_index)))
+        self._can_ids[streams] = can_ids
+        return streams
+
+    @classmethod
+    def get_bin(cls, intervals):
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            bins = numpy.floor(numpy.log(intervals / cls.MIN_INTERVAL) / math.log(cls.GAMMA)) + 1
+        return numpy.clip(numpy.nan_to_num(bins, nan=0, neginf=0), 0, cls.NUM_BINS - 1).astype(numpy.int64)
+
+    @classmethod
+    def get_bin_edges(cls):
+        """Lower boundaries of the bins; the first bin begins at zero."""
+        edges = cls.MIN_INTERVAL * cls.GAMMA ** numpy.arange(-1, cls.NUM_BINS, dtype=numpy.float64)
+        edges[0] = 0
+        return edges
+
+    def add_frames(self, records):
+        """Accepts an array of FRAME_RECORD_DTYPE."""
+        dlc = records['dlc'].astype(numpy.int64)
+        tail = records['data'][numpy.arange(len(records)), numpy.maximum(dlc - 1, 0)]
+        records = records[((records['flags'] & FLAG_EXTENDED) != 0) & (dlc > 0) & ((tail & 0x80) != 0)]
+        if len(records) == 0:
+            return
+
+        can_id = records['can_id'].astype(numpy.int64)
+        _, data_type, src = split_can_ids(can_id)
+        keys = (data_type << 7) | src
+
+        # Grouping the transfers by stream while preserving the order of arrival within each stream
+        order = numpy.argsort(keys, kind='stable')
+        keys, can_id, ts = keys[order], can_id[order], records['ts_monotonic'][order]
+        unique_keys, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        last = numpy.append(first[1:], len(keys)) - 1
+        unique_streams = self._get_streams(unique_keys, can_id[first])
+
+        prev_ts = numpy.empty_like(ts)
+        prev_ts[1:] = ts[:-1]
+        prev_ts[first] = self._last_ts[unique_streams]
+        self._last_ts[unique_streams] = ts[last]
+
+        intervals = numpy.maximum(ts - prev_ts, 0)
+        valid = ~numpy.isnan(intervals)
+        intervals, local = intervals[valid], inverse[valid]
+        if len(intervals) == 0:
+            return
+
+        # Merging the statistics of the batch into the running statistics (Chan et al.)
+        n_batch = numpy.bincount(local, minlength=len(unique_keys))
+        present = n_batch > 0
+        n_batch = n_batch[present]
+        streams = unique_streams[present]
+        local_to_present = numpy.cumsum(present) - 1
+        local = local_to_present[local]
+
+        mean_batch = numpy.bincount(local, weights=intervals) / n_batch
+        m2_batch = numpy.bincount(local, weights=(intervals - mean_batch[local]) ** 2)
+        n = self._count[streams]
+        total = n + n_batch
+        delta = mean_batch - self._mean[streams]
+        self._mean[streams] += delta * n_batch / total
+        self._m2[streams] += m2_batch + delta ** 2 * n * n_batch / total
+        self._count[streams] = total
+
+        numpy.minimum.at(self._min, streams[local], intervals)
+        numpy.maximum.at(self._max, streams[local], intervals)
+
+        histogram = numpy.bincount(local * self.NUM_BINS + self.get_bin(intervals),
+                                   minlength=len(streams) * self.NUM_BINS)
+        self._histograms[streams] += histogram.reshape(len(streams), self.NUM_BINS)
+
+    def get_quantile(self, stream, q):
+        """Approximate quantile of the intervals of the stream with the relative error of RELATIVE_ACCURACY."""
+        count = self._count[stream]
+        if count == 0:
+            return numpy.nan
+        cumulative = numpy.cumsum(self._histograms[stream])
+        b = int(numpy.searchsorted(cumulative, q * (count - 1), side='right'))
+        if b == 0:
+            value = self._min[stream]
+        else:
+            value = self.MIN_INTERVAL * self.GAMMA ** (b - 1) * 2 * self.GAMMA / (self.GAMMA + 1)
+        return min(max(value, self._min[stream]), self._max[stream])
+
+    def get_histogram(self, stream):
+        return self._histograms[stream]
+
+    def __len__(self):
+        """Number of streams."""
+        return len(self._stream_index)
+
+    def get_streams(self):
+        """Returns a list of (stream, data type name, source node) for each stream that has at least one interval."""
+        out = []
+        for stream in numpy.flatnonzero(self._count[:len(self._stream_index)]).tolist():
+            info = decode_can_id(int(self._can_ids[stream]), True)
+            out.append((stream, info.data_type, info.src))
+        return out
+
+    def get_stats(self, stream):
+        """Returns a tuple (count, mean, standard deviation, min, max) of the intervals."""
+        count = int(self._count[stream])
+        std = math.sqrt(self._m2[stream] / (count - 1)) if count > 1 else 0.0
+        return count, float(self._mean[stream]), std, float(self._min[stream]), float(self._max[stream])
+
+    def clear(self):
+        self._stream_index.clear()
+        self._allocate(0)
+
+
+class TimingAnalysisWindow(QDialog):
+    """Table of the timing statistics per stream and the interval histogram of the selected stream."""
+    UPDATE_INTERVAL_MS = 1000
+
+    COLUMNS = [
+        ('Transfers', '%d'),
+        ('Rate, Hz', '%.2f'),
+        ('Mean, ms', '%.3f'),
+        ('Min, ms', '%.3f'),
+        ('P50, ms', '%.3f'),
+        ('P99, ms', '%.3f'),
+        ('Max, ms', '%.3f'),
+        ('Jitter, ms', '%.3f'),
+    ]
+
+    def __init__(self, parent, analyzer, live=True):
+        super(TimingAnalysisWindow, self).__init__(parent)
+        self.setWindowTitle('Transfer Timing Analysis')
+        self.setAttribute(Qt.WA_DeleteOnClose)  # This is required to stop background timers!
+
+        self._analyzer = analyzer
+        self._selected_stream = None
+
+        self._clear_button = make_icon_button('trash-o', 'Reset statistics', self, on_clicked=self._clear)
+        self._clear_button.setVisible(live)
+
+        info = QLabel('Intervals between the first frames of consecutive transfers per data type and source node, '
+                      'according to the driver timestamps. Jitter is the standard deviation of the interval; '
+                      'quantiles are accurate within %.0f%%.' % (100 * TimingAnalyzer.RELATIVE_ACCURACY), self)
+        info.setWordWrap(True)
+
+        self._table = QTableWidget(self)
+        self._table.setColumnCount(len(self.COLUMNS) + 2)
+        self._table.setHorizontalHeaderLabels(['Data type', 'Src'] + [name for name, _ in self.COLUMNS])
+        self._table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self._table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self._table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._table.setFont(get_monospace_font())
+        self._table.verticalHeader().setVisible(False)
+        self._table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self._table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self._table.setSortingEnabled(True)
+        self._table.sortByColumn(0, Qt.AscendingOrder)
+        self._table.itemSelectionChanged.connect(self._on_selection_changed)
+
+        self._histogram_plot = PlotWidget(background=(0, 0, 0))
+        self._histogram_plot.showGrid(x=True, y=True, alpha=0.4)
+        self._histogram_plot.setLabel('bottom', 'Interval, ms')
+        self._histogram_plot.setLabel('left', 'Transfers')
+        self._histogram = None
+
+        splitter = QSplitter(Qt.Vertical, self)
+        splitter.addWidget(self._table)
+        splitter.addWidget(self._histogram_plot)
+
+        controls_layout = QHBoxLayout()
+        controls_layout.addWidget(info, 1)
+        controls_layout.addWidget(self._clear_button)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls_layout)
+        layout.addWidget(splitter, 1)
+        self.setLayout(layout)
+        self.resize(900, 600)
+
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(False)
+        self._update_timer.timeout.connect(self._update)
+        if live:
+            self._update_timer.start(self.UPDATE_INTERVAL_MS)
+
+        self._update()
+
+    def _clear(self):
+        self._analyzer.clear()
+        self._selected_stream = None
+        self._update()
+
+    def _on_selection_changed(self):
+        rows = self._table.selectionModel().selectedRows()
+        if rows:
+            self._selected_stream = self._table.item(rows[0].row(), 0).data(Qt.UserRole)
+            self._update_histogram()
+
+    def _update(self):
+        a = self._analyzer
+        self._table.setSortingEnabled(False)
+        self._table.setUpdatesEnabled(False)
+        self._table.blockSignals(True)
+
+        streams = a.get_streams()
+        self._table.setRowCount(len(streams))
+        for row, (stream, data_type, src) in enumerate(streams):
+            count, mean, std, minimum, maximum = a.get_stats(stream)
+            values = (count, 1 / mean if mean > 0 else 0, mean * 1e3, minimum * 1e3,
+                      a.get_quantile(stream, 0.5) * 1e3, a.get_quantile(stream, 0.99) * 1e3, maximum * 1e3, std * 1e3)
+
+            data_type_item = QTableWidgetItem(data_type)
+            data_type_item.setData(Qt.UserRole, stream)
+            self._table.setItem(row, 0, data_type_item)
+            self._table.setItem(row, 1, QTableWidgetItem(str(src)))
+            for col, ((_, fmt), value) in enumerate(zip(self.COLUMNS, values)):
+                self._table.setItem(row, col + 2, NumericTableItem(value, fmt))
+            if stream == self._selected_stream:
+                self._table.selectRow(row)
+
+        self._table.blockSignals(False)
+        self._table.setUpdatesEnabled(True)
+        self._table.setSortingEnabled(True)
+        self._update_histogram()
+
+    def _update_histogram(self):
+        if self._histogram is not None:
+            self._histogram_plot.removeItem(self._histogram)
+            self._histogram = None
+
+        if self._selected_stream is None or self._selected_stream >= len(self._analyzer):
+            return
+
+        counts = self._analyzer.get_histogram(self._selected_stream)
+        nonzero = numpy.flatnonzero(counts)
+        if len(nonzero) == 0:
+            return
+
+        begin, end = nonzero[0], nonzero[-1] + 1
+        edges = TimingAnalyzer.get_bin_edges()[begin:end + 1] * 1e3
+        self._histogram = BarGraphItem(x0=edges[:-1], x1=edges[1:], height=counts[begin:end],
+                                       brush=QColor(Qt.lightGray), pen=QColor(Qt.lightGray))
+        self._histogram_plot.addItem(self._histogram)
+        self._histogram_plot.autoRange()
@@ -0,0 +1,298 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+from logging import getLogger
+
+import numpy
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QWidget, QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView, QComboBox, \
+    QSpinBox, QLabel, QHBoxLayout, QVBoxLayout
+
+from .can_id import decode_can_id, split_can_ids
+from .. import get_monospace_font, NumericTableItem
+from ...frame_record import FLAG_TX, FLAG_EXTENDED
+
+logger = getLogger(__name__)
+
+DEFAULT_BITRATE = 1000000
+
+# Nominal frame length on the wire from SOF through the interframe space, excluding the data field and bit stuffing
+FRAME_OVERHEAD_BITS_BASE = 47
+FRAME_OVERHEAD_BITS_EXTENDED = 67
+
+
+def estimate_frame_bits(dlc, extended):
+    """Vectorised; bit stuffing is not accounted for, so the estimate is a lower bound."""
+    return numpy.where(extended, FRAME_OVERHEAD_BITS_EXTENDED, FRAME_OVERHEAD_BITS_BASE) + dlc.astype(numpy.int64) * 8
+
+
+class TrafficBreakdown:
+    """
+    Frame, byte and bit counters split by an integer key, such as the source node ID or the data type.
+    The key NOT_APPLICABLE is reserved for the frames the key is not applicable to (i.e. non-UAVCAN frames).
+    Only the keys that have been seen are allocated a slot, so the cost of counting and of computing the rates
+    depends on the number of distinct keys on the bus rather than on the size of the key space; the rates are
+    updated by the owner at fixed intervals.
+    """
+    FRAMES, BYTES, BITS = range(3)
+    NOT_APPLICABLE = -1
+
+    def __init__(self, name, get_label):
+        """get_label(CANIDInfo) returns the text describing the key the CAN ID belongs to."""
+        self.name = name
+        self._get_label = get_label
+        self._slot_index = {}           # Key : slot number
+        self._keys = []                 # Slot number : key
+        self._allocate(0)
+        self._num_rate_updates = 0
+
+    def _allocate(self, capacity):
+        def grow(array):
+            out = numpy.zeros(array.shape[:-1] + (capacity,), dtype=array.dtype)
+            out[..., :array.shape[-1]] = array
+            return out
+
+        if capacity == 0:
+            self._counters = numpy.zeros((3, 0), dtype=numpy.float64)
+            self._checkpoint = self._counters.copy()
+            self._rates = self._counters.copy()
+            self._can_ids = numpy.zeros(0, dtype=numpy.int64)      # Last CAN ID seen per slot, for labeling
+        else:
+            self._counters = grow(self._counters)
+            self._checkpoint = grow(self._checkpoint)
+            self._rates = grow(self._rates)
+            self._can_ids = grow(self._can_ids)
+
+    def _get_slots(self, keys):
+        slots = numpy.empty(len(keys), dtype=numpy.int64)
+        for i, key in enumerate(keys.tolist()):
+            try:
+                slots[i] = self._slot_index[key]
+            except KeyError:
+                slots[i] = self._slot_index[key] = len(self._keys)
+                self._keys.append(key)
+        if len(self._keys) > len(self._can_ids):
+            self._allocate(max(16, 2 * len(self._keys)))
+        return slots
+
+    def add(self, keys, can_id, dlc, bits):
+        unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        slots = self._get_slots(unique_keys)
+        self._counters[self.FRAMES, slots] += numpy.bincount(inverse, minlength=len(slots))
+        self._counters[self.BYTES, slots] += numpy.bincount(inverse, weights=dlc, minlength=len(slots))
+        self._counters[self.BITS, slots] += numpy.bincount(inverse, weights=bits, minlength=len(slots))
+        self._can_ids[slots[inverse]] = can_id
+
+    def update_rates(self, dt, smoothing):
+        """Computes the rates over the last dt seconds and mixes them into the exponential moving averages."""
+        rates = (self._counters - self._checkpoint) / dt
+        if self._num_rate_updates == 0:
+            self._rates[:] = rates
+        else:
+            self._rates += (rates - self._rates) * smoothing
+        self._checkpoint[:] = self._counters
+        self._num_rate_updates += 1
+
+    def _get_slot_label(self, slot):
+        if self._keys[slot] == self.NOT_APPLICABLE:
+            return 'N/A'
+        return str(self._get_label(decode_can_id(int(self._can_ids[slot]), True)))
+
+    def get_rows(self):
+        """Returns a list of (label, frames per second, bytes per second, bits per second, total frames)."""
+        slots = numpy.flatnonzero(self._counters[self.FRAMES])
+        return [(self._get_slot_label(s),
+                 float(self._rates[self.FRAMES, s]),
+                 float(self._rates[self.BYTES, s]),
+                 float(self._rates[self.BITS, s]),
+                 int(self._counters[self.FRAMES, s])) for s in slots.tolist()]
+
+
+class TrafficStatCounter:
+    """
+    Counts the traffic and estimates the rates over windows of the specified duration; if the window is infinite,
+    the rates are updated only by explicit calls to update_rates(), e.g. to get the average rates of a capture.
+    """
+    MOVING_AVERAGE_LENGTH = 4
+    FPS_ESTIMATION_WINDOW = 0.5
+
+    def __init__(self, bitrate=None, estimation_window=FPS_ESTIMATION_WINDOW):
+        self._rx = 0
+        self._tx = 0
+        self._estimation_window = estimation_window
+        self._bits_per_second = 0
+        self._last_ts_mono = None
+        self._prev_fps_checkpoint_mono = None
+        self._frames_since_fps_checkpoint = 0
+        self._bits_since_fps_checkpoint = 0
+        self._last_fps_estimates = [0] * self.MOVING_AVERAGE_LENGTH
+
+        self.bitrate = bitrate or DEFAULT_BITRATE
+
+        self.by_node = TrafficBreakdown('Source node', lambda info: info.src)
+        self.by_data_type = TrafficBreakdown('Data type', lambda info: info.data_type)
+        self.by_priority = TrafficBreakdown('Priority', lambda info: info.priority)
+
+    def _add_to_breakdowns(self, records, extended, bits):
+        can_id = records['can_id'].astype(numpy.int64)
+        dlc = records['dlc']
+
+        priority, data_type, src = split_can_ids(can_id)
+        for breakdown, keys in ((self.by_node, src),
+                                (self.by_data_type, data_type),
+                                (self.by_priority, priority)):
+            keys = numpy.where(extended, keys, TrafficBreakdown.NOT_APPLICABLE)
+            breakdown.add(keys, can_id, dlc, bits)
+
+    def add_frames(self, records):
+        """Accepts an array of FRAME_RECORD_DTYPE."""
+        if len(records) == 0:
+            return
+
+        is_tx = (records['flags'] & FLAG_TX) != 0
+        num_tx = int(numpy.count_nonzero(is_tx))
+        self._tx += num_tx
+        self._rx += len(records) - num_tx
+
+        extended = (records['flags'] & FLAG_EXTENDED) != 0
+        bits = estimate_frame_bits(records['dlc'], extended)
+        self._add_to_breakdowns(records, extended, bits)
+
+        # Updating the rate estimates once per window rather than once per frame.
+        # It is extremely important that the algorithm relies only on the timestamps provided by the driver!
+        # Naive timestamping produces highly unreliable estimates, because the application is not nearly real-time.
+        self._frames_since_fps_checkpoint += len(records)
+        self._bits_since_fps_checkpoint += int(bits.sum())
+
+        self._last_ts_mono = float(records['ts_monotonic'][-1])
+        if self._prev_fps_checkpoint_mono is None:
+            self._prev_fps_checkpoint_mono = float(records['ts_monotonic'][0])
+
+        if self._last_ts_mono - self._prev_fps_checkpoint_mono >= self._estimation_window:
+            self.update_rates()
+
+    def update_rates(self):
+        """Updates the rate estimates with the traffic counted since the previous update."""
+        if self._last_ts_mono is None:
+            return
+        dt = self._last_ts_mono - self._prev_fps_checkpoint_mono
+        if dt <= 0:
+            return
+
+        self._last_fps_estimates.pop()
+        self._last_fps_estimates.insert(0, self._frames_since_fps_checkpoint / dt)
+        self._bits_per_second = self._bits_since_fps_checkpoint / dt
+        for breakdown in self.breakdowns:
+            breakdown.update_rates(dt, 1 / self.MOVING_AVERAGE_LENGTH)
+
+        self._prev_fps_checkpoint_mono = self._last_ts_mono
+        self._frames_since_fps_checkpoint = 0
+        self._bits_since_fps_checkpoint = 0
+
+    @property
+    def rx(self):
+        return self._rx
+
+    @property
+    def tx(self):
+        return self._tx
+
+    @property
+    def total(self):
+        return self._rx + self._tx
+
+    @property
+    def breakdowns(self):
+        return self.by_node, self.by_data_type, self.by_priority
+
+    def get_frames_per_second(self):
+        return (sum(self._last_fps_estimates) / len(self._last_fps_estimates)), (self._prev_fps_checkpoint_mono or 0)
+
+    def get_bus_utilization(self):
+        """Estimated fraction of the bus bandwidth in use over the last estimation window, in percent."""
+        return 100 * self._bits_per_second / self.bitrate
+
+
+class TrafficBreakdownWidget(QWidget):
+    """Sortable table of the traffic of a TrafficStatCounter split by node, data type or priority."""
+    COLUMNS = [
+        ('FPS', '%.1f'),
+        ('Bytes/s', '%.0f'),
+        ('Load %', '%.2f'),
+        ('Frames', '%d'),
+    ]
+
+    def __init__(self, parent, traffic_stat):
+        super(TrafficBreakdownWidget, self).__init__(parent)
+        self._traffic_stat = traffic_stat
+
+        self._breakdown_selector = QComboBox(self)
+        self._breakdown_selector.setToolTip('Traffic breakdown')
+        for b in traffic_stat.breakdowns:
+            self._breakdown_selector.addItem('By ' + b.name.lower())
+        self._breakdown_selector.currentIndexChanged.connect(self.update_table)
+
+        self._bitrate_spinbox = QSpinBox(self)
+        self._bitrate_spinbox.setToolTip('Bus bit rate used to estimate the load.\n'
+                                         'Bit stuffing is not accounted for, so the load is slightly underestimated.')
+        self._bitrate_spinbox.setRange(10000, 1000000)
+        self._bitrate_spinbox.setSingleStep(125000)
+        self._bitrate_spinbox.setSuffix(' bit/s')
+        self._bitrate_spinbox.setValue(traffic_stat.bitrate)
+        self._bitrate_spinbox.valueChanged.connect(self._on_bitrate_changed)
+
+        self._utilization = QLabel(self)
+
+        self._table = QTableWidget(self)
+        self._table.setColumnCount(len(self.COLUMNS) + 1)
+        self._table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self._table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._table.setFont(get_monospace_font())
+        self._table.verticalHeader().setVisible(False)
+        self._table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self._table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self._table.horizontalHeader().setStretchLastSection(True)
+        self._table.setSortingEnabled(True)
+        self._table.sortByColumn(3, Qt.DescendingOrder)
+
+        controls_layout = QHBoxLayout(self)
+        controls_layout.addWidget(self._breakdown_selector, 1)
+        controls_layout.addWidget(self._bitrate_spinbox)
+        controls_layout.addWidget(self._utilization)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls_layout)
+        layout.addWidget(self._table, 1)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+        self.update_table()
+
+    def _on_bitrate_changed(self):
+        self._traffic_stat.bitrate = self._bitrate_spinbox.value()
+        self.update_table()
+
+    def update_table(self):
+        breakdown = self._traffic_stat.breakdowns[self._breakdown_selector.currentIndex()]
+        bitrate = self._traffic_stat.bitrate
+        rows = breakdown.get_rows()
+
+        self._utilization.setText('%.1f%%' % self._traffic_stat.get_bus_utilization())
+
+        self._table.setSortingEnabled(False)
+        self._table.setUpdatesEnabled(False)
+        self._table.setHorizontalHeaderLabels([breakdown.name] + [name for name, _ in self.COLUMNS])
+        self._table.setRowCount(len(rows))
+        for row, (label, fps, bytes_per_second, bits_per_second, num_frames) in enumerate(rows):
+            values = fps, bytes_per_second, 100 * bits_per_second / bitrate, num_frames
+            self._table.setItem(row, 0, QTableWidgetItem(label))
+            for col, ((_, fmt), value) in enumerate(zip(self.COLUMNS, values)):
+                self._table.setItem(row, col + 1, NumericTableItem(value, fmt))
+        self._table.setUpdatesEnabled(True)
+        self._table.setSortingEnabled(True)
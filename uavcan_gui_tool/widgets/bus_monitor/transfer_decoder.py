@@ -6,64 +6,240 @@
 # Author: Pavel Kirienko <pavel.kirienko@zubax.com>
 #
 
+import threading
+from collections import OrderedDict
+from logging import getLogger
+
+import numpy
 import pyuavcan_v0
 from pyuavcan_v0.transport import Transfer, Frame
+from PyQt5.QtCore import QObject, pyqtSignal
 
-# How many rows will be traversed while looking for beginning/end of a multi frame transfer
-TABLE_TRAVERSING_RANGE = 2000
+logger = getLogger(__name__)
 
 
 class DecodingFailedException(Exception):
     pass
 
 
-def _get_transfer_id(frame):
-    if len(frame.data):
-        return frame.data[-1] & 0b00011111
-
-
-def _is_start_of_transfer(frame):
-    if len(frame.data):
-        return frame.data[-1] & 0b10000000
-
-
-def _is_end_of_transfer(frame):
-    if len(frame.data):
-        return frame.data[-1] & 0b01000000
-
-
-def decode_transfer_from_frame(entry_row, row_to_frame):
-    entry_frame, direction = row_to_frame(entry_row)
-    can_id = entry_frame.id
-    transfer_id = _get_transfer_id(entry_frame)
-    frames = [entry_frame]
-
-    related_rows = []
-
-    # Scanning backward looking for the first frame
-    row = entry_row - 1
-    while not _is_start_of_transfer(frames[0]):
-        if row < 0 or entry_row - row > TABLE_TRAVERSING_RANGE:
-            raise DecodingFailedException('SOT not found')
-        f, d = row_to_frame(row)
-        row -= 1
-        if f.id == can_id and _get_transfer_id(f) == transfer_id and d == direction:
-            frames.insert(0, f)
-            related_rows.insert(0, row)
-
-    # Scanning forward looking for the last frame
-    row = entry_row + 1
-    while not _is_end_of_transfer(frames[-1]):
-        f, d = row_to_frame(row)
-        if f is None or row - entry_row > TABLE_TRAVERSING_RANGE:
-            raise DecodingFailedException('EOT not found')
-        row += 1
-        if f.id == can_id and _get_transfer_id(f) == transfer_id and d == direction:
-            frames.append(f)
-            related_rows.append(row)
-
-    # The transfer is now fully recovered
+class TransferIndex:
+    """
+    Reassembles transfers incrementally as new frames arrive into a FrameStore.
+    Open transfers are tracked by (CAN ID, transfer ID, direction); once a transfer is complete, every frame of it
+    is linked to the sequence number of its last frame, so the transfer can be found from any of its frames
+    in constant time regardless of the size of the store.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._end = store.begin                     # Sequence number of the next frame to process
+        self._last_frame_of = numpy.full(store.capacity, -1, dtype=numpy.int64)  # Indexed by storage slot
+        self._open = {}                             # (CAN ID, transfer ID, direction) : [seq]
+        self._multi_frame = OrderedDict()           # Seq of the last frame : tuple(seq), ordered by the last seq
+
+    def _reset(self):
+        self._end = self._store.begin
+        self._last_frame_of = numpy.full(self._store.capacity, -1, dtype=numpy.int64)
+        self._open.clear()
+        self._multi_frame.clear()
+
+    def update(self):
+        """Processes the frames that were added to the store since the last call."""
+        store = self._store
+        if len(self._last_frame_of) != store.capacity:      # The store was reallocated, starting over
+            self._reset()
+
+        begin = max(self._end, store.begin)
+        end = store.end
+        self._end = end
+        if begin >= end:
+            return
+
+        slots = store.slots(begin, end)
+        self._last_frame_of[slots] = -1
+
+        dlc = store.dlc[slots]
+        tails = store.data[slots, numpy.maximum(dlc, 1) - 1]
+        is_valid = store.extended[slots] & (dlc > 0)
+
+        capacity = store.capacity
+        for seq, valid, can_id, tail, direction in zip(range(begin, end),
+                                                        is_valid.tolist(),
+                                                        store.can_id[slots].tolist(),
+                                                        tails.tolist(),
+                                                        store.direction[slots].tolist()):
+            if not valid:
+                continue
+
+            key = can_id, tail & 0x1F, direction
+            if tail & 0x80:                         # Start of transfer
+                if tail & 0x40:                     # Single frame transfer, nothing to track
+                    self._last_frame_of[seq % capacity] = seq
+                else:
+                    self._open[key] = [seq]
+                continue
+
+            seqs = self._open.get(key)
+            if seqs is None:                        # Start of this transfer was missed
+                continue
+            seqs.append(seq)
+
+            if tail & 0x40:                         # End of transfer
+                del self._open[key]
+                self._multi_frame[seq] = tuple(seqs)
+                for x in seqs:
+                    if x in store:
+                        self._last_frame_of[x % capacity] = seq
+
+        # Forgetting the transfers that have been evicted from the store
+        while self._multi_frame:
+            last_seq = next(iter(self._multi_frame))
+            if last_seq >= store.begin:
+                break
+            del self._multi_frame[last_seq]
+
+    def get_transfer(self, seq):
+        """Returns the sequence numbers of all frames of the transfer that contains the specified frame."""
+        store = self._store
+        if seq not in store or len(self._last_frame_of) != store.capacity:
+            raise DecodingFailedException('Frame is not indexed')
+
+        last_seq = int(self._last_frame_of[seq % store.capacity])
+        if last_seq < 0:
+            raise DecodingFailedException('Transfer is incomplete')
+
+        seqs = self._multi_frame.get(last_seq, (last_seq,))
+        if seqs[0] not in store:
+            raise DecodingFailedException('Beginning of the transfer has been discarded')
+
+        return seqs
+
+
+class TransferLocator:
+    """
+    Finds transfers on demand by scanning the neighbourhood of the requested frame, without keeping any index.
+    Intended for large read-only stores such as capture files, where indexing every frame up front is too costly.
+    Has the same interface as TransferIndex.
+    """
+    DEFAULT_SCAN_WINDOW = 100000
+
+    def __init__(self, store, scan_window=DEFAULT_SCAN_WINDOW):
+        self._store = store
+        self._scan_window = scan_window
+
+    def update(self):
+        pass
+
+    def get_transfer(self, seq):
+        store = self._store
+        if seq not in store:
+            raise DecodingFailedException('Frame is not in the store')
+
+        slot = store.slot(seq)
+        dlc = int(store.dlc[slot])
+        if not store.extended[slot] or dlc == 0:
+            raise DecodingFailedException('Not a UAVCAN frame')
+
+        begin = max(store.begin, seq - self._scan_window)
+        end = min(store.end, seq + self._scan_window + 1)
+        slots = store.slots(begin, end)
+
+        # Frames of the same transfer share the CAN ID, the transfer ID and the direction
+        dlcs = store.dlc[slots]
+        tails = store.data[slots, numpy.maximum(dlcs, 1) - 1]
+        tid = int(store.data[slot, dlc - 1]) & 0x1F
+        matching = (store.can_id[slots] == store.can_id[slot]) & (dlcs > 0) & ((tails & 0x1F) == tid) & \
+            (store.direction[slots] == store.direction[slot])
+        positions = numpy.flatnonzero(matching)
+        tails = tails[positions]
+        position = int(numpy.searchsorted(positions, seq - begin))
+
+        starts = numpy.flatnonzero(tails[:position + 1] & 0x80)
+        ends = numpy.flatnonzero(tails[position:] & 0x40)
+        if not len(starts):
+            raise DecodingFailedException('Beginning of the transfer is not found')
+        if not len(ends):
+            raise DecodingFailedException('Transfer is incomplete')
+
+        first = int(starts[-1])
+        last = position + int(ends[0])
+        if numpy.count_nonzero(tails[first + 1:last + 1] & 0x80) or numpy.count_nonzero(tails[first:last] & 0x40):
+            raise DecodingFailedException('Transfer is malformed')
+
+        return tuple(begin + int(x) for x in positions[first:last + 1])
+
+
+def decode_transfer(frames):
+    """Accepts a list of CANFrame, returns the decoded payload rendered in YAML."""
     tr = Transfer()
     tr.from_frames([Frame(x.id, x.data) for x in frames])
-
-    return related_rows, pyuavcan_v0.to_yaml(tr.payload)
+    return pyuavcan_v0.to_yaml(tr.payload)
+
+
+class TransferRenderer(QObject):
+    """
+    Decodes transfers and renders them in YAML on a worker thread, so that the GUI never waits for the decoder.
+    The renderings are kept in an LRU cache keyed by the frame span of the transfer, i.e. the sequence numbers of its
+    first and last frames, which are never reused by a FrameStore.
+    Only the latest request is served; the requests that have been superseded before the worker got to them
+    are discarded. The results are delivered via the signal 'rendered' in the thread that owns this object.
+    """
+    DEFAULT_CACHE_SIZE = 1000
+
+    rendered = pyqtSignal(object, str)          # Key, text
+
+    def __init__(self, parent=None, cache_size=DEFAULT_CACHE_SIZE):
+        super(TransferRenderer, self).__init__(parent)
+        self._cache_size = cache_size
+        self._cache = OrderedDict()             # Key : text
+        self._condition = threading.Condition()
+        self._pending = None                    # Key, list of CANFrame
+        self._thread = None
+
+    @staticmethod
+    def get_key(seqs):
+        return seqs[0], seqs[-1]
+
+    def get_cached(self, key):
+        """Returns the rendering if it is cached, otherwise None."""
+        with self._condition:
+            try:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            except KeyError:
+                return None
+
+    def request(self, key, frames):
+        """Schedules rendering of the transfer composed of the list of CANFrame; supersedes the previous request."""
+        with self._condition:
+            self._pending = key, frames
+            self._condition.notify()
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='transfer_renderer', daemon=True)
+            self._thread.start()
+
+    def clear(self):
+        with self._condition:
+            self._cache.clear()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                key, frames = self._pending
+                self._pending = None
+
+            try:
+                text = decode_transfer(frames)
+            except Exception as ex:
+                logger.debug('Transfer could not be decoded', exc_info=True)
+                text = 'Transfer could not be decoded:\n' + str(ex)
+
+            with self._condition:
+                self._cache[key] = text
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+            self.rendered.emit(key, text)
@@ -0,0 +1,216 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+from logging import getLogger
+
+import numpy
+from PyQt5.QtWidgets import QWidget, QHBoxLayout, QLabel, QSpinBox, QCheckBox
+
+from .frame_filter import StructuredFilter, RecordColumns, FILTER_SYNTAX_HELP
+from .. import CommitableComboBoxWithHistory, SearchMatcher, make_icon_button, show_error
+from ..ring_buffers import RingBuffer
+from ...frame_record import FRAME_RECORD_DTYPE
+
+logger = getLogger(__name__)
+
+# The predicates are the same as in the filter expressions, except that plain text is not accepted and the data type
+# is always matched as a regular expression
+TRIGGER_SYNTAX_HELP = ('Trigger condition: whitespace-separated predicates that must all hold, e.g.\n' +
+                       FILTER_SYNTAX_HELP.split('\n', 2)[2].replace('substring or regular expression as configured',
+                                                                     'regular expression'))
+
+
+class FrameTrigger:
+    """
+    Oscilloscope-style trigger over the stream of frames. While armed, the most recent frames are kept in a circular
+    pre-trigger buffer; once a frame matches the condition, the buffer, the matching frame and the specified number
+    of the following frames are returned as a window. The condition is evaluated over whole batches as a NumPy mask,
+    so the cost per frame is small and constant.
+    If auto re-arm is disabled, the trigger disarms itself after the first window has been collected.
+    """
+
+    def __init__(self, condition, pre_trigger, post_trigger, auto_rearm=False):
+        """The condition is a StructuredFilter, see parse_condition()."""
+        self._condition = condition
+        self._post_trigger = int(post_trigger)
+        self._history = RingBuffer(pre_trigger, None, dtype=FRAME_RECORD_DTYPE) if pre_trigger > 0 else None
+        self._window = None                     # Parts of the window being collected, None if waiting for a trigger
+        self._trigger_index = 0
+        self._remaining = 0
+        self._armed = True
+
+        self.auto_rearm = auto_rearm
+        self.num_hits = 0
+
+    @staticmethod
+    def parse_condition(expression):
+        """Raises SearchMatcher.BadPatternException if the expression is malformed or not structured."""
+        condition = StructuredFilter.parse(SearchMatcher(expression, use_regex=True, case_sensitive=False))
+        if condition is None:
+            raise SearchMatcher.BadPatternException('Trigger condition must consist of predicates, such as id=... '
+                                                    'or type=...; plain text is not supported')
+        return condition
+
+    def _remember(self, records):
+        if self._history is not None:
+            self._history.extend(records)
+
+    def process(self, records):
+        """
+        Accepts an array of FRAME_RECORD_DTYPE. Returns a list of the windows completed by the new frames,
+        where each window is a tuple of (array of FRAME_RECORD_DTYPE, index of the trigger frame in the window).
+        """
+        out = []
+        mask = None
+        pos = 0
+        while pos < len(records) and self._armed:
+            if self._window is None:
+                if mask is None:
+                    mask = self._condition.evaluate(RecordColumns(records))
+                hits = numpy.flatnonzero(mask[pos:])
+                if len(hits) == 0:
+                    self._remember(records[pos:])
+                    break
+
+                hit = pos + int(hits[0])
+                self._remember(records[pos:hit])
+                pre_trigger = self._history.data.copy() if self._history is not None else records[:0]
+                if self._history is not None:
+                    self._history.clear()
+                self._window = [pre_trigger]
+                self._trigger_index = len(pre_trigger)
+                self._remaining = self._post_trigger + 1
+                self.num_hits += 1
+                pos = hit
+
+            chunk = records[pos:pos + self._remaining]
+            self._window.append(chunk)
+            self._remaining -= len(chunk)
+            pos += len(chunk)
+            if self._remaining == 0:
+                out.append((numpy.concatenate(self._window), self._trigger_index))
+                self._window = None
+                self._armed = self.auto_rearm
+        return out
+
+    @property
+    def armed(self):
+        return self._armed
+
+    @property
+    def triggered(self):
+        """True while the frames following a trigger hit are being collected."""
+        return self._window is not None
+
+
+class TriggerBar(QWidget):
+    """
+    Trigger configuration controls. on_arm(FrameTrigger) is invoked when the user arms the trigger,
+    on_disarm() when the user disarms it.
+    """
+    DEFAULT_PRE_TRIGGER = 100
+    DEFAULT_POST_TRIGGER = 100
+    MAX_TRIGGER_WINDOW = 1000000
+
+    def __init__(self, parent):
+        super(TriggerBar, self).__init__(parent)
+
+        self.on_arm = lambda _: None
+        self.on_disarm = lambda: None
+
+        self._trigger = None
+
+        self._condition = CommitableComboBoxWithHistory(self)
+        self._condition.setToolTip(TRIGGER_SYNTAX_HELP)
+        self._condition.lineEdit().setPlaceholderText('Trigger condition, e.g. type=NodeStatus src=10')
+        self._condition.on_commit = self._arm
+
+        def make_window_spinbox(value, tool_tip):
+            spinbox = QSpinBox(self)
+            spinbox.setRange(0, self.MAX_TRIGGER_WINDOW)
+            spinbox.setValue(value)
+            spinbox.setToolTip(tool_tip)
+            return spinbox
+
+        self._pre_trigger = make_window_spinbox(self.DEFAULT_PRE_TRIGGER,
+                                                'Number of frames preceding the trigger frame to display')
+        self._post_trigger = make_window_spinbox(self.DEFAULT_POST_TRIGGER,
+                                                 'Number of frames following the trigger frame to display')
+
+        self._auto_rearm = QCheckBox('Auto re-arm', self)
+        self._auto_rearm.setToolTip('Re-arm the trigger after every hit; otherwise it fires only once')
+        self._auto_rearm.toggled.connect(self._on_auto_rearm_toggled)
+
+        self._arm_button = make_icon_button('crosshairs', 'Arm the trigger [Enter]', self, checkable=True,
+                                            on_clicked=self._on_arm_button_clicked, text='Arm')
+
+        self._status = QLabel(self)
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self._condition, 1)
+        layout.addWidget(QLabel('Pre:', self))
+        layout.addWidget(self._pre_trigger)
+        layout.addWidget(QLabel('Post:', self))
+        layout.addWidget(self._post_trigger)
+        layout.addWidget(self._auto_rearm)
+        layout.addWidget(self._arm_button)
+        layout.addWidget(self._status)
+        self.setLayout(layout)
+
+        self.update_status()
+
+    def _arm(self):
+        self._arm_button.setChecked(True)
+        self._on_arm_button_clicked()
+
+    def _on_auto_rearm_toggled(self, checked):
+        if self._trigger is not None:
+            self._trigger.auto_rearm = checked
+
+    def _on_arm_button_clicked(self):
+        if not self._arm_button.isChecked():
+            self._trigger = None
+            self.update_status()
+            self.on_disarm()
+            return
+
+        self._condition.add_current_text_to_history()
+        try:
+            condition = FrameTrigger.parse_condition(self._condition.currentText())
+        except Exception as ex:
+            self._arm_button.setChecked(False)
+            show_error('Trigger error', 'Invalid trigger condition', ex, self)
+            return
+
+        self._trigger = FrameTrigger(condition, self._pre_trigger.value(), self._post_trigger.value(),
+                                     auto_rearm=self._auto_rearm.isChecked())
+        self.update_status()
+        self.on_arm(self._trigger)
+
+    def disarm(self):
+        if self._arm_button.isChecked():
+            self._arm_button.setChecked(False)
+            self._on_arm_button_clicked()
+
+    def update_status(self):
+        """Must be invoked after the trigger has processed new frames."""
+        trigger = self._trigger
+        if trigger is None:
+            self._status.setText('Disarmed')
+        elif trigger.triggered:
+            self._status.setText('Triggered (%d)' % trigger.num_hits)
+        elif trigger.armed:
+            self._status.setText('Armed (%d)' % trigger.num_hits)
+        else:
+            self._status.setText('Stopped (%d)' % trigger.num_hits)
+            self._arm_button.setChecked(False)       # The window stays frozen until the user re-arms the trigger
+
+    @property
+    def trigger(self):
+        return self._trigger
@@ -9,83 +9,32 @@
 import datetime
 import os
 import time
-from functools import partial
 from logging import getLogger
 
+import numpy
 import pyuavcan_v0
+from pyuavcan_v0.driver import CANFrame
 from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QColor, QIcon, QTextOption
+from PyQt5.QtGui import QColor, QTextOption
 from PyQt5.QtWidgets import QMainWindow, QHeaderView, QLabel, QSplitter, QSizePolicy, QWidget, QHBoxLayout, \
-    QPlainTextEdit, QDialog, QVBoxLayout, QMenu, QAction
-from pyuavcan_v0.driver import CANFrame
-
-from .transfer_decoder import decode_transfer_from_frame
-from .. import BasicTable, map_7bit_to_color, RealtimeLogWidget, get_monospace_font, get_icon, flash, get_app_icon, \
-    show_error
+    QPlainTextEdit, QDialog, QVBoxLayout, QMenu, QAction, QFileDialog
+
+from .can_id import decode_can_id, invalidate_can_id_cache
+from .frame_store import CaptureFrameStore
+from .frame_table import FrameLogWidget, FrameColumn
+from .traffic_stat import TrafficStatCounter, TrafficBreakdownWidget
+from .timing_analysis import TimingAnalyzer, TimingAnalysisWindow
+from .transfer_decoder import TransferIndex, TransferLocator, TransferRenderer
+from .trigger import TriggerBar
+from .. import get_monospace_font, get_icon, flash, get_app_icon, show_error, make_icon_button
+from ..ipc_stats import format_ipc_stats
+from ..ring_buffers import DecimatingRingBuffer
+from ...capture_file import CaptureWriter, CaptureReader, FILE_EXTENSION
 from ...thirdparty.pyqtgraph import PlotWidget, mkPen
 
 logger = getLogger(__name__)
 
 
-def parse_can_frame(frame):
-    if frame.extended:
-        can_id = frame.id
-        source_node_id = can_id & 0x7F
-
-        service_not_message = bool((can_id >> 7) & 1)
-        if service_not_message:
-            destination_node_id = (can_id >> 8) & 0x7F
-            request_not_response = bool((can_id >> 15) & 1)
-            service_type_id = (can_id >> 16) & 0xFF
-            try:
-                data_type_name = pyuavcan_v0.DATATYPES[
-                    (service_type_id, pyuavcan_v0.dsdl.CompoundType.KIND_SERVICE)].full_name
-            except KeyError:
-                data_type_name = '<unknown service %d>' % service_type_id
-        else:
-            message_type_id = (can_id >> 8) & 0xFFFF
-            if source_node_id == 0:
-                source_node_id = 'Anon'
-                message_type_id &= 0b11
-            destination_node_id = ''
-            try:
-                data_type_name = pyuavcan_v0.DATATYPES[
-                    (message_type_id, pyuavcan_v0.dsdl.CompoundType.KIND_MESSAGE)].full_name
-            except KeyError:
-                data_type_name = '<unknown message %d>' % message_type_id
-    else:
-        data_type_name = 'N/A'
-        source_node_id = 'N/A'
-        destination_node_id = 'N/A'
-
-    return {
-        'data_type': data_type_name,
-        'src': source_node_id,
-        'dst': destination_node_id,
-    }
-
-
-def render_node_id_with_color(frame, field):
-    nid = parse_can_frame(frame)[field]
-    return nid, (map_7bit_to_color(nid) if isinstance(nid, int) else None)
-
-
-def render_data_type_with_color(frame):
-    dtname = parse_can_frame(frame)['data_type']
-    color_hash = sum(dtname.encode('ascii')) & 0xF7
-    return dtname, map_7bit_to_color(color_hash)
-
-
-def colorize_can_id(frame):
-    if not frame.extended:
-        return
-    mask = 0b11111
-    priority = (frame.id >> 24) & mask
-    col = QColor()
-    col.setRgb(0xFF, 0xFF - (mask - priority) * 6, 0xFF)
-    return col
-
-
 def colorize_transfer_id(e):
     if len(e[1].data) < 1:
         return
@@ -104,171 +53,211 @@ def colorize_transfer_id(e):
 class TimestampRenderer:
     FORMAT = '%H:%M:%S.%f'
 
-    def __init__(self):
-        self._prev_ts = 0
-
-    def __call__(self, e):
-        ts = datetime.datetime.fromtimestamp(e[1].ts_real).strftime(self.FORMAT)
+    def __call__(self, store, seq):
+        ts_real = store.ts_real[store.slot(seq)]
+        ts = datetime.datetime.fromtimestamp(ts_real).strftime(self.FORMAT)
         col = QColor()
 
         # Constraining delta to [0, 1]
-        delta = min(1, e[1].ts_real - self._prev_ts)
+        prev_ts_real = store.ts_real[store.slot(seq - 1)] if (seq - 1) in store else ts_real
+        delta = min(1, ts_real - prev_ts_real)
         if delta < 0:
             col.setRgb(255, 230, 230)
         else:
-            self._prev_ts = e[1].ts_real
             col.setRgb(*([255 - int(192 * delta)] * 3))
         return ts, col
 
-    @staticmethod
-    def compute_timestamp_difference(earlier, later):
-        def s2delta(string):
-            h, m, s = [float(x) for x in string.split(':')]
-            return datetime.timedelta(hours=h, minutes=m, seconds=s)
-        return (s2delta(later) - s2delta(earlier)).total_seconds()
-
-
-class TrafficStatCounter:
-    MOVING_AVERAGE_LENGTH = 4
-    FPS_ESTIMATION_WINDOW = 0.5
-
-    def __init__(self):
-        self._rx = 0
-        self._tx = 0
-        self._fps = 0
-        self._prev_fps_checkpoint_mono = 0
-        self._frames_since_fps_checkpoint = 0
-        self._last_fps_estimates = [0] * self.MOVING_AVERAGE_LENGTH
-
-    def add_frame(self, direction, frame):
-        if direction == 'tx':
-            self._tx += 1
-        else:
-            self._rx += 1
 
-        # Updating FPS estimate.
-        # It is extremely important that the algorithm relies only on the timestamps provided by the driver!
-        # Naive timestamping produces highly unreliable estimates, because the application is not nearly real-time.
-        self._frames_since_fps_checkpoint += 1
-        if direction == 'rx':
-            dt = frame.ts_monotonic - self._prev_fps_checkpoint_mono
-            if dt >= self.FPS_ESTIMATION_WINDOW:
-                self._last_fps_estimates.pop()
-                self._last_fps_estimates.insert(0, self._frames_since_fps_checkpoint / dt)
-                self._prev_fps_checkpoint_mono = frame.ts_monotonic
-                self._frames_since_fps_checkpoint = 0
+def render_frame(renderer):
+    """Adapts a renderer that accepts a (direction, CANFrame) tuple to the FrameStore interface."""
+    return lambda store, seq: renderer(store.get_frame(seq))
 
-    @property
-    def rx(self):
-        return self._rx
 
-    @property
-    def tx(self):
-        return self._tx
+def render_can_id_info(field, color_field):
+    def render(store, seq):
+        slot = store.slot(seq)
+        info = decode_can_id(int(store.can_id[slot]), bool(store.extended[slot]))
+        return getattr(info, field), getattr(info, color_field)
+    return render
 
-    @property
-    def total(self):
-        return self._rx + self._tx
 
-    def get_frames_per_second(self):
-        return (sum(self._last_fps_estimates) / len(self._last_fps_estimates)), self._prev_fps_checkpoint_mono
+def match_can_id_info(field):
+    """Vectorised counterpart of render_can_id_info() for search; every distinct CAN ID is checked only once."""
+    def match(store, slots, matcher):
+        keys = store.can_id[slots].astype(numpy.int64) | (store.extended[slots].astype(numpy.int64) << 32)
+        unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+        unique_mask = numpy.fromiter((matcher.match(str(getattr(decode_can_id(int(k) & 0xFFFFFFFF, bool(k >> 32)),
+                                                                field)))
+                                      for k in unique_keys.tolist()), dtype=numpy.bool_, count=len(unique_keys))
+        return unique_mask[inverse.reshape(-1)]
+    return match
 
 
-COLUMNS = [
-    BasicTable.Column('Dir',
-                      lambda e: (e[0].upper()),
-                      searchable=False),
-    BasicTable.Column('Local Time', TimestampRenderer(), searchable=False),
-    BasicTable.Column('CAN ID',
-                      lambda e: (('%0*X' % (8 if e[1].extended else 3, e[1].id)).rjust(8),
-                                 colorize_can_id(e[1]))),
-    BasicTable.Column('Data Hex',
-                      lambda e: (' '.join(['%02X' % x for x in e[1].data]).ljust(3 * e[1].MAX_DATA_LENGTH),
-                                 colorize_transfer_id(e))),
-    BasicTable.Column('Data ASCII',
-                      lambda e: (''.join([(chr(x) if 32 <= x <= 126 else '.') for x in e[1].data]),
-                                 colorize_transfer_id(e))),
-    BasicTable.Column('Src',
-                      lambda e: render_node_id_with_color(e[1], 'src')),
-    BasicTable.Column('Dst',
-                      lambda e: render_node_id_with_color(e[1], 'dst')),
-    BasicTable.Column('Data Type',
-                      lambda e: render_data_type_with_color(e[1]),
-                      resize_mode=QHeaderView.Stretch),
-]
+def match_rendered_bytes(matcher, texts):
+    """Matches an array of ASCII byte strings against the SearchMatcher; plain text patterns are matched in NumPy."""
+    if matcher.use_regex or matcher.inverse:
+        return numpy.fromiter((matcher.match(x.decode('ascii')) for x in texts.tolist()),
+                              dtype=numpy.bool_, count=len(texts))
+
+    pattern = matcher.pattern
+    if not matcher.case_sensitive:
+        pattern = pattern.lower()
+        texts = numpy.char.lower(texts)
+    try:
+        pattern = pattern.encode('ascii')
+    except UnicodeEncodeError:
+        return numpy.zeros(len(texts), dtype=numpy.bool_)
+    return numpy.char.find(texts, pattern) >= 0
 
 
-def row_to_frame(table, row_index):
-    if row_index >= table.rowCount():
-        return None, None
+_HEX_DIGITS = numpy.frombuffer(b'0123456789ABCDEF', dtype=numpy.uint8)
 
-    can_id = None
-    payload = None
-    extended = None
-    direction = None
 
-    for col_index, col_spec in enumerate(COLUMNS):
-        item = table.item(row_index, col_index).text()
-        if col_spec.name == 'CAN ID':
-            extended = len(item.strip()) > 3
-            can_id = int(item, 16)
-        if col_spec.name == 'Data Hex':
-            payload = bytes([int(x, 16) for x in item.split()])
-        if col_spec.name == 'Dir':
-            direction = item.strip()
+def match_data_hex(store, slots, matcher):
+    data, dlc = store.data[slots], store.dlc[slots]
+    valid = numpy.arange(CANFrame.MAX_DATA_LENGTH) < dlc[:, None]
+    text = numpy.full(data.shape + (3,), ord(' '), dtype=numpy.uint8)       # Same layout as the rendered column
+    text[:, :, 0] = numpy.where(valid, _HEX_DIGITS[data >> 4], ord(' '))
+    text[:, :, 1] = numpy.where(valid, _HEX_DIGITS[data & 0xF], ord(' '))
+    texts = text.reshape(len(slots), -1).view('S%d' % (3 * CANFrame.MAX_DATA_LENGTH)).reshape(-1)
+    return match_rendered_bytes(matcher, texts)
 
-    assert all(map(lambda x: x is not None, [can_id, payload, extended, direction]))
-    return CANFrame(can_id, payload, extended, ts_monotonic=-1, ts_real=-1), direction
+
+def match_data_ascii(store, slots, matcher):
+    data, dlc = store.data[slots], store.dlc[slots]
+    valid = numpy.arange(CANFrame.MAX_DATA_LENGTH) < dlc[:, None]
+    text = numpy.where((data >= 32) & (data <= 126), data, ord('.'))
+    text = numpy.ascontiguousarray(numpy.where(valid, text, 0), dtype=numpy.uint8)  # Trailing NUL are stripped
+    return match_rendered_bytes(matcher, text.view('S%d' % CANFrame.MAX_DATA_LENGTH).reshape(-1))
+
+
+COLUMNS = [
+    FrameColumn('Dir',
+                lambda store, seq: store.get_direction(seq).upper(),
+                searchable=False),
+    FrameColumn('Local Time', TimestampRenderer(), searchable=False),
+    FrameColumn('CAN ID', render_can_id_info('text', 'can_id_color'), match_can_id_info('text')),
+    FrameColumn('Data Hex',
+                render_frame(lambda e: (' '.join(['%02X' % x for x in e[1].data]).ljust(3 * e[1].MAX_DATA_LENGTH),
+                                        colorize_transfer_id(e))),
+                match_data_hex),
+    FrameColumn('Data ASCII',
+                render_frame(lambda e: (''.join([(chr(x) if 32 <= x <= 126 else '.') for x in e[1].data]),
+                                        colorize_transfer_id(e))),
+                match_data_ascii),
+    FrameColumn('Src', render_can_id_info('src', 'src_color'), match_can_id_info('src')),
+    FrameColumn('Dst', render_can_id_info('dst', 'dst_color'), match_can_id_info('dst')),
+    FrameColumn('Data Type', render_can_id_info('data_type', 'data_type_color'), match_can_id_info('data_type'),
+                resize_mode=QHeaderView.Stretch),
+]
 
 
 class BusMonitorWindow(QMainWindow):
     DEFAULT_PLOT_X_RANGE = 120
     BUS_LOAD_PLOT_MAX_SAMPLES = 50000
 
-    def __init__(self, get_frame, iface_name):
+    CAPTURE_FILE_FILTER = 'CAN capture files (*%s);;All files (*)' % FILE_EXTENSION
+    CAPTURE_STAT_CHUNK_SIZE = 100000
+    DECODING_NOTICE_DELAY_MS = 200
+
+    def __init__(self, get_frames, iface_name, get_ipc_stats, capture=None, bitrate=None):
+        """
+        If a CaptureReader is supplied, the window displays the capture instead of the live traffic.
+        The bitrate is used to estimate the bus load; if not known, the default is assumed.
+        get_ipc_stats() returns the IPCChannelStats of the channel the live frames are received from.
+        """
         super(BusMonitorWindow, self).__init__()
-        self.setWindowTitle('CAN bus monitor (%s)' % iface_name.split(os.path.sep)[-1])
+        if capture is None:
+            self.setWindowTitle('CAN bus monitor (%s)' % iface_name.split(os.path.sep)[-1])
+        else:
+            self.setWindowTitle('CAN capture (%s)' % os.path.basename(capture.path))
         self.setWindowIcon(get_app_icon())
 
         # get dsdl_directory from parent process, if set
         dsdl_directory = os.environ.get('UAVCAN_CUSTOM_DSDL_PATH', None)
         if dsdl_directory:
             pyuavcan_v0.load_dsdl(dsdl_directory)
+            invalidate_can_id_cache()
 
-        self._get_frame = get_frame
+        self._get_frames = get_frames
+        self._get_ipc_stats = get_ipc_stats
+        self._capture = capture
+        self._capture_writer = None
+        self._capture_windows = []
 
-        self._log_widget = RealtimeLogWidget(self, columns=COLUMNS, font=get_monospace_font(),
-                                             pre_redraw_hook=self._redraw_hook)
+        self._log_widget = FrameLogWidget(self, columns=COLUMNS, font=get_monospace_font(),
+                                          pre_redraw_hook=self._redraw_hook,
+                                          store=CaptureFrameStore(capture.records) if capture else None)
         self._log_widget.on_selection_changed = self._update_measurement_display
 
-        self._log_widget.table.cellClicked.connect(lambda row, col: self._decode_transfer_at_row(row))
+        if capture is None:
+            self._transfer_index = TransferIndex(self._log_widget.store)
+        else:
+            self._transfer_index = TransferLocator(self._log_widget.store)
+
+        self._log_widget.table.clicked.connect(lambda index: self._decode_transfer_at_row(index.row()))
 
         self._log_widget.table.setContextMenuPolicy(Qt.CustomContextMenu)
         self._log_widget.table.customContextMenuRequested.connect(self._context_menu_requested)
 
-        self._stat_display = QLabel('0 / 0 / 0', self)
-        stat_display_label = QLabel('TX / RX / FPS: ', self)
+        self._record_button = make_icon_button('circle', 'Record all received frames to a capture file', self,
+                                               checkable=True, on_clicked=self._on_record_button_clicked)
+        self._open_capture_button = make_icon_button('folder-open-o', 'Open a capture file', self,
+                                                     on_clicked=self._open_capture)
+        self._timing_analysis_button = make_icon_button('clock-o', 'Transfer timing analysis', self,
+                                                        on_clicked=self._show_timing_analysis)
+        self._log_widget.custom_area_layout.addWidget(self._record_button)
+        self._log_widget.custom_area_layout.addWidget(self._open_capture_button)
+        self._trigger_button = make_icon_button('crosshairs', 'Trigger mode: display only the frames around the '
+                                                'frames that match the trigger condition', self,
+                                                checkable=True, on_clicked=self._on_trigger_button_clicked)
+        self._log_widget.custom_area_layout.addWidget(self._timing_analysis_button)
+        self._log_widget.custom_area_layout.addWidget(self._trigger_button)
+
+        self._trigger_bar = TriggerBar(self)
+        self._trigger_bar.on_arm = self._on_trigger_armed
+        self._trigger_bar.hide()
+
+        self._stat_display = QLabel('0 / 0 / 0 / 0% / 0 / 0', self)
+        stat_display_label = QLabel('TX / RX / FPS / Load / Lost / Queued: ', self)
         stat_display_label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
         self._log_widget.custom_area_layout.addWidget(stat_display_label)
         self._log_widget.custom_area_layout.addWidget(self._stat_display)
 
-        def flip_row_mark(row, col):
-            if col == 0:
-                item = self._log_widget.table.item(row, col)
-                if item.icon().isNull():
-                    item.setIcon(get_icon('circle'))
-                    flash(self, 'Row %d was marked, click again to unmark', row, duration=3)
-                else:
-                    item.setIcon(QIcon())
+        if capture is not None:
+            self._record_button.hide()
+            self._trigger_button.hide()
+            stat_display_label.setText('Frames / Duration: ')
+
+        def flip_row_mark(index):
+            if index.column() == 0:
+                if self._log_widget.model.toggle_mark(index.row()):
+                    flash(self, 'Row %d was marked, click again to unmark', index.row(), duration=3)
 
-        self._log_widget.table.cellPressed.connect(flip_row_mark)
+        self._log_widget.table.pressed.connect(flip_row_mark)
 
         self._stat_update_timer = QTimer(self)
         self._stat_update_timer.setSingleShot(False)
         self._stat_update_timer.timeout.connect(self._update_stat)
-        self._stat_update_timer.start(500)
+        if capture is None:
+            self._stat_update_timer.start(500)
+
+        self._timing_analyzer = TimingAnalyzer()
+        self._capture_scan_position = None      # Number of the capture frames counted so far, None once done
+        self._capture_scan_timer = QTimer(self)
+        self._capture_scan_timer.setSingleShot(False)
+        self._capture_scan_timer.timeout.connect(self._scan_capture)
+        if capture is None:
+            self._traffic_stat = TrafficStatCounter(bitrate)
+        else:
+            # The rates of a capture are averaged over its whole duration. The capture is counted in chunks from
+            # the event loop, so that a large file neither delays the window nor is paged in all at once.
+            self._traffic_stat = TrafficStatCounter(bitrate, estimation_window=float('inf'))
+            self._capture_scan_position = 0
+            self._capture_scan_timer.start(0)
+            self._update_capture_stat_display()
 
-        self._traffic_stat = TrafficStatCounter()
+        self._traffic_breakdown = TrafficBreakdownWidget(self, self._traffic_stat)
 
         self._decoded_message_box = QPlainTextEdit(self)
         self._decoded_message_box.setReadOnly(True)
@@ -279,6 +268,10 @@ class BusMonitorWindow(QMainWindow):
         self._decoded_message_box.setLineWrapMode(QPlainTextEdit.NoWrap)
         self._decoded_message_box.setWordWrapMode(QTextOption.NoWrap)
 
+        self._transfer_renderer = TransferRenderer(self)
+        self._transfer_renderer.rendered.connect(self._on_transfer_rendered)
+        self._displayed_transfer = None         # Key of the transfer that is displayed or is being rendered
+
         self._load_plot = PlotWidget(background=(0, 0, 0))
         self._load_plot.setRange(xRange=(0, self.DEFAULT_PLOT_X_RANGE), padding=0)
         self._load_plot.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
@@ -287,17 +280,27 @@ class BusMonitorWindow(QMainWindow):
         self._load_plot.getPlotItem().getViewBox().setMouseEnabled(x=True, y=False)
         self._load_plot.enableAutoRange()
         self._bus_load_plot = self._load_plot.plot(name='Frames per second', pen=mkPen(QColor(Qt.lightGray), width=1))
-        self._bus_load_samples = [], []
+        self._bus_load_samples = DecimatingRingBuffer(self.BUS_LOAD_PLOT_MAX_SAMPLES)
         self._started_at_mono = time.monotonic()
+        self._load_plot.getPlotItem().getViewBox().sigXRangeChanged.connect(self._redraw_bus_load_plot)
 
         self._footer_splitter = QSplitter(Qt.Horizontal, self)
         self._footer_splitter.addWidget(self._decoded_message_box)
         self._decoded_message_box.setMinimumWidth(400)
         self._footer_splitter.addWidget(self._load_plot)
         self._load_plot.setMinimumWidth(200)
+        self._footer_splitter.addWidget(self._traffic_breakdown)
+        self._traffic_breakdown.setMinimumWidth(200)
+
+        log_container = QWidget(self)
+        log_layout = QVBoxLayout(log_container)
+        log_layout.setContentsMargins(0, 0, 0, 0)
+        log_layout.addWidget(self._trigger_bar)
+        log_layout.addWidget(self._log_widget, 1)
+        log_container.setLayout(log_layout)
 
         splitter = QSplitter(Qt.Vertical, self)
-        splitter.addWidget(self._log_widget)
+        splitter.addWidget(log_container)
         self._log_widget.setMinimumHeight(200)
         splitter.addWidget(self._footer_splitter)
 
@@ -322,60 +325,210 @@ class BusMonitorWindow(QMainWindow):
         super(BusMonitorWindow, self).resizeEvent(qresizeevent)
         self._update_widget_sizes()
 
+    def _redraw_bus_load_plot(self):
+        # Only the visible range is rendered, decimated down to about two points per horizontal pixel
+        (xmin, xmax), _ = self._load_plot.viewRange()
+        max_points = max(100, 2 * self._load_plot.width())
+        self._bus_load_plot.setData(*self._bus_load_samples.get(xmin, xmax, max_points))
+
+    def _update_capture_stat_display(self):
+        span = self._capture.time_span or (0, 0)
+        text = '%d / %.3f sec' % (len(self._capture), span[1] - span[0])
+        if self._capture_scan_position is not None:
+            text += ' (analyzing, %.0f%%)' % (100 * self._capture_scan_position / max(len(self._capture), 1))
+        self._stat_display.setText(text)
+
+    def _scan_capture(self):
+        begin = self._capture_scan_position
+        chunk = self._capture.records[begin:begin + self.CAPTURE_STAT_CHUNK_SIZE]
+        self._traffic_stat.add_frames(chunk)
+        self._timing_analyzer.add_frames(chunk)
+        self._capture_scan_position = begin + len(chunk)
+
+        if self._capture_scan_position >= len(self._capture):
+            self._capture_scan_timer.stop()
+            self._capture_scan_position = None
+            self._traffic_stat.update_rates()
+            self._traffic_breakdown.update_table()
+        self._update_capture_stat_display()
+
     def _update_stat(self):
         bus_load, ts_mono = self._traffic_stat.get_frames_per_second()
+        x = ts_mono - self._started_at_mono
+        self._bus_load_samples.append(x, bus_load)
+
+        (xmin, xmax), _ = self._load_plot.viewRange()
+        diff = xmax - xmin
+        self._load_plot.setRange(xRange=(x - diff, x), padding=0)
+        self._redraw_bus_load_plot()
+
+        if self._traffic_breakdown.isVisible():
+            self._traffic_breakdown.update_table()
+
+    def _on_record_button_clicked(self):
+        if self._record_button.isChecked():
+            path, _ = QFileDialog.getSaveFileName(self, 'Record frames to file', 'capture' + FILE_EXTENSION,
+                                                  self.CAPTURE_FILE_FILTER)
+            if not path:
+                self._record_button.setChecked(False)
+                return
+            try:
+                self._capture_writer = CaptureWriter(path)
+            except Exception as ex:
+                self._record_button.setChecked(False)
+                show_error('Recording error', 'Could not create the capture file', ex, self)
+                return
+            flash(self, 'Recording to %s', path)
+        else:
+            self._stop_recording()
+
+    def _stop_recording(self):
+        if self._capture_writer is not None:
+            self._capture_writer.close()
+            flash(self, '%d frames have been recorded to %s',
+                  self._capture_writer.num_records, self._capture_writer.path, duration=5)
+            self._capture_writer = None
+        self._record_button.setChecked(False)
+
+    def _open_capture(self):
+        path, _ = QFileDialog.getOpenFileName(self, 'Open capture file', '', self.CAPTURE_FILE_FILTER)
+        if not path:
+            return
+        try:
+            capture = CaptureReader(path)
+        except Exception as ex:
+            show_error('Capture error', 'Could not open the capture file', ex, self)
+            return
 
-        if len(self._bus_load_samples[0]) >= self.BUS_LOAD_PLOT_MAX_SAMPLES:
-            self._bus_load_samples[0].pop(0)
-            self._bus_load_samples[1].pop(0)
+        win = BusMonitorWindow(None, '', None, capture=capture, bitrate=self._traffic_stat.bitrate)
+        win.setAttribute(Qt.WA_DeleteOnClose)
+        win.destroyed.connect(lambda: self._capture_windows.remove(win))
+        self._capture_windows.append(win)
+        win.show()
 
-        self._bus_load_samples[1].append(bus_load)
-        self._bus_load_samples[0].append(ts_mono - self._started_at_mono)
+    def _on_trigger_button_clicked(self):
+        # While in the trigger mode, the live frames are not displayed, only the windows captured by the trigger
+        if self._trigger_button.isChecked():
+            self._trigger_bar.show()
+        else:
+            self._trigger_bar.disarm()
+            self._trigger_bar.hide()
 
-        self._bus_load_plot.setData(*self._bus_load_samples)
+    def _on_trigger_armed(self, _trigger):
+        self._log_widget.clear()
+        self._log_widget.start()
 
-        (xmin, xmax), _ = self._load_plot.viewRange()
-        diff = xmax - xmin
-        xmax = self._bus_load_samples[0][-1]
-        xmin = self._bus_load_samples[0][-1] - diff
-        self._load_plot.setRange(xRange=(xmin, xmax), padding=0)
+    def _add_triggered_frames(self, records):
+        trigger = self._trigger_bar.trigger
+        if trigger is None:
+            return
+
+        windows = trigger.process(records)
+        for window, trigger_index in windows:
+            self._log_widget.model.marked.add(self._log_widget.store.end + trigger_index)
+            self._log_widget.add_frames(window)
+        if windows:
+            flash(self, 'Trigger hit #%d, the trigger frame is marked', trigger.num_hits, duration=3)
+        self._trigger_bar.update_status()
+
+    def _show_timing_analysis(self):
+        if self._capture_scan_position is not None:
+            flash(self, 'The capture is still being analyzed, please try again in a moment', duration=3)
+            return
+        TimingAnalysisWindow(self, self._timing_analyzer, live=self._capture is None).show()
+
+    def closeEvent(self, qcloseevent):
+        self._stop_recording()
+        if self._capture is not None:
+            self._capture_scan_timer.stop()
+            self._log_widget.table.setModel(None)
+            self._capture.close()
+        super(BusMonitorWindow, self).closeEvent(qcloseevent)
 
     def _redraw_hook(self):
-        while True:
-            item = self._get_frame()
-            if item is None:
-                break
-            direction, frame = item
-            self._traffic_stat.add_frame(direction, frame)
-            # There is no need to maintain a second queue actually; should be refactored
-            self._log_widget.add_item_async((direction, frame))
+        if self._capture is not None:
+            return
+
+        records = self._get_frames()
+        if self._capture_writer is not None and len(records):
+            try:
+                self._capture_writer.write(records)
+            except Exception as ex:
+                logger.error('Capture file write failed', exc_info=True)
+                self._stop_recording()
+                show_error('Recording error', 'Could not write the capture file', ex, self)
+
+        self._traffic_stat.add_frames(records)
+        self._timing_analyzer.add_frames(records)
+        if self._trigger_button.isChecked():
+            self._add_triggered_frames(records)
+        else:
+            self._log_widget.add_frames(records)
+        self._transfer_index.update()
 
         bus_load, _ = self._traffic_stat.get_frames_per_second()
-        self._stat_display.setText('%d / %d / %d' % (self._traffic_stat.tx, self._traffic_stat.rx, bus_load))
+        ipc_stats = self._get_ipc_stats()
+        self._stat_display.setText('%d / %d / %d / %.1f%% / %d / %d' % (self._traffic_stat.tx, self._traffic_stat.rx,
+                                                                         bus_load,
+                                                                         self._traffic_stat.get_bus_utilization(),
+                                                                         ipc_stats.dropped, ipc_stats.queued))
+        self._stat_display.setToolTip('Frames forwarded from the main window:\n' + format_ipc_stats(ipc_stats))
 
     def _decode_transfer_at_row(self, row):
+        store = self._log_widget.store
         try:
-            rows, text = decode_transfer_from_frame(row, partial(row_to_frame, self._log_widget.table))
+            self._transfer_index.update()
+            seqs = self._transfer_index.get_transfer(self._log_widget.model.seq_at(row))
         except Exception as ex:
-            text = 'Transfer could not be decoded:\n' + str(ex)
-            rows = [row]
+            self._displayed_transfer = None
+            self._decoded_message_box.setPlainText('Transfer could not be decoded:\n' + str(ex))
+            return
 
-        self._decoded_message_box.setPlainText(text.strip())
+        key = TransferRenderer.get_key(seqs)
+        if key == self._displayed_transfer:
+            return
+        self._displayed_transfer = key
 
-    def _update_measurement_display(self, selected_rows_cols):
-        if not selected_rows_cols:
+        text = self._transfer_renderer.get_cached(key)
+        if text is not None:
+            self._decoded_message_box.setPlainText(text.strip())
+        else:
+            # The frames are collected here, because the store must not be accessed from the worker thread
+            self._transfer_renderer.request(key, [store.get_frame(x)[1] for x in seqs])
+            QTimer.singleShot(self.DECODING_NOTICE_DELAY_MS, lambda: self._show_decoding_notice(key))
+
+    def _show_decoding_notice(self, key):
+        if key == self._displayed_transfer and self._transfer_renderer.get_cached(key) is None:
+            self._decoded_message_box.setPlainText('Decoding...')
+
+    def _on_transfer_rendered(self, key, text):
+        if key == self._displayed_transfer:
+            self._decoded_message_box.setPlainText(text.strip())
+
+    def _get_ts_real_at_row(self, row):
+        """Returns None if the frame has been evicted from the store, which happens to the rows kept while paused."""
+        store = self._log_widget.store
+        seq = self._log_widget.model.seq_at(row)
+        if seq not in store:
+            return None
+        return store.ts_real[store.slot(seq)]
+
+    def _update_measurement_display(self, selected_rows):
+        if not selected_rows:
             return
 
-        min_row = min([row for row, _ in selected_rows_cols])
-        max_row = max([row for row, _ in selected_rows_cols])
+        min_row = min(selected_rows)
+        max_row = max(selected_rows)
 
         if min_row == max_row:
             self._decode_transfer_at_row(min_row)
 
         def get_ts_diff(row_earlier, row_later):
-            e = self._log_widget.table.item(row_earlier, 1).text()
-            l = self._log_widget.table.item(row_later, 1).text()
-            return TimestampRenderer.compute_timestamp_difference(e, l)
+            ts_earlier = self._get_ts_real_at_row(row_earlier)
+            ts_later = self._get_ts_real_at_row(row_later)
+            if ts_earlier is None or ts_later is None:
+                return None
+            return ts_later - ts_earlier
 
         def get_load_str(num_frames, dt):
             if dt >= 1e-6:
@@ -385,11 +538,15 @@ class BusMonitorWindow(QMainWindow):
         if min_row == max_row:
             num_frames = min_row
             dt = get_ts_diff(0, min_row)
+            if dt is None:
+                return
             flash(self, '%d frames from beginning, %.3f sec since first frame, %s',
                   num_frames, dt, get_load_str(num_frames, dt))
         else:
             num_frames = max_row - min_row + 1
             dt = get_ts_diff(min_row, max_row)
+            if dt is None:
+                return
             flash(self, '%d frames, timedelta %.6f sec, %s',
                   num_frames, dt, get_load_str(num_frames, dt))
 
@@ -405,7 +562,8 @@ class BusMonitorWindow(QMainWindow):
 
     def _show_data_type_definition(self, row):
         try:
-            data_type_name = self._log_widget.table.item(row, self._log_widget.table.columnCount() - 1).text()
+            _, frame = self._log_widget.store.get_frame(self._log_widget.model.seq_at(row))
+            data_type_name = decode_can_id(frame.id, frame.extended).data_type
             definition = pyuavcan_v0.TYPENAMES[data_type_name].source_text
         except Exception as ex:
             show_error('Data type lookup error', 'Could not load data type definition', ex, self)
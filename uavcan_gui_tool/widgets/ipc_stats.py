@@ -0,0 +1,99 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+from logging import getLogger
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QDialog, QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView, QLabel, \
+    QVBoxLayout
+
+from . import get_monospace_font, get_app_icon
+from ..ipc import IPCChannelStats
+
+logger = getLogger(__name__)
+
+
+def format_ipc_stats(stats):
+    return 'Delivered %d / Lost %d / Queued %d / Buffer %.0f%%' % (stats.delivered, stats.dropped, stats.queued,
+                                                                   100 * stats.ring_usage)
+
+
+class IPCStatsWindow(QDialog):
+    """
+    Data flow from this process to every child window: what has been sent, received by the window and lost
+    because the window could not keep up.
+    """
+    UPDATE_INTERVAL_MS = 1000
+
+    COLUMNS = [
+        ('Window', None),
+        ('PID', '%d'),
+        ('Enqueued', '%d'),
+        ('Delivered', '%d'),
+        ('Lost', '%d'),
+        ('Queued', '%d'),
+        ('Buffer %', '%.1f'),
+        ('Peak buffer %', '%.1f'),
+    ]
+
+    def __init__(self, parent, get_stats):
+        """get_stats() returns a list of tuples (window name, PID, IPCChannelStats)."""
+        super(IPCStatsWindow, self).__init__(parent)
+        self.setWindowTitle('Inter-process Communication Statistics')
+        self.setWindowIcon(get_app_icon())
+        self.setAttribute(Qt.WA_DeleteOnClose)
+
+        self._get_stats = get_stats
+
+        self._table = QTableWidget(self)
+        self._table.setColumnCount(len(self.COLUMNS))
+        self._table.setHorizontalHeaderLabels([name for name, _ in self.COLUMNS])
+        self._table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self._table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._table.setFont(get_monospace_font())
+        self._table.verticalHeader().setVisible(False)
+        self._table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self._table.horizontalHeader().setStretchLastSection(True)
+
+        self._summary = QLabel(self)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self._table, 1)
+        layout.addWidget(self._summary)
+        self.setLayout(layout)
+        self.resize(700, 250)
+
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(False)
+        self._update_timer.timeout.connect(self._update)
+        self._update_timer.start(self.UPDATE_INTERVAL_MS)
+        self._update()
+
+    def _update(self):
+        try:
+            entries = self._get_stats()
+        except Exception:
+            logger.error('Could not obtain the IPC statistics', exc_info=True)
+            return
+
+        self._table.setRowCount(len(entries))
+        for row, (name, pid, stats) in enumerate(entries):
+            values = (name, pid, stats.enqueued, stats.delivered, stats.dropped, stats.queued,
+                      100 * stats.ring_usage, 100 * stats.peak_ring_usage)
+            for col, ((_, fmt), value) in enumerate(zip(self.COLUMNS, values)):
+                item = QTableWidgetItem(str(value) if fmt is None else fmt % value)
+                if fmt is not None:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                if stats.dropped:
+                    item.setForeground(Qt.red)
+                self._table.setItem(row, col, item)
+
+        total = IPCChannelStats(*[sum(s[i] for _, _, s in entries) for i in range(4)],
+                                ring_usage=max([s.ring_usage for _, _, s in entries], default=0),
+                                peak_ring_usage=max([s.peak_ring_usage for _, _, s in entries], default=0))
+        self._summary.setText('%d windows. Total: %s' % (len(entries), format_ipc_stats(total)))
@@ -9,7 +9,6 @@
 import logging
 import multiprocessing
 import os
-import queue
 import sys
 
 import pyuavcan_v0
@@ -17,6 +16,7 @@ from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication
 
 from .window import PlotterWindow
+from ...ipc import IPCChannel
 
 logger = logging.getLogger(__name__)
 
@@ -29,36 +29,20 @@ except AttributeError:
     PARENT_PID = os.getppid()
 
 
-class IPCChannel:
-    """
-    This class is built as an abstraction over the underlying IPC communication channel.
-    """
-    def __init__(self):
-        # Queue is slower than pipe, but it allows to implement non-blocking sending easier,
-        # and the buffer can be arbitrarily large.
-        self._q = multiprocessing.Queue()
-
-    def send_nonblocking(self, obj):
-        try:
-            self._q.put_nowait(obj)
-        except queue.Full:
-            pass
-
-    def receive_nonblocking(self):
-        """Returns: (True, object) if successful, (False, None) if no data to read """
-        try:
-            return True, self._q.get_nowait()
-        except queue.Empty:
-            return False, None
-
-
 IPC_COMMAND_STOP = 'stop'
+IPC_COMMAND_ACTIVE_DATA_TYPES = 'active_data_types'      # Followed by a list of data type names
+IPC_FEEDBACK_DEMAND = 'demand'                          # Followed by the demand as reported by PlotterWindow
 
 
 def _process_entry_point(channel):
     logger.info('Plotter process started with PID %r', os.getpid())
     app = QApplication(sys.argv)  # Inheriting args from the parent process
 
+    # get dsdl_directory from parent process, if set; the transfers are decoded here
+    dsdl_directory = os.environ.get('UAVCAN_CUSTOM_DSDL_PATH', None)
+    if dsdl_directory:
+        pyuavcan_v0.load_dsdl(dsdl_directory)
+
     def exit_if_should():
         if RUNNING_ON_WINDOWS:
             return False
@@ -73,123 +57,257 @@ def _process_entry_point(channel):
     def get_transfer():
         received, obj = channel.receive_nonblocking()
         if received:
-            if obj == IPC_COMMAND_STOP:
+            return obj
+
+    win = PlotterWindow(get_transfer, channel.get_stats)
+    win.on_demand_changed = lambda demand: channel.send_feedback((IPC_FEEDBACK_DEMAND, demand))
+    win.show()
+
+    def process_commands():
+        while True:
+            command = channel.receive_command()
+            if command is None:
+                break
+            if command == IPC_COMMAND_STOP:
                 logger.info('Plotter process has received a stop request, goodbye')
                 app.exit(0)
-            else:
-                return obj
+            elif command[0] == IPC_COMMAND_ACTIVE_DATA_TYPES:
+                win.add_active_data_types(command[1])
 
-    win = PlotterWindow(get_transfer)
-    win.show()
+    def pump():
+        process_commands()
+        channel.pump()
+
+    # Draining the shared memory ring even while the window is paused, so that the parent never has to drop data
+    pump_timer = QTimer()
+    pump_timer.setSingleShot(False)
+    pump_timer.timeout.connect(pump)
+    pump_timer.start(50)
 
     logger.info('Plotter process %r initialized successfully, now starting the event loop', os.getpid())
     sys.exit(app.exec_())
 
 
-class CompactMessage:
-    """
-    Transfer and message objects from Pyuavcan cannot be exchanged between processes,
-    so we build this minimal representation that is just enough to mimic a Pyuavcan message object.
-    """
-    def __init__(self, uavcan_data_type_name):
-        self._uavcan_data_type_name = uavcan_data_type_name
-        self._fields = {}
-
-    def __repr__(self):
-        return '%s(%r)' % (self._uavcan_data_type_name, self._fields)
-
-    def _add_field(self, name, value):
-        self._fields[name] = value
-
-    def __getattr__(self, item):
-        if item not in ('_fields', '_uavcan_data_type_name'):
-            try:
-                return self._fields[item]
-            except KeyError:
-                pass
-            try:
-                return getattr(pyuavcan_v0.TYPENAMES[self._uavcan_data_type_name](), item)
-            except KeyError:
-                pass
-        raise AttributeError(item)
-
-
-# noinspection PyProtectedMember
-def _extract_struct_fields(m):
-    if isinstance(m, pyuavcan_v0.transport.CompoundValue):
-        out = CompactMessage(pyuavcan_v0.get_uavcan_data_type(m).full_name)
-        for field_name, field in pyuavcan_v0.get_fields(m).items():
-            if pyuavcan_v0.is_union(m) and pyuavcan_v0.get_active_union_field(m) != field_name:
-                continue
-            val = _extract_struct_fields(field)
-            if val is not None:
-                out._add_field(field_name, val)
-        return out
-    elif isinstance(m, pyuavcan_v0.transport.ArrayValue):
-        # cannot say I'm breaking the rules
-        container = bytes if pyuavcan_v0.get_uavcan_data_type(m).is_string_like else list
-        # if I can glue them back together
-        return container(filter(lambda x: x is not None, (_extract_struct_fields(item) for item in m)))
-    elif isinstance(m, pyuavcan_v0.transport.PrimitiveValue):
-        return m.value
-    elif isinstance(m, (int, float, bool)):
-        return m
-    elif isinstance(m, pyuavcan_v0.transport.VoidValue):
-        pass
-    else:
-        raise ValueError(':(')
+def _get_message_data_type(data_type_id):
+    return pyuavcan_v0.DATATYPES.get((data_type_id, pyuavcan_v0.dsdl.CompoundType.KIND_MESSAGE))
 
 
 class MessageTransfer:
-    def __init__(self, tr):
-        self.source_node_id = tr.source_node_id
-        self.ts_mono = tr.ts_monotonic
-        self.data_type_name = pyuavcan_v0.get_uavcan_data_type(tr.payload).full_name
-        self.message = _extract_struct_fields(tr.payload)
+    """
+    Message transfer as it is sent to the plotter process: the raw payload bytes as they were received from the bus,
+    plus the metadata. The payload is decoded by the plotter process when the message is accessed for the first time,
+    so the transfers that no extractor looks at are never decoded.
+    """
+    __slots__ = ('data_type_id', 'source_node_id', 'ts_mono', 'payload', 'multi_frame', '_message')
+
+    def __init__(self, data_type_id, source_node_id, ts_mono, payload, multi_frame):
+        self.data_type_id = data_type_id
+        self.source_node_id = source_node_id
+        self.ts_mono = ts_mono
+        self.payload = payload
+        self.multi_frame = multi_frame          # Multi-frame transfers are prefixed with the transfer CRC
+        self._message = None
+
+    @property
+    def data_type_name(self):
+        """None if the data type is not known to this process."""
+        data_type = _get_message_data_type(self.data_type_id)
+        return data_type.full_name if data_type is not None else None
+
+    @property
+    def message(self):
+        """None if the data type is not known to this process."""
+        if self._message is None:
+            data_type = _get_message_data_type(self.data_type_id)
+            if data_type is None:
+                return None
+            payload = self.payload
+            if self.multi_frame:
+                crc = payload[0] | (payload[1] << 8)
+                payload = payload[2:]
+                if pyuavcan_v0.dsdl.common.crc16_from_bytes(payload, initial=data_type.base_crc) != crc:
+                    raise pyuavcan_v0.transport.TransferError('Transfer CRC mismatch')
+            message = data_type()
+            # noinspection PyProtectedMember
+            message._unpack(pyuavcan_v0.transport.bits_from_bytes(payload))
+            self._message = message
+        return self._message
+
+
+class TransferReassembler:
+    """
+    Collects the payload of message transfers from CAN frames without decoding it. A multi-frame transfer with
+    a missing frame, a wrong toggle bit or an unexpected transfer ID is discarded; the CRC is verified by the receiver.
+    """
+
+    def __init__(self):
+        self._open = {}  # CAN ID : [transfer ID, expected toggle bit, timestamp, list of payload chunks]
+
+    def process(self, frame):
+        """Returns a tuple (timestamp, payload, multi frame flag) if the frame completes a transfer, otherwise None."""
+        data = frame.data
+        tail = data[-1]
+        if tail & 0x80:                                 # Start of transfer
+            if tail & 0x40:                             # Single frame transfer
+                return frame.ts_monotonic, bytes(data[:-1]), False
+            self._open[frame.id] = [tail & 0x1F, 0x20, frame.ts_monotonic, [bytes(data[:-1])]]
+            return
+
+        state = self._open.get(frame.id)
+        if state is None:
+            return
+        if (tail & 0x1F) != state[0] or (tail & 0x20) != state[1]:
+            del self._open[frame.id]
+            return
+
+        state[3].append(bytes(data[:-1]))
+        if tail & 0x40:                                 # End of transfer
+            del self._open[frame.id]
+            return state[2], b''.join(state[3]), True
+        state[1] ^= 0x20
 
 
 class PlotterManager:
+    """
+    Transfers are forwarded to a plotter process only if its plots need them: every process reports the data types
+    and, optionally, the source nodes its extractors use, and the parent maintains a routing table from that.
+    The transfers are reassembled from the CAN frames and sent to the plotter processes undecoded; the frames that
+    nobody needs cost only a dict lookup. The names of the data types seen on the bus are sent to the processes
+    separately, so that they can be offered for plotting.
+    """
+    FLUSH_INTERVAL_MS = 10
+
     def __init__(self, node):
         self._node = node
         self._inferiors = []  # process object, channel
         self._hook_handle = None
-
-    def _transfer_hook(self, tr):
-        if tr.direction == 'rx' and not tr.service_not_message and len(self._inferiors):
-            msg = MessageTransfer(tr)
-            for proc, channel in self._inferiors[:]:
-                if proc.is_alive():
-                    try:
-                        channel.send_nonblocking(msg)
-                    except Exception:
-                        logger.error('Failed to send data to process %r', proc, exc_info=True)
-                else:
-                    logger.info('Plotter process %r appears to be dead, removing', proc)
-                    self._inferiors.remove((proc, channel))
+        self._flush_timer = None
+        self._demands = {}  # Channel : demand as reported by the process
+        self._routes = {}  # Data type ID : list of (channel, set of source node IDs or None for any)
+        self._reassembler = TransferReassembler()
+        self._seen_data_type_ids = set()
+        self._active_data_types = set()
+        self._new_active_data_types = []
+
+    def _add_active_data_type(self, data_type_id):
+        self._seen_data_type_ids.add(data_type_id)
+        data_type = _get_message_data_type(data_type_id)
+        if data_type is not None:
+            self._active_data_types.add(data_type.full_name)
+            self._new_active_data_types.append(data_type.full_name)
+
+    def _frame_hook(self, direction, frame):
+        if direction != 'rx' or not frame.extended or not frame.data or not self._inferiors:
+            return
+
+        can_id = frame.id
+        if can_id & 0x80:                               # Service transfer
+            return
+        source_node_id = can_id & 0x7F
+        data_type_id = (can_id >> 8) & (0xFFFF if source_node_id else 0x3)   # Anonymous messages have short IDs
+        if data_type_id not in self._seen_data_type_ids:
+            self._add_active_data_type(data_type_id)
+
+        routes = self._routes.get(data_type_id)
+        if routes is None:
+            return
+
+        transfer = self._reassembler.process(frame)
+        if transfer is None:
+            return
+
+        msg = None
+        for channel, node_ids in routes:
+            if node_ids is None or source_node_id in node_ids:
+                if msg is None:
+                    msg = MessageTransfer(data_type_id, source_node_id, *transfer)
+                channel.send_nonblocking(msg)
+
+    def _update_routes(self):
+        routes = {}
+        for channel, demand in self._demands.items():
+            for data_type_name, node_ids in demand.items():
+                data_type = pyuavcan_v0.TYPENAMES.get(data_type_name)
+                if data_type is None or data_type.kind != data_type.KIND_MESSAGE or data_type.default_dtid is None:
+                    logger.warning('Plotter demand for %r cannot be satisfied: not a message with a default DTID',
+                                   data_type_name)
+                    continue
+                routes.setdefault(data_type.default_dtid, []).append((channel, node_ids))
+        self._routes = routes
+        logger.info('Plotter demand updated: %r', {k: len(v) for k, v in routes.items()})
+
+    def _process_feedback(self, channel):
+        while True:
+            feedback = channel.receive_feedback()
+            if feedback is None:
+                break
+            kind, payload = feedback
+            if kind == IPC_FEEDBACK_DEMAND:
+                self._demands[channel] = payload
+                self._update_routes()
+
+    def _flush(self):
+        if self._new_active_data_types:
+            command = IPC_COMMAND_ACTIVE_DATA_TYPES, self._new_active_data_types
+            self._new_active_data_types = []
+            for _, channel in self._inferiors:
+                channel.send_command(command)
+
+        for proc, channel in self._inferiors[:]:
+            if proc.is_alive():
+                try:
+                    self._process_feedback(channel)
+                    channel.flush()
+                except Exception:
+                    logger.error('Failed to send data to process %r', proc, exc_info=True)
+            else:
+                logger.info('Plotter process %r appears to be dead, removing; IPC statistics: %r',
+                            proc, channel.get_stats())
+                self._inferiors.remove((proc, channel))
+                if self._demands.pop(channel, None) is not None:
+                    self._update_routes()
+                channel.close()
 
     def spawn_plotter(self):
         channel = IPCChannel()
 
         if self._hook_handle is None:
-            self._hook_handle = self._node.add_transfer_hook(self._transfer_hook)
+            self._hook_handle = self._node.can_driver.add_io_hook(self._frame_hook)
+
+        if self._flush_timer is None:
+            self._flush_timer = QTimer()
+            self._flush_timer.setSingleShot(False)
+            self._flush_timer.timeout.connect(self._flush)
+            self._flush_timer.start(self.FLUSH_INTERVAL_MS)
 
         proc = multiprocessing.Process(target=_process_entry_point, name='plotter', args=(channel,))
         proc.daemon = True
         proc.start()
 
+        channel.send_command((IPC_COMMAND_ACTIVE_DATA_TYPES, sorted(self._active_data_types)))
+
         self._inferiors.append((proc, channel))
 
         logger.info('Spawned new plotter process %r', proc)
 
+    def get_ipc_stats(self):
+        """Returns a list of tuples (window name, PID, IPCChannelStats) for every live window."""
+        return [('Plotter', proc.pid, channel.get_stats()) for proc, channel in self._inferiors if proc.is_alive()]
+
     def close(self):
         try:
             self._hook_handle.remove()
         except Exception:
             pass
 
+        try:
+            self._flush_timer.stop()
+        except Exception:
+            pass
+
         for _, channel in self._inferiors:
             try:
-                channel.send_nonblocking(IPC_COMMAND_STOP)
+                channel.send_command(IPC_COMMAND_STOP)
             except Exception:
                 pass
 
@@ -199,8 +317,9 @@ class PlotterManager:
             except Exception:
                 pass
 
-        for proc, _ in self._inferiors:
+        for proc, channel in self._inferiors:
             try:
                 proc.terminate()
             except Exception:
                 pass
+            channel.close()
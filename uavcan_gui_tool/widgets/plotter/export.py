@@ -0,0 +1,221 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+"""
+Export of the plotted series into files.
+Every series is a sequence of rows (time, value, ...), one per extracted value; an extractor that yields several
+values at once produces one column per value.
+CSV files are in the long format with the columns time, series, value; a series with several values is written
+as several series named like "name[index]".
+NumPy archives contain one 2D array per series and per written chunk, named like "series<index>/<chunk>", plus the
+array "names" with the names of the series; see load_npz_export().
+"""
+
+import csv
+import logging
+import queue
+import threading
+import zipfile
+from collections import OrderedDict, defaultdict
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FILE_FILTER = 'CSV files (*.csv);;Compressed NumPy archives (*.npz)'
+
+
+class CSVSeriesWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(('time', 'series', 'value'))
+
+    def write(self, _index, name, data):
+        num_values = data.shape[1] - 1
+        names = [name] if num_values == 1 else ['%s[%d]' % (name, i) for i in range(num_values)]
+        self._writer.writerows((row[0], names[i], row[i + 1]) for row in data.tolist() for i in range(num_values))
+
+    def close(self):
+        self._file.close()
+
+
+class NPZSeriesWriter:
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._names = {}
+        self._num_chunks = 0
+
+    def _write_array(self, name, array):
+        with self._zip.open(name + '.npy', 'w', force_zip64=True) as f:
+            numpy.lib.format.write_array(f, array, allow_pickle=False)
+
+    def write(self, index, name, data):
+        self._names[index] = name
+        self._write_array('series%d/%06d' % (index, self._num_chunks), data)
+        self._num_chunks += 1
+
+    def close(self):
+        try:
+            self._write_array('names', numpy.array([self._names[i] for i in sorted(self._names)], dtype=str))
+        finally:
+            self._zip.close()
+
+
+def load_npz_export(path):
+    """Returns an OrderedDict {series name: array of rows (time, value, ...)} from a file written by the exporter."""
+    with numpy.load(path, allow_pickle=False) as archive:
+        names = [str(x) for x in archive['names']]
+        chunks = defaultdict(list)
+        for key in archive.files:
+            if key != 'names':
+                series, chunk = key.split('/')
+                chunks[int(series[len('series'):])].append((int(chunk), key))
+        return OrderedDict((name, numpy.concatenate([archive[key] for _, key in sorted(chunks[index])]))
+                           for index, name in enumerate(names))
+
+
+def make_series_writer(path):
+    if path.lower().endswith('.npz'):
+        return NPZSeriesWriter(path)
+    return CSVSeriesWriter(path)
+
+
+def get_series_name(extractor):
+    return '%s %s' % (extractor.data_type_name, extractor.extraction_expression.source)
+
+
+class SeriesExporter:
+    """
+    Writes series into a file from a worker thread. The caller only appends the new values to lists and hands them
+    over to the thread in one batch per flush(), so the export never blocks the plotter. If the thread falls behind,
+    whole batches are dropped and accounted for in num_dropped.
+    close() returns immediately; the file is closed by the thread once all batches have been written.
+    """
+    MAX_PENDING_BATCHES = 100
+
+    def __init__(self, path):
+        self._path = path
+        self._writer = make_series_writer(path)
+        self._queue = queue.Queue(self.MAX_PENDING_BATCHES)
+        self._series = {}       # (extractor, number of values) : series index
+        self._names = []
+        self._pending = {}      # Series index : (list of timestamps, list of value tuples)
+        self._closed = False
+        self._stop = threading.Event()      # Set on close if the queue has no room for the terminating None
+        self._error = None
+
+        self.num_written = 0
+        self.num_dropped = 0
+
+        self._thread = threading.Thread(target=self._write_loop, name='series_exporter')
+        self._thread.start()
+
+    def _write_loop(self):
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    break
+                for index, (timestamps, values) in batch.items():
+                    data = numpy.column_stack((numpy.asarray(timestamps, dtype=numpy.float64),
+                                               numpy.asarray(values, dtype=numpy.float64)))
+                    self._writer.write(index, self._names[index], data)
+                    self.num_written += len(data)
+                if self._stop.is_set() and self._queue.empty():
+                    break
+        except Exception as ex:
+            logger.error('Series export into %r failed', self._path, exc_info=True)
+            self._error = ex
+        finally:
+            try:
+                self._writer.close()
+            except Exception as ex:
+                logger.error('Could not close %r', self._path, exc_info=True)
+                self._error = self._error or ex
+
+    def _get_series_index(self, extractor, num_values):
+        key = extractor, num_values
+        try:
+            return self._series[key]
+        except KeyError:
+            name = get_series_name(extractor)
+            if name in self._names:
+                name += ' #%d' % len(self._names)
+            self._series[key] = len(self._names)
+            self._names.append(name)
+            return self._series[key]
+
+    def add(self, extractor, timestamp, value):
+        """Adds one value as returned by the extractor: a number or a sequence of numbers."""
+        try:
+            values = tuple(map(float, value))
+        except TypeError:
+            values = float(value),
+        index = self._get_series_index(extractor, len(values))
+        try:
+            timestamps, value_list = self._pending[index]
+        except KeyError:
+            timestamps, value_list = self._pending[index] = [], []
+        timestamps.append(timestamp)
+        value_list.append(values)
+
+    def add_many(self, extractor, timestamps, values):
+        """Like add(), for an array of timestamps and an array of values, 1D or with one row per timestamp."""
+        if values.ndim == 1:
+            values = values[:, numpy.newaxis]
+        index = self._get_series_index(extractor, values.shape[1])
+        try:
+            timestamp_list, value_list = self._pending[index]
+        except KeyError:
+            timestamp_list, value_list = self._pending[index] = [], []
+        timestamp_list.extend(timestamps.tolist())
+        value_list.extend(values.tolist())
+
+    def add_series(self, extractor, timestamps, values):
+        """Adds a whole series at once: an array of timestamps and a 2D array of values, one row per timestamp."""
+        index = self._get_series_index(extractor, values.shape[1])
+        self._pending[index] = timestamps, values
+
+    def flush(self):
+        """Hands the values added since the last flush over to the worker thread."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            self.num_dropped += sum(len(timestamps) for timestamps, _ in batch.values())
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.flush()
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                # The thread checks the event after every batch; if it has drained the queue meanwhile and is
+                # waiting for the next one, there is room for the None now
+                self._stop.set()
+                try:
+                    self._queue.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    @property
+    def finished(self):
+        """True once the exporter has been closed and the file has been written completely."""
+        return self._closed and not self._thread.is_alive()
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def path(self):
+        return self._path
@@ -18,6 +18,14 @@ class AbstractPlotArea:
     def add_value(self, extractor, timestamp, value):
         pass
 
+    def add_values(self, extractor, timestamps, values):
+        """
+        Adds many values of one extractor at once: an array of timestamps and an array of values, with one row
+        per timestamp if the extractor yields several values. Plot areas can override this to add them in bulk.
+        """
+        for timestamp, value in zip(timestamps.tolist(), values.tolist()):
+            self.add_value(extractor, timestamp, value)
+
     def remove_curves_provided_by_extractor(self, extractor):
         pass
 
@@ -27,6 +35,13 @@ class AbstractPlotArea:
     def reset(self):
         pass
 
+    def get_series(self):
+        """
+        Returns a list of (extractor, array of timestamps, 2D array of values) for the data kept by the area,
+        or None if the area does not keep the extracted values, so there is nothing to save.
+        """
+        return None
+
 
 def add_crosshair(plot, render_measurements, color=Qt.gray):
     pen = mkPen(color=QColor(color), width=1)
@@ -63,8 +78,10 @@ def add_crosshair(plot, render_measurements, color=Qt.gray):
 
 from .yt import PlotAreaYTWidget
 from .xy import PlotAreaXYWidget
+from .spectrum import PlotAreaSpectrumWidget
 
 PLOT_AREAS = OrderedDict([
     ('Y-T plot', PlotAreaYTWidget),
     ('X-Y plot', PlotAreaXYWidget),
+    ('Spectrum plot', PlotAreaSpectrumWidget),
 ])
@@ -0,0 +1,359 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import logging
+import queue
+import threading
+from collections import namedtuple, deque
+
+import numpy
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QSpinBox, QComboBox, QLabel, QCheckBox
+
+from . import AbstractPlotArea, add_crosshair
+from ... import make_icon_button
+from ...ring_buffers import RingBuffer
+from ....thirdparty.pyqtgraph import PlotWidget, mkPen
+
+logger = logging.getLogger(__name__)
+
+
+SpectrumConfig = namedtuple('SpectrumConfig', ['mode', 'window', 'segment_length', 'overlap', 'num_averages'])
+
+MODE_PSD = 'PSD'
+MODE_AMPLITUDE = 'Amplitude'
+
+WINDOWS = {
+    'Hann': numpy.hanning,
+    'Hamming': numpy.hamming,
+    'Blackman': numpy.blackman,
+    'Rectangular': numpy.ones,
+}
+
+
+class SpectrumEstimator:
+    """
+    Incremental Welch estimator of the spectrum of one series with irregular timestamps.
+    The samples are resampled onto a uniform grid at the median sample rate; the grid is fixed, so every segment
+    of the grid is transformed only once, when the samples covering it have arrived. The spectrum is the average
+    of the last segments. If the sample rate changes, the estimation starts over.
+    """
+    RATE_TOLERANCE = 0.1
+
+    def __init__(self, config):
+        self._config = None
+        self._samples = RingBuffer(1, 2)
+        self.configure(config)
+
+    def configure(self, config):
+        """The samples are retained, the spectrum is computed anew."""
+        self._config = config
+        self._samples.set_capacity(4 * config.segment_length)
+        self._window = WINDOWS[config.window](config.segment_length)
+        self._step = max(1, int(round(config.segment_length * (1 - config.overlap))))
+        self._spectra = deque(maxlen=config.num_averages)
+        self._rate = None
+        self._grid_origin = None
+        self._next_segment = 0
+
+    def add(self, x, y):
+        self._samples.extend(numpy.column_stack((x, y)))
+
+    def _estimate_rate(self, x):
+        intervals = numpy.diff(x[-self._config.segment_length:])
+        intervals = intervals[intervals > 0]
+        return 1 / numpy.median(intervals) if len(intervals) else None
+
+    def _transform(self, segment):
+        segment = (segment - segment.mean()) * self._window      # Removing the DC offset before windowing
+        spectrum = numpy.abs(numpy.fft.rfft(segment))
+        # One-sided spectra; the segment lengths are even, so the last bin is at the Nyquist frequency
+        if self._config.mode == MODE_PSD:
+            spectrum = numpy.square(spectrum) / (self._rate * numpy.square(self._window).sum())
+            spectrum[1:-1] *= 2
+        else:
+            spectrum *= 2 / self._window.sum()
+            spectrum[[0, -1]] /= 2
+        return spectrum
+
+    def update(self):
+        """Transforms the segments completed since the last call; returns a tuple (frequencies, spectrum) or None."""
+        data = self._samples.data
+        length = self._config.segment_length
+        if len(data) < length:
+            return
+        x, y = data[:, 0], data[:, 1]
+
+        rate = self._estimate_rate(x)
+        if rate is None:
+            return
+        if self._rate is None or abs(rate - self._rate) > self._rate * self.RATE_TOLERANCE:
+            logger.info('Spectrum sample rate %.3f Hz, resampling grid reset', rate)
+            self._rate = rate
+            self._grid_origin = x[0]
+            self._next_segment = 0
+            self._spectra.clear()
+
+        def segment_start(index):
+            return self._grid_origin + index * self._step / self._rate
+
+        # Segments older than the retained samples or than the segments to be averaged are skipped
+        last_complete = int(numpy.floor((x[-1] - self._grid_origin) * self._rate - (length - 1))) // self._step
+        first = max(self._next_segment, last_complete - self._config.num_averages + 1,
+                    int(numpy.ceil((x[0] - self._grid_origin) * self._rate / self._step)))
+        for index in range(first, last_complete + 1):
+            grid = segment_start(index) + numpy.arange(length) / self._rate
+            self._spectra.append(self._transform(numpy.interp(grid, x, y)))
+        self._next_segment = max(self._next_segment, last_complete + 1)
+
+        if not self._spectra:
+            return
+        return numpy.fft.rfftfreq(length, 1 / self._rate), numpy.mean(self._spectra, axis=0)
+
+
+class SpectrumWorker:
+    """
+    Runs the estimators of all curves in a background thread, so that the transforms never delay the plotter.
+    The new samples are submitted in batches; the latest spectrum of every curve is collected by take_results().
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._results = {}
+        self._thread = threading.Thread(target=self._run, name='spectrum_worker', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        estimators = {}     # Curve key : SpectrumEstimator
+        config = None
+        while True:
+            command, argument = self._queue.get()
+            try:
+                if command == 'stop':
+                    break
+                elif command == 'configure':
+                    config = argument
+                    for e in estimators.values():
+                        e.configure(config)
+                elif command == 'remove':
+                    estimators.pop(argument, None)
+                elif command == 'reset':
+                    estimators.clear()
+                elif command == 'data':
+                    results = {}
+                    for key, (x, y) in argument.items():
+                        if key not in estimators:
+                            estimators[key] = SpectrumEstimator(config)
+                        estimators[key].add(x, y)
+                        result = estimators[key].update()
+                        if result is not None:
+                            results[key] = result
+                    with self._lock:
+                        self._results.update(results)
+            except Exception:
+                logger.error('Spectrum worker failed to process %r', command, exc_info=True)
+
+    def configure(self, config):
+        self._queue.put(('configure', config))
+
+    def submit(self, batch):
+        """Accepts a dict {curve key: (array of x, array of y)} of the samples added since the last submission."""
+        self._queue.put(('data', batch))
+
+    def remove(self, key):
+        self._queue.put(('remove', key))
+
+    def reset(self):
+        self._queue.put(('reset', None))
+
+    def stop(self):
+        self._queue.put(('stop', None))
+
+    def take_results(self):
+        """Returns a dict {curve key: (frequencies, spectrum)} of the spectra computed since the last call."""
+        with self._lock:
+            results, self._results = self._results, {}
+        return results
+
+
+class PlotAreaSpectrumWidget(QWidget, AbstractPlotArea):
+    MAX_CURVES_PER_EXTRACTOR = 9
+    DARKENING_VALUES = [100, 200, 300]
+    SEGMENT_LENGTHS = [2 ** n for n in range(6, 17)]
+    DEFAULT_SEGMENT_LENGTH = 1024
+
+    def __init__(self, parent, display_measurements):
+        super(PlotAreaSpectrumWidget, self).__init__(parent)
+
+        self._extractor_associations = {}  # Extractor : plots
+        self._pending = {}  # (Extractor, index) : (list of x, list of y)
+
+        self._worker = worker = SpectrumWorker()
+        self.destroyed.connect(lambda *_: worker.stop())
+
+        self._clear_button = make_icon_button('eraser', 'Clear all curves', self, on_clicked=self.reset)
+
+        def make_combobox(items, current, tool_tip):
+            box = QComboBox(self)
+            box.setEditable(False)
+            box.addItems(items)
+            box.setCurrentText(current)
+            box.setToolTip(tool_tip)
+            box.currentTextChanged.connect(self._configure)
+            return box
+
+        def make_spinbox(minimum, maximum, value, tool_tip, suffix=''):
+            box = QSpinBox(self)
+            box.setRange(minimum, maximum)
+            box.setValue(value)
+            box.setSuffix(suffix)
+            box.setToolTip(tool_tip)
+            box.valueChanged.connect(self._configure)
+            return box
+
+        self._mode_box = make_combobox([MODE_PSD, MODE_AMPLITUDE], MODE_PSD,
+                                       'Power spectral density (Welch) or amplitude spectrum')
+        self._window_box = make_combobox(list(WINDOWS), 'Hann', 'Window function')
+        self._segment_length_box = make_combobox([str(x) for x in self.SEGMENT_LENGTHS],
+                                                 str(self.DEFAULT_SEGMENT_LENGTH),
+                                                 'Number of samples per transform; the frequency resolution is '
+                                                 'the sample rate divided by this number')
+        self._overlap_spinbox = make_spinbox(0, 95, 50, 'Overlap of the consecutive segments', suffix=' %')
+        self._averages_spinbox = make_spinbox(1, 256, 8, 'Number of the latest segments to average')
+
+        self._log_y_checkbox = QCheckBox('Log Y', self)
+        self._log_y_checkbox.setChecked(True)
+        self._log_y_checkbox.toggled.connect(lambda checked: self._plot.setLogMode(y=checked))
+
+        self._plot = PlotWidget(self, background=QColor(Qt.black))
+        self._plot.showButtons()
+        self._plot.enableAutoRange()
+        self._plot.showGrid(x=True, y=True, alpha=0.4)
+        self._plot.setLabel('bottom', 'Frequency', units='Hz')
+        self._plot.setLogMode(y=True)
+        self._legend = None
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self._plot, 1)
+
+        controls_layout = QHBoxLayout(self)
+        controls_layout.addWidget(self._clear_button)
+        controls_layout.addStretch(1)
+        controls_layout.addWidget(QLabel('Mode:', self))
+        controls_layout.addWidget(self._mode_box)
+        controls_layout.addWidget(QLabel('Window:', self))
+        controls_layout.addWidget(self._window_box)
+        controls_layout.addWidget(QLabel('Samples:', self))
+        controls_layout.addWidget(self._segment_length_box)
+        controls_layout.addWidget(QLabel('Overlap:', self))
+        controls_layout.addWidget(self._overlap_spinbox)
+        controls_layout.addWidget(QLabel('Averages:', self))
+        controls_layout.addWidget(self._averages_spinbox)
+        controls_layout.addWidget(self._log_y_checkbox)
+
+        layout.addLayout(controls_layout)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+        # Crosshair
+        def _render_measurements(cur, ref):
+            freq, value = cur[0], 10 ** cur[1] if self._log_y_checkbox.isChecked() else cur[1]
+            text = 'freq %.6f Hz,  y %.6g' % (freq, value)
+            if ref is None:
+                return text
+            text += ';' + ' ' * 4 + 'dfreq %.6f Hz' % (freq - ref[0])
+            display_measurements(text)
+
+        display_measurements('Hover to sample Frequency/Y, click to set new reference')
+        add_crosshair(self._plot, _render_measurements)
+
+        self._configure()
+
+    def _configure(self):
+        config = SpectrumConfig(mode=self._mode_box.currentText(),
+                                window=self._window_box.currentText(),
+                                segment_length=int(self._segment_length_box.currentText()),
+                                overlap=self._overlap_spinbox.value() / 100,
+                                num_averages=self._averages_spinbox.value())
+        self._worker.configure(config)
+
+    def _forge_curves(self, how_many, base_color):
+        if how_many > 1 and self._legend is None:
+            self._legend = self._plot.addLegend()
+
+        return [self._plot.plot(name=str(idx), pen=self._make_pen(base_color, idx)) for idx in range(how_many)]
+
+    def _make_pen(self, base_color, idx):
+        return mkPen(color=base_color.darker(self.DARKENING_VALUES[idx % len(self.DARKENING_VALUES)]), width=1)
+
+    def _get_pending(self, extractor, num_curves):
+        """Returns the lists of the pending x and y of every curve of the extractor."""
+        if extractor in self._extractor_associations and num_curves != len(self._extractor_associations[extractor]):
+            self.remove_curves_provided_by_extractor(extractor)
+
+        if extractor not in self._extractor_associations:
+            if num_curves > self.MAX_CURVES_PER_EXTRACTOR:
+                raise RuntimeError('%r curves is much too many' % num_curves)
+            self._extractor_associations[extractor] = self._forge_curves(num_curves, extractor.color)
+
+        return [self._pending.setdefault((extractor, idx), ([], [])) for idx in range(num_curves)]
+
+    def add_value(self, extractor, timestamp, y):
+        try:
+            num_curves = len(y)
+        except Exception:
+            num_curves = 1
+            y = y,
+
+        for idx, (xs, ys) in enumerate(self._get_pending(extractor, num_curves)):
+            xs.append(timestamp)
+            ys.append(float(y[idx]))
+
+    def add_values(self, extractor, timestamps, y):
+        if y.ndim == 1:
+            y = y[:, numpy.newaxis]
+
+        for idx, (xs, ys) in enumerate(self._get_pending(extractor, y.shape[1])):
+            xs.extend(timestamps.tolist())
+            ys.extend(y[:, idx].tolist())
+
+    def remove_curves_provided_by_extractor(self, extractor):
+        try:
+            plots = self._extractor_associations.pop(extractor)
+        except KeyError:
+            return
+
+        for idx, plot in enumerate(plots):
+            self._plot.removeItem(plot)
+            self._pending.pop((extractor, idx), None)
+            self._worker.remove((extractor, idx))
+
+        if self._legend is not None:
+            if self._legend.scene() is not None:
+                self._legend.scene().removeItem(self._legend)
+            self._plot.getPlotItem().legend = None
+            self._legend = None
+
+    def reset(self):
+        for extractor in list(self._extractor_associations.keys()):
+            self.remove_curves_provided_by_extractor(extractor)
+        self._worker.reset()
+        self._plot.enableAutoRange()
+
+    def update(self):
+        if self._pending:
+            batch = {key: (numpy.array(xs), numpy.array(ys)) for key, (xs, ys) in self._pending.items()}
+            self._pending = {}
+            self._worker.submit(batch)
+
+        for (extractor, idx), (freq, spectrum) in self._worker.take_results().items():
+            plots = self._extractor_associations.get(extractor)
+            if plots is not None and idx < len(plots):
+                plots[idx].setData(freq, spectrum, pen=self._make_pen(extractor.color, idx))
@@ -9,33 +9,69 @@
 import logging
 import math
 
+import numpy
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QSpinBox, QComboBox, QLabel, QCheckBox, QDoubleSpinBox
 
 from . import AbstractPlotArea, add_crosshair
 from ... import make_icon_button
+from ...ring_buffers import RingBuffer
 from ....thirdparty.pyqtgraph import PlotWidget, mkPen
 
 logger = logging.getLogger(__name__)
 
 
 class AbstractPlotContainer:
+    """
+    Keeps the last points of the plot in ring buffers, see CurveContainer in the YT plot area.
+    The buffers are reallocated when the number of points to keep changes.
+    """
+
     def __init__(self, plot):
         self.plot = plot
-        self.x = []
-        self.y = []
-
-    def add_point(self, x, y, max_data_points):
-        while len(self.x) >= max_data_points:
-            self.x.pop(0)
-            self.y.pop(0)
-        assert len(self.x) == len(self.y)
-        self.x.append(x)
-        self.y.append(y)
+        self._timestamps = RingBuffer(1, None)   # Not plotted, only exported
+        self._x = RingBuffer(1, None)
+        self._y = RingBuffer(1, None)
+        self._modified = False
+
+    def _set_capacity(self, max_data_points):
+        if self._x.capacity != max_data_points:
+            self._timestamps.set_capacity(max_data_points)
+            self._x.set_capacity(max_data_points)
+            self._y.set_capacity(max_data_points)
+
+    def add_point(self, timestamp, x, y, max_data_points):
+        self._set_capacity(max_data_points)
+        self._timestamps.append(timestamp)
+        self._x.append(x)
+        self._y.append(y)
+        self._modified = True
+
+    def add_points(self, timestamps, x, y, max_data_points):
+        """Accepts arrays."""
+        self._set_capacity(max_data_points)
+        self._timestamps.extend(timestamps)
+        self._x.extend(x)
+        self._y.extend(y)
+        self._modified = True
+
+    @property
+    def timestamps(self):
+        return self._timestamps.data
+
+    @property
+    def x(self):
+        return self._x.data
+
+    @property
+    def y(self):
+        return self._y.data
 
     def update(self):
-        self.plot.setData(self.x, self.y)
+        if self._modified:
+            self._modified = False
+            self.plot.setData(self.x, self.y)
 
 
 class LinePlotContainer(AbstractPlotContainer):
@@ -61,6 +97,7 @@ class ScatterPlotContainer(AbstractPlotContainer):
         # once it has been created. Either it's bug in PyQtGraph, or I'm doing something wrong.
         self.parent.removeItem(self.plot)
         self.plot = self._inst(color)
+        self._modified = True
 
 
 class PlotAreaXYWidget(QWidget, AbstractPlotArea):
@@ -160,7 +197,7 @@ class PlotAreaXYWidget(QWidget, AbstractPlotArea):
         else:
             raise RuntimeError('Invalid plot mode: %r' % mode)
 
-    def add_value(self, extractor, _timestamp, xy):
+    def add_value(self, extractor, timestamp, xy):
         try:
             x, y = xy
         except Exception:
@@ -171,7 +208,19 @@ class PlotAreaXYWidget(QWidget, AbstractPlotArea):
         if extractor not in self._extractor_associations:
             self._extractor_associations[extractor] = self._forge_curve(extractor.color)
 
-        self._extractor_associations[extractor].add_point(float(x), float(y), self._max_data_points)
+        self._extractor_associations[extractor].add_point(timestamp, float(x), float(y), self._max_data_points)
+        self._extractor_associations[extractor].set_color(extractor.color)
+
+    def add_values(self, extractor, timestamps, xy):
+        if xy.ndim != 2 or xy.shape[1] != 2:
+            if extractor in self._extractor_associations:
+                self.remove_curves_provided_by_extractor(extractor)
+            raise RuntimeError('XY must be an iterable with exactly 2 elements')
+
+        if extractor not in self._extractor_associations:
+            self._extractor_associations[extractor] = self._forge_curve(extractor.color)
+
+        self._extractor_associations[extractor].add_points(timestamps, xy[:, 0], xy[:, 1], self._max_data_points)
         self._extractor_associations[extractor].set_color(extractor.color)
 
     def remove_curves_provided_by_extractor(self, extractor):
@@ -182,6 +231,10 @@ class PlotAreaXYWidget(QWidget, AbstractPlotArea):
         for k in list(self._extractor_associations.keys()):
             self.remove_curves_provided_by_extractor(k)
 
+    def get_series(self):
+        return [(extractor, c.timestamps.copy(), numpy.column_stack((c.x, c.y)))
+                for extractor, c in self._extractor_associations.items()]
+
     def reset(self):
         self._do_clear()
         self._plot.enableAutoRange()
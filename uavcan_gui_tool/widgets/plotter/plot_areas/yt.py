@@ -7,36 +7,51 @@
 #
 
 import logging
+import time
 
+import numpy
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QDoubleSpinBox
 
 from . import AbstractPlotArea, add_crosshair
 from ... import make_icon_button
+from ...ring_buffers import DecimatingRingBuffer
 from ....thirdparty.pyqtgraph import PlotWidget, mkPen
 
 logger = logging.getLogger(__name__)
 
 
 class CurveContainer:
+    """
+    Keeps the last MAX_DATA_POINTS points of the curve in a preallocated DecimatingRingBuffer, so adding a point costs
+    the same regardless of how long the plot has been running. Only the visible part of the curve is rendered,
+    decimated to a min/max envelope of about one entry per horizontal pixel, so zooming out is as cheap as zooming in.
+    The new points are accumulated in lists and moved into the buffer in batches once per update.
+    """
     MAX_DATA_POINTS = 200000
 
-    def __init__(self, plot, base_color, darkening, pen):
+    def __init__(self, plot, name, base_color, darkening, pen):
+        self.name = name
         self.base_color = base_color
         self.darkening = darkening
         self.pen = pen
         self.plot = plot
-        self.x = []
-        self.y = []
+        self._samples = DecimatingRingBuffer(self.MAX_DATA_POINTS, coarse_history=False, statistics=True)
+        self._pending_x = []
+        self._pending_y = []
+        self._modified = False
 
     def add_point(self, x, y):
-        while len(self.x) >= self.MAX_DATA_POINTS:
-            self.x.pop(0)
-            self.y.pop(0)
-        assert len(self.x) == len(self.y)
-        self.x.append(x)
-        self.y.append(y)
+        self._pending_x.append(x)
+        self._pending_y.append(y)
+        self._modified = True
+
+    def add_points(self, x, y):
+        """Accepts arrays."""
+        self._pending_x.extend(x.tolist())
+        self._pending_y.extend(y.tolist())
+        self._modified = True
 
     def set_color(self, color):
         if self.base_color != color:
@@ -44,20 +59,39 @@ class CurveContainer:
             color = self.base_color.darker(self.darkening)
             logger.info('Updating color %r --> %r', self.pen.color(), color)
             self.pen.setColor(color)
+            self._modified = True
 
-    def update(self):
-        self.plot.setData(self.x, self.y, pen=self.pen)
+    def get_samples(self):
+        """Returns a tuple of arrays (x, y) of all points kept, not decimated."""
+        x, y = self._samples.get()
+        return numpy.concatenate((x, self._pending_x)), numpy.concatenate((y, self._pending_y))
+
+    def get_statistics(self, x_min, x_max):
+        """SeriesStatistics of the points within the range that have been moved into the buffer by update()."""
+        return self._samples.get_statistics(x_min, x_max)
+
+    def update(self, x_min, x_max, max_points, view_changed=False):
+        if self._pending_x:
+            self._samples.extend(self._pending_x, self._pending_y)
+            self._pending_x, self._pending_y = [], []
+        if self._modified or view_changed:
+            self._modified = False
+            x, y = self._samples.get(x_min, x_max, max_points)
+            self.plot.setData(x, y, pen=self.pen)
 
 
 class PlotAreaYTWidget(QWidget, AbstractPlotArea):
     INITIAL_X_RANGE = 120
     MAX_CURVES_PER_EXTRACTOR = 9
+    STATISTICS_UPDATE_INTERVAL = 0.25
 
     def __init__(self, parent, display_measurements):
         super(PlotAreaYTWidget, self).__init__(parent)
 
         self._extractor_associations = {}  # Extractor : plots
         self._max_x = 0
+        self._view_changed = False
+        self._x_auto_range = False
 
         self._autoscroll_checkbox = make_icon_button('angle-double-right',
                                                      'Scroll the plot automatically as new data arrives', self,
@@ -65,6 +99,19 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
 
         self._clear_button = make_icon_button('eraser', 'Clear all curves', self, on_clicked=self._do_clear)
 
+        self._statistics_button = make_icon_button('calculator', 'Show the statistics of every curve in the legend',
+                                                   self, checkable=True, on_clicked=self._on_statistics_toggled)
+        self._statistics_updated_at = 0
+
+        self._statistics_window_spinbox = QDoubleSpinBox(self)
+        self._statistics_window_spinbox.setToolTip('Statistics are computed over this many last seconds, '
+                                                   'or over the visible range if zero')
+        self._statistics_window_spinbox.setRange(0, 1e6)
+        self._statistics_window_spinbox.setDecimals(1)
+        self._statistics_window_spinbox.setSuffix(' s')
+        self._statistics_window_spinbox.setSpecialValueText('View')
+        self._statistics_window_spinbox.setVisible(False)
+
         self._plot = PlotWidget(self, background=QColor(Qt.black))
         self._plot.showButtons()
         self._plot.enableAutoRange()
@@ -72,12 +119,15 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
         self._legend = None
         # noinspection PyArgumentList
         self._plot.setRange(xRange=(0, self.INITIAL_X_RANGE), padding=0)
+        self._plot.getPlotItem().getViewBox().sigXRangeChanged.connect(self._on_x_range_changed)
 
         layout = QHBoxLayout(self)
 
         controls_layout = QVBoxLayout(self)
         controls_layout.addWidget(self._clear_button)
         controls_layout.addWidget(self._autoscroll_checkbox)
+        controls_layout.addWidget(self._statistics_button)
+        controls_layout.addWidget(self._statistics_window_spinbox)
         controls_layout.addStretch(1)
         layout.addLayout(controls_layout)
 
@@ -102,8 +152,51 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
         display_measurements('Hover to sample Time/Y, click to set new reference')
         add_crosshair(self._plot, _render_measurements)
 
+    def _on_x_range_changed(self):
+        # The curves are re-rendered for the new range on the next update, so that continuous zooming or
+        # scrolling does not cost more than one rendering per update interval
+        self._view_changed = True
+
+    def _on_statistics_toggled(self):
+        self._statistics_window_spinbox.setVisible(self._statistics_button.isChecked())
+        self._statistics_updated_at = 0
+        self._rebuild_legend()
+
+    def _rebuild_legend(self):
+        """The legend is shown if there are extractors with several curves, or if the statistics are enabled."""
+        if self._legend is not None:
+            if self._legend.scene() is not None:
+                self._legend.scene().removeItem(self._legend)
+            self._plot.getPlotItem().legend = None      # Otherwise, newer PyQtGraph would return it from addLegend()
+            self._legend = None
+
+        curves = [c for curves in self._extractor_associations.values() for c in curves]
+        multiple = any(len(curves) > 1 for curves in self._extractor_associations.values())
+        if curves and (multiple or self._statistics_button.isChecked()):
+            self._legend = self._plot.addLegend()
+            for c in curves:
+                self._legend.addItem(c.plot, c.name)
+
+    def _update_statistics(self, x_min, x_max):
+        if self._statistics_window_spinbox.value() > 0:
+            x_min, x_max = self._max_x - self._statistics_window_spinbox.value(), None
+
+        labels = {sample.item: label for sample, label in self._legend.items}
+        for extractor, curves in self._extractor_associations.items():
+            for idx, c in enumerate(curves):
+                stat = c.get_statistics(x_min, x_max)
+                name = extractor.extraction_expression.source + ('[%d]' % idx if len(curves) > 1 else '')
+                if stat is None:
+                    text = '%s: no data' % name
+                else:
+                    text = '%s: n %d, mean %.6g, stdev %.6g, min %.6g, max %.6g' % \
+                        (name, stat.count, stat.mean, stat.stddev, stat.min, stat.max)
+                if c.plot in labels:
+                    labels[c.plot].setText(text)
+        self._legend.updateSize()
+
     def _forge_curves(self, how_many, base_color):
-        if how_many > 1 and self._legend is None:
+        if (how_many > 1 or self._statistics_button.isChecked()) and self._legend is None:
             self._legend = self._plot.addLegend()
 
         out = []
@@ -120,18 +213,12 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
                 pattern = dash_patterns[int(idx / len(darkening_values)) % len(dash_patterns)]
                 pen = mkPen(color=base_color.darker(darkening), width=1, dash=pattern)
                 plot = self._plot.plot(name=str(idx), pen=pen)
-                out.append(CurveContainer(plot, base_color, darkening, pen))
+                out.append(CurveContainer(plot, str(idx), base_color, darkening, pen))
             except Exception:
                 logger.error('Could not add curve', exc_info=True)
         return out
 
-    def add_value(self, extractor, x, y):
-        try:
-            num_curves = len(y)
-        except Exception:
-            num_curves = 1
-            y = y,  # do you love Python as I do
-
+    def _get_curves(self, extractor, num_curves):
         # If number of curves changed, removing all plots from this extractor
         if extractor in self._extractor_associations and num_curves != len(self._extractor_associations[extractor]):
             self.remove_curves_provided_by_extractor(extractor)
@@ -143,14 +230,33 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
                 raise RuntimeError('%r curves is much too many' % num_curves)
             self._extractor_associations[extractor] = self._forge_curves(num_curves, extractor.color)
 
+        return self._extractor_associations[extractor]
+
+    def add_value(self, extractor, x, y):
+        try:
+            num_curves = len(y)
+        except Exception:
+            num_curves = 1
+            y = y,  # do you love Python as I do
+
         # Actually plotting
-        for idx, curve in enumerate(self._extractor_associations[extractor]):
+        for idx, curve in enumerate(self._get_curves(extractor, num_curves)):
             curve.add_point(x, float(y[idx]))
             curve.set_color(extractor.color)
 
         # Updating the rightmost value
         self._max_x = max(self._max_x, x)
 
+    def add_values(self, extractor, x, y):
+        if y.ndim == 1:
+            y = y[:, numpy.newaxis]
+
+        for idx, curve in enumerate(self._get_curves(extractor, y.shape[1])):
+            curve.add_points(x, y[:, idx])
+            curve.set_color(extractor.color)
+
+        self._max_x = max(self._max_x, float(x.max()))
+
     def remove_curves_provided_by_extractor(self, extractor):
         try:
             curves = self._extractor_associations[extractor]
@@ -160,14 +266,19 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
         except KeyError:
             pass
 
-        if self._legend is not None:
-            self._legend.scene().removeItem(self._legend)
-            self._legend = None
+        self._rebuild_legend()
 
     def _do_clear(self):
         for k in list(self._extractor_associations.keys()):
             self.remove_curves_provided_by_extractor(k)
 
+    def get_series(self):
+        out = []
+        for extractor, curves in self._extractor_associations.items():
+            samples = [c.get_samples() for c in curves]
+            out.append((extractor, samples[0][0], numpy.column_stack([y for _, y in samples])))
+        return out
+
     def reset(self):
         self._do_clear()
         self._max_x = 0
@@ -176,11 +287,6 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
         self._plot.setRange(xRange=(0, self.INITIAL_X_RANGE), padding=0)
 
     def update(self):
-        # Updating curves
-        for curves in self._extractor_associations.values():
-            for c in curves:
-                c.update()
-
         # Updating view range
         if self._autoscroll_checkbox.isChecked():
             (xmin, xmax), _ = self._plot.viewRange()
@@ -189,3 +295,21 @@ class PlotAreaYTWidget(QWidget, AbstractPlotArea):
             xmin = self._max_x - diff
             # noinspection PyArgumentList
             self._plot.setRange(xRange=(xmin, xmax), padding=0)
+
+        # Updating curves; about two points per horizontal pixel are enough to render the min/max envelope
+        (xmin, xmax), _ = self._plot.viewRange()
+        x_auto_range = bool(self._plot.getPlotItem().getViewBox().autoRangeEnabled()[0])
+        if x_auto_range:
+            xmin, xmax = None, None             # Auto range needs to see the whole curve to find its bounds
+        max_points = max(100, 2 * self._plot.width())
+        view_changed = self._view_changed or x_auto_range != self._x_auto_range
+        self._view_changed, self._x_auto_range = False, x_auto_range
+        for curves in self._extractor_associations.values():
+            for c in curves:
+                c.update(xmin, xmax, max_points, view_changed)
+
+        # Statistics are cheap to compute, but updating the legend text is not, so it is done at a lower rate
+        if self._statistics_button.isChecked() and self._legend is not None:
+            if time.monotonic() - self._statistics_updated_at >= self.STATISTICS_UPDATE_INTERVAL:
+                self._statistics_updated_at = time.monotonic()
+                self._update_statistics(xmin, xmax)
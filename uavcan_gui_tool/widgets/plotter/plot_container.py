@@ -7,12 +7,15 @@
 #
 
 import logging
+import os
 
+import numpy
 from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QDockWidget, QVBoxLayout, QHBoxLayout, QWidget, QLabel
+from PyQt5.QtWidgets import QDockWidget, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QFileDialog
 
+from .export import SeriesExporter, EXPORT_FILE_FILTER
 from .value_extractor_views import NewValueExtractorWindow, ExtractorWidget
-from .. import make_icon_button
+from .. import make_icon_button, show_error, flash
 
 logger = logging.getLogger(__name__)
 
@@ -23,18 +26,29 @@ class PlotContainerWidget(QDockWidget):
         self.setAttribute(Qt.WA_DeleteOnClose)  # This is required to stop background timers!
 
         self.on_close = lambda: None
+        self.on_extractors_changed = lambda: None
 
         self._plot_area = plot_area_class(self, display_measurements=self.setWindowTitle)
 
-        self.update = self._plot_area.update
         self.reset = self._plot_area.reset
 
         self._active_data_types = active_data_types
         self._extractors = []
 
+        self._exporter = None               # Continuous recording of the extracted values, if active
+        self._finishing_exporters = []      # Closed exporters that are still writing
+
         self._new_extractor_button = make_icon_button('plus', 'Add new value extractor', self,
                                                       on_clicked=self._do_new_extractor)
 
+        self._save_button = make_icon_button('floppy-o', 'Save the data of all curves into a CSV or NumPy file',
+                                             self, on_clicked=self._do_save)
+        self._save_button.setVisible(self._plot_area.get_series() is not None)
+
+        self._record_button = make_icon_button('circle', 'Record the extracted values into a CSV or NumPy file '
+                                               'as they arrive', self, checkable=True,
+                                               on_clicked=self._on_record_button_clicked)
+
         self._how_to_label = QLabel('\u27F5 Click to configure plotting', self)
 
         widget = QWidget(self)
@@ -46,6 +60,8 @@ class PlotContainerWidget(QDockWidget):
 
         controls_layout = QVBoxLayout(widget)
         controls_layout.addWidget(self._new_extractor_button)
+        controls_layout.addWidget(self._save_button)
+        controls_layout.addWidget(self._record_button)
         controls_layout.addStretch(1)
         controls_layout.setContentsMargins(0, 0, 0, 0)
         footer_layout.addLayout(controls_layout)
@@ -76,6 +92,7 @@ class PlotContainerWidget(QDockWidget):
 
         def done(extractor):
             self._extractors.append(extractor)
+            self.on_extractors_changed()
             widget = ExtractorWidget(self, extractor)
             self._extractors_layout.addWidget(widget)
 
@@ -83,6 +100,7 @@ class PlotContainerWidget(QDockWidget):
                 self._plot_area.remove_curves_provided_by_extractor(extractor)
                 self._extractors.remove(extractor)
                 self._extractors_layout.removeWidget(widget)
+                self.on_extractors_changed()
 
             widget.on_remove = remove
 
@@ -90,16 +108,107 @@ class PlotContainerWidget(QDockWidget):
         win.on_done = done
         win.show()
 
-    def process_transfer(self, timestamp, tr):
-        for extractor in self._extractors:
+    def _ask_export_path(self, title):
+        path, selected_filter = QFileDialog.getSaveFileName(self, title, '', EXPORT_FILE_FILTER)
+        if path and not os.path.splitext(path)[1]:
+            path += '.npz' if '.npz' in selected_filter else '.csv'
+        return path
+
+    def _make_exporter(self, title):
+        path = self._ask_export_path(title)
+        if not path:
+            return
+        try:
+            return SeriesExporter(path)
+        except Exception as ex:
+            show_error('Export error', 'Could not create the file', ex, self)
+
+    def _finish_exporter(self, exporter):
+        exporter.close()
+        self._finishing_exporters.append(exporter)
+
+    def _do_save(self):
+        exporter = self._make_exporter('Save plotted data')
+        if exporter is not None:
+            # Only the arrays are copied here, they are formatted and written by the exporter thread
+            for extractor, timestamps, values in self._plot_area.get_series():
+                exporter.add_series(extractor, timestamps, values)
+            self._finish_exporter(exporter)
+            flash(self.parentWidget(), 'Saving to %s', exporter.path)
+
+    def _on_record_button_clicked(self):
+        if self._record_button.isChecked():
+            self._exporter = self._make_exporter('Record extracted values')
+            if self._exporter is None:
+                self._record_button.setChecked(False)
+                return
+            flash(self.parentWidget(), 'Recording to %s', self._exporter.path)
+        else:
+            self._stop_recording()
+
+    def _stop_recording(self):
+        if self._exporter is not None:
+            self._finish_exporter(self._exporter)
+            self._exporter = None
+        self._record_button.setChecked(False)
+
+    def _check_finished_exporters(self):
+        for exporter in self._finishing_exporters[:]:
+            if not exporter.finished:
+                continue
+            self._finishing_exporters.remove(exporter)
+            if exporter.error is not None:
+                show_error('Export error', 'Could not write %s' % exporter.path, exporter.error, self)
+            else:
+                flash(self.parentWidget(), '%d values have been written to %s, %d dropped', exporter.num_written,
+                      exporter.path, exporter.num_dropped, duration=5)
+
+    @property
+    def extractors(self):
+        return self._extractors
+
+    def process_transfers(self, timestamps, transfers, extractor):
+        """
+        Feeds a list of transfers and an array of their timestamps to one of the extractors of this container;
+        the data type must match. If the values are numbers or sequences of numbers of the same length, they are
+        added to the plot area in bulk.
+        """
+        indices, values = extractor.extract_batch(transfers)
+        if not indices:
+            return
+        timestamps = timestamps[indices]
+
+        try:
+            values_array = numpy.asarray(values, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            values_array = None
+
+        if values_array is not None and values_array.ndim in (1, 2):
             try:
-                value = extractor.try_extract(tr)
-                if value is None:
-                    continue
-                self._plot_area.add_value(extractor, timestamp, value)
+                self._plot_area.add_values(extractor, timestamps, values_array)
+                if self._exporter is not None:
+                    self._exporter.add_many(extractor, timestamps, values_array)
             except Exception:
-                extractor.register_error()
+                extractor.register_error(len(indices))
+        else:
+            for timestamp, value in zip(timestamps.tolist(), values):
+                try:
+                    self._plot_area.add_value(extractor, timestamp, value)
+                    if self._exporter is not None:
+                        self._exporter.add(extractor, timestamp, value)
+                except Exception:
+                    extractor.register_error()
+
+    def update(self):
+        self._plot_area.update()
+        if self._exporter is not None:
+            self._exporter.flush()
+            if self._exporter.error is not None:
+                self._stop_recording()
+        if self._finishing_exporters:
+            self._check_finished_exporters()
 
     def closeEvent(self, qcloseevent):
+        self._stop_recording()
         super(PlotContainerWidget, self).closeEvent(qcloseevent)
         self.on_close()
@@ -6,30 +6,171 @@
 # Author: Pavel Kirienko <pavel.kirienko@zubax.com>
 #
 
+import ast
+import operator
+
 
 EXPRESSION_VARIABLE_FOR_MESSAGE = 'msg'
 EXPRESSION_VARIABLE_FOR_SRC_NODE_ID = 'src_node_id'
 
+_COMPARISON_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+
+def _parse_path(node):
+    """
+    If the node is a plain field path, such as msg.status.rpm or msg.cmd[3], returns a tuple of the variable name
+    and the list of the steps of the path, which are dotted attribute names and item getters; otherwise None.
+    """
+    getters = []                # From the last to the first
+    while not isinstance(node, ast.Name):
+        if isinstance(node, ast.Attribute):
+            if getters and isinstance(getters[-1], str):
+                getters[-1] = node.attr + '.' + getters[-1]         # Consecutive attributes share one attrgetter
+            else:
+                getters.append(node.attr)
+        elif isinstance(node, ast.Subscript):
+            index = node.slice.value if isinstance(node.slice, getattr(ast, 'Index', ())) else node.slice
+            try:
+                index = ast.literal_eval(index)
+            except ValueError:
+                return None
+            if not isinstance(index, int):
+                return None
+            getters.append(operator.itemgetter(index))
+        else:
+            return None
+        node = node.value
+
+    if node.id not in (EXPRESSION_VARIABLE_FOR_MESSAGE, EXPRESSION_VARIABLE_FOR_SRC_NODE_ID):
+        return None
+
+    return node.id, list(reversed(getters))
+
+
+def _compile_path(node):
+    """
+    If the node is a plain field path, returns a function of (msg, src_node_id) that follows the path with attribute
+    and item getters; otherwise returns None.
+    """
+    path = _parse_path(node)
+    if path is None:
+        return None
+
+    variable, steps = path
+    getters = [operator.attrgetter(g) if isinstance(g, str) else g for g in steps]
+    use_message = variable == EXPRESSION_VARIABLE_FOR_MESSAGE
+
+    def follow(msg, src_node_id):
+        value = msg if use_message else src_node_id
+        for g in getters:
+            value = g(value)
+        return value
+
+    return follow
+
+
+def _compile_batch_path(node):
+    """
+    Like _compile_path(), but the function accepts a list of transfers and returns the list of their values.
+    The getters are chained with map(), so no Python code is executed per transfer.
+    """
+    path = _parse_path(node)
+    if path is None:
+        return None
+
+    variable, steps = path
+    field = 'message' if variable == EXPRESSION_VARIABLE_FOR_MESSAGE else 'source_node_id'
+    if steps and isinstance(steps[0], str):
+        steps[0] = field + '.' + steps[0]
+    else:
+        steps.insert(0, field)
+    getters = [operator.attrgetter(g) if isinstance(g, str) else g for g in steps]
+
+    def follow(transfers):
+        values = transfers
+        for g in getters:
+            values = map(g, values)
+        return list(values)
+
+    return follow
+
+
+def _compile_comparison(node):
+    """Like _compile_path(), for a comparison of a field path with a constant, such as src_node_id == 42."""
+    if not isinstance(node, ast.Compare) or len(node.ops) != 1 or type(node.ops[0]) not in _COMPARISON_OPERATORS:
+        return None
+    compare = _COMPARISON_OPERATORS[type(node.ops[0])]
+    path = _compile_path(node.left)
+    try:
+        constant = ast.literal_eval(node.comparators[0])
+    except ValueError:
+        return None
+    if path is None:
+        return None
+    return lambda msg, src_node_id: compare(path(msg, src_node_id), constant)
+
+
+def _get_required_source_node_id(node):
+    """If the node is a comparison of the form src_node_id == 42, returns the node ID, otherwise None."""
+    if not isinstance(node, ast.Compare) or len(node.ops) != 1 or not isinstance(node.ops[0], ast.Eq):
+        return None
+    if not isinstance(node.left, ast.Name) or node.left.id != EXPRESSION_VARIABLE_FOR_SRC_NODE_ID:
+        return None
+    try:
+        value = ast.literal_eval(node.comparators[0])
+    except ValueError:
+        return None
+    return value if isinstance(value, int) else None
+
 
 class Expression:
+    """
+    Python expression of the variables msg and src_node_id. Plain field paths and their comparisons with constants,
+    which make up most of the expressions in practice, are compiled into chains of attribute and item getters;
+    everything else is evaluated with eval().
+    """
     class EvaluationError(Exception):
         pass
 
     def __init__(self, source=None):
         self._source = None
         self._compiled = None
+        self._function = None
+        self._batch_function = None
+        self._required_source_node_id = None
         self.set(source)
 
     def set(self, source):
         source = source.strip()
         code = compile(str(source), '<custom-expression>', 'eval')  # May throw
+        tree = ast.parse(source, mode='eval').body
         self._source = source
         self._compiled = code
+        self._function = _compile_path(tree) or _compile_comparison(tree) or self._evaluate_positional
+        self._batch_function = _compile_batch_path(tree)
+        self._required_source_node_id = _get_required_source_node_id(tree)
 
     @property
     def source(self):
         return self._source
 
+    @property
+    def required_source_node_id(self):
+        """If the expression holds only for the transfers from one node, e.g. src_node_id == 42, its ID."""
+        return self._required_source_node_id
+
+    @property
+    def is_compiled(self):
+        """True if the expression is evaluated without eval()."""
+        return self._function != self._evaluate_positional
+
     # noinspection PyShadowingBuiltins
     def evaluate(self, **locals):
         try:
@@ -37,38 +178,109 @@ class Expression:
         except Exception as ex:
             raise self.EvaluationError('Failed to evaluate expression: %s' % ex) from ex
 
+    def _evaluate_positional(self, msg, src_node_id):
+        return self.evaluate(**{EXPRESSION_VARIABLE_FOR_MESSAGE: msg, EXPRESSION_VARIABLE_FOR_SRC_NODE_ID: src_node_id})
+
+    @property
+    def function(self):
+        """The expression as a function of (msg, src_node_id); the fastest way to evaluate it."""
+        return self._function
+
+    @property
+    def batch_function(self):
+        """For plain field paths, a function of a list of transfers that returns their values; otherwise None."""
+        return self._batch_function
+
 
 class Extractor:
     def __init__(self, data_type_name, extraction_expression, filter_expressions, color):
         self.data_type_name = data_type_name
-        self.extraction_expression = extraction_expression
-        self.filter_expressions = filter_expressions
+        self._extraction_expression = extraction_expression
+        self._filter_expressions = filter_expressions
+        self._extract = None
+        self._extract_batch = None
         self.color = color
         self._error_count = 0
+        self._fuse()
+
+    def _fuse(self):
+        """Combines the filters and the extraction into one function that returns None if filtered out."""
+        extract = self._extraction_expression.function
+        filters = [x.function for x in self._filter_expressions]
+        if not filters:
+            self._extract = extract
+        elif len(filters) == 1:
+            accept = filters[0]
+            self._extract = lambda msg, src: extract(msg, src) if accept(msg, src) else None
+        else:
+            self._extract = lambda msg, src: extract(msg, src) if all(f(msg, src) for f in filters) else None
+
+        fused = self._extract
+        if not filters and self._extraction_expression.batch_function is not None:
+            self._extract_batch = self._extraction_expression.batch_function
+        else:
+            self._extract_batch = lambda transfers: [fused(tr.message, tr.source_node_id) for tr in transfers]
+
+    @property
+    def extraction_expression(self):
+        return self._extraction_expression
+
+    @extraction_expression.setter
+    def extraction_expression(self, value):
+        self._extraction_expression = value
+        self._fuse()
+
+    @property
+    def filter_expressions(self):
+        return self._filter_expressions
+
+    @filter_expressions.setter
+    def filter_expressions(self, value):
+        self._filter_expressions = value
+        self._fuse()
+
+    @property
+    def source_node_id(self):
+        """If the filters pass only the transfers from one node, its ID; otherwise None."""
+        for x in self._filter_expressions:
+            if x.required_source_node_id is not None:
+                return x.required_source_node_id
 
     def __repr__(self):
         return '%r %r %r' % (self.data_type_name, self.extraction_expression.source,
                              [x.source for x in self.filter_expressions])
 
-    def try_extract(self, tr):
-        if tr.data_type_name != self.data_type_name:
-            return
-
-        evaluation_kwargs = {
-            EXPRESSION_VARIABLE_FOR_MESSAGE: tr.message,
-            EXPRESSION_VARIABLE_FOR_SRC_NODE_ID: tr.source_node_id,
-        }
-
-        for exp in self.filter_expressions:
-            if not exp.evaluate(**evaluation_kwargs):
-                return
+    def extract(self, tr):
+        """
+        Returns the value extracted from the transfer, or None if the transfer does not pass the filters.
+        The data type of the transfer is expected to match the extractor; it is not checked here.
+        """
+        return self._extract(tr.message, tr.source_node_id)
 
-        value = self.extraction_expression.evaluate(**evaluation_kwargs)
+    def extract_batch(self, transfers):
+        """
+        Like extract(), for a list of transfers. Returns a tuple of the list of the indices of the transfers that
+        yielded values and the list of the values. Failures are registered as errors.
+        """
+        try:
+            values = self._extract_batch(transfers)
+        except Exception:
+            # Some of the transfers are broken; finding them one by one
+            values = []
+            for tr in transfers:
+                try:
+                    values.append(self._extract(tr.message, tr.source_node_id))
+                except Exception:
+                    values.append(None)
+                    self.register_error()
 
-        return value
+        indices = [i for i, v in enumerate(values) if v is not None]
+        if len(indices) < len(values):
+            values = [values[i] for i in indices]
+        return indices, values
 
-    def register_error(self):
-        self._error_count += 1
+    def register_error(self, count=1):
+        self._error_count += count
 
     def reset_error_count(self):
         self._error_count = 0
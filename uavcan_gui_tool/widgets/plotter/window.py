@@ -6,39 +6,61 @@
 # Author: Pavel Kirienko <pavel.kirienko@zubax.com>
 #
 
+import collections
 import logging
 import time
 from functools import partial
 
+import numpy
 from PyQt5.QtCore import QTimer, Qt
 from PyQt5.QtGui import QKeySequence
-from PyQt5.QtWidgets import QMainWindow, QAction
+from PyQt5.QtWidgets import QMainWindow, QAction, QLabel
 
 from .plot_areas import PLOT_AREAS
 from .plot_container import PlotContainerWidget
 from .. import get_app_icon, get_icon
+from ..ipc_stats import format_ipc_stats
 
 logger = logging.getLogger(__name__)
 
 
 class PlotterWindow(QMainWindow):
-    def __init__(self, get_transfer_callback):
+    IPC_STATS_UPDATE_INTERVAL_MS = 1000
+
+    def __init__(self, get_transfer_callback, get_ipc_stats=None):
         super(PlotterWindow, self).__init__()
         self.setWindowTitle('UAVCAN Plotter')
         self.setWindowIcon(get_app_icon())
 
         self._active_data_types = set()
 
+        # Invoked with a dict {data type name: set of source node IDs or None for any} whenever the set of
+        # the transfers the plots need changes; other transfers need not be delivered to this window
+        self.on_demand_changed = lambda _: None
+        self._demand = {}
+
         self._get_transfer = get_transfer_callback
+        self._unknown_data_type_ids = set()     # Of the received transfers that could not be decoded
 
         self._update_timer = QTimer(self)
         self._update_timer.setSingleShot(False)
         self._update_timer.timeout.connect(self._update)
         self._update_timer.start(50)
 
+        self._get_ipc_stats = get_ipc_stats
+        self._ipc_stats_display = QLabel(self)
+        self._ipc_stats_display.setToolTip('Transfers forwarded from the main window')
+
+        self._ipc_stats_timer = QTimer(self)
+        self._ipc_stats_timer.setSingleShot(False)
+        self._ipc_stats_timer.timeout.connect(self._update_ipc_stats)
+        if get_ipc_stats is not None:
+            self._ipc_stats_timer.start(self.IPC_STATS_UPDATE_INTERVAL_MS)
+
         self._base_time = time.monotonic()
 
         self._plot_containers = []
+        self._extractor_dispatch = {}  # Data type name : list of (plot container, extractor)
 
         #
         # Control menu
@@ -83,6 +105,7 @@ class PlotterWindow(QMainWindow):
         # Window stuff
         #
         self.statusBar().showMessage('Use the "New Plot" menu to add plots')
+        self.statusBar().addPermanentWidget(self._ipc_stats_display)
         self.setCentralWidget(None)
         self.resize(600, 400)
 
@@ -93,12 +116,33 @@ class PlotterWindow(QMainWindow):
     def _on_pause_toggled(self, checked):
         self.statusBar().showMessage('Paused' if checked else 'Un-paused')
 
+    def _update_extractor_dispatch(self):
+        dispatch = collections.defaultdict(list)
+        for plc in self._plot_containers:
+            for extractor in plc.extractors:
+                dispatch[extractor.data_type_name].append((plc, extractor))
+        self._extractor_dispatch = dict(dispatch)
+
+        demand = {}
+        for data_type_name, targets in self._extractor_dispatch.items():
+            node_ids = {extractor.source_node_id for _, extractor in targets}
+            demand[data_type_name] = None if None in node_ids else node_ids
+        if demand != self._demand:
+            self._demand = demand
+            self.on_demand_changed(demand)
+
+    def add_active_data_types(self, names):
+        """Data types seen on the bus, offered for plotting even if they are not delivered to this window."""
+        self._active_data_types.update(names)
+
     def _do_add_new_plot(self, plot_area_name):
         def remove():
             self._plot_containers.remove(plc)
+            self._update_extractor_dispatch()
 
         plc = PlotContainerWidget(self, PLOT_AREAS[plot_area_name], self._active_data_types)
         plc.on_close = remove
+        plc.on_extractors_changed = self._update_extractor_dispatch
         self._plot_containers.append(plc)
 
         docks = [
@@ -113,6 +157,11 @@ class PlotterWindow(QMainWindow):
         if len(self._plot_containers) > 1:
             self.statusBar().showMessage('Drag plots by the header to rearrange or detach them')
 
+    def _update_ipc_stats(self):
+        stats = self._get_ipc_stats()
+        self._ipc_stats_display.setText(format_ipc_stats(stats))
+        self._ipc_stats_display.setStyleSheet('color: red' if stats.dropped else '')
+
     def _do_reset(self):
         self._base_time = time.monotonic()
 
@@ -131,18 +180,34 @@ class PlotterWindow(QMainWindow):
             return
 
         if not self._pause_action.isChecked():
+            # Grouping the transfers by data type, so that every extractor processes all of its transfers at once
+            batches = collections.defaultdict(list)
             while True:
                 tr = self._get_transfer()
                 if not tr:
                     break
-
-                self._active_data_types.add(tr.data_type_name)
-
-                for plc in self._plot_containers:
+                data_type_name = tr.data_type_name
+                if data_type_name is None:
+                    if tr.data_type_id not in self._unknown_data_type_ids:
+                        self._unknown_data_type_ids.add(tr.data_type_id)
+                        logger.warning('Transfers of unknown data type %r will be ignored', tr.data_type_id)
+                    continue
+                batches[data_type_name].append(tr)
+
+            for data_type_name, transfers in batches.items():
+                self._active_data_types.add(data_type_name)
+
+                # Only the extractors configured for this data type get to see the transfers
+                targets = self._extractor_dispatch.get(data_type_name)
+                if not targets:
+                    continue
+                timestamps = numpy.fromiter((tr.ts_mono for tr in transfers), dtype=numpy.float64,
+                                            count=len(transfers)) - self._base_time
+                for plc, extractor in targets:
                     try:
-                        plc.process_transfer(tr.ts_mono - self._base_time, tr)
+                        plc.process_transfers(timestamps, transfers, extractor)
                     except Exception:
-                        logger.error('Plot container failed to process a transfer', exc_info=True)
+                        logger.error('Plot container failed to process transfers', exc_info=True)
 
         for plc in self._plot_containers:
             try:
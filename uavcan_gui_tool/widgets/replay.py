@@ -0,0 +1,185 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import logging
+import os
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QDialog, QHBoxLayout, QVBoxLayout, QComboBox, QLabel, QSlider, QCheckBox, QFileDialog
+
+from . import make_icon_button, show_error
+from ..capture_file import CaptureReader, FILE_EXTENSION
+from ..replay import CaptureReplay
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayWindow(QDialog):
+    """
+    Replays a capture file through the local node, so that all tools (bus monitors, plotters, subscribers, etc.)
+    receive the recorded traffic as if it was live.
+    """
+    POLL_INTERVAL_MS = 10
+    SLIDER_RESOLUTION = 1000
+
+    SPEEDS = [
+        ('Real time', 1.0),
+        ('2x', 2.0),
+        ('5x', 5.0),
+        ('10x', 10.0),
+        ('50x', 50.0),
+        ('As fast as possible', None),
+    ]
+
+    def __init__(self, parent, node):
+        super(ReplayWindow, self).__init__(parent)
+        self.setWindowTitle('Capture Replay')
+        self.setAttribute(Qt.WA_DeleteOnClose)  # This is required to stop background timers!
+
+        self._node = node
+        self._capture = None
+        self._replay = None
+
+        self._open_button = make_icon_button('folder-open-o', 'Open capture file', self, on_clicked=self._open)
+        self._play_button = make_icon_button('play', 'Start/pause replay', self, checkable=True,
+                                             on_clicked=self._on_play_button_clicked)
+        self._rewind_button = make_icon_button('fast-backward', 'Rewind to the beginning', self,
+                                               on_clicked=lambda: self._seek(0))
+
+        self._file_label = QLabel('No capture file', self)
+
+        self._speed_selector = QComboBox(self)
+        self._speed_selector.setToolTip('Replay speed relative to the recorded pace')
+        for name, _ in self.SPEEDS:
+            self._speed_selector.addItem(name)
+        self._speed_selector.currentIndexChanged.connect(self._on_speed_changed)
+
+        self._deliver_messages = QCheckBox('Deliver messages to handlers', self)
+        self._deliver_messages.setToolTip('Make replayed messages visible to the subscriber, node monitor, etc.\n'
+                                          'Hooks (bus monitor, plotter) always receive the replayed traffic.\n'
+                                          'Takes effect when a capture is opened.')
+        self._deliver_messages.setChecked(True)
+
+        self._position_slider = QSlider(Qt.Horizontal, self)
+        self._position_slider.setRange(0, self.SLIDER_RESOLUTION)
+        self._position_slider.sliderReleased.connect(
+            lambda: self._seek(self._position_slider.value() / self.SLIDER_RESOLUTION))
+
+        self._status_label = QLabel(self)
+
+        self._poll_timer = QTimer(self)
+        self._poll_timer.setSingleShot(False)
+        self._poll_timer.timeout.connect(self._poll)
+        self._poll_timer.start(self.POLL_INTERVAL_MS)
+
+        layout = QVBoxLayout(self)
+
+        controls_layout = QHBoxLayout(self)
+        controls_layout.addWidget(self._open_button)
+        controls_layout.addWidget(self._play_button)
+        controls_layout.addWidget(self._rewind_button)
+        controls_layout.addWidget(self._speed_selector)
+        controls_layout.addWidget(self._file_label, 1)
+
+        layout.addLayout(controls_layout)
+        layout.addWidget(self._position_slider)
+        layout.addWidget(self._deliver_messages)
+        layout.addWidget(self._status_label)
+        self.setLayout(layout)
+
+        self.setMinimumWidth(500)
+        self._update_status()
+
+    def _get_speed(self):
+        return self.SPEEDS[self._speed_selector.currentIndex()][1]
+
+    def _close_capture(self):
+        self._replay = None
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
+    def _open(self):
+        path, _ = QFileDialog.getOpenFileName(self, 'Open capture file', '',
+                                              'CAN capture files (*%s);;All files (*)' % FILE_EXTENSION)
+        if not path:
+            return
+
+        self._close_capture()
+        try:
+            self._capture = CaptureReader(path)
+        except Exception as ex:
+            show_error('Capture error', 'Could not open the capture file', ex, self)
+            return
+
+        self._replay = CaptureReplay(self._node, self._capture.records, speed=self._get_speed(),
+                                     deliver_messages=self._deliver_messages.isChecked())
+        self._file_label.setText(os.path.basename(path))
+        self._play_button.setChecked(False)
+        self._update_status()
+
+    def _on_play_button_clicked(self):
+        if self._replay is None:
+            self._play_button.setChecked(False)
+            return
+        if self._play_button.isChecked():
+            if self._replay.finished:
+                self._replay.seek(0)
+            self._replay.start()
+        else:
+            self._replay.pause()
+
+    def _on_speed_changed(self):
+        if self._replay is not None:
+            self._replay.speed = self._get_speed()
+
+    def _seek(self, fraction):
+        if self._replay is not None:
+            self._replay.seek(fraction * len(self._replay))
+            self._update_status()
+
+    def _poll(self):
+        if self._replay is None or self._replay.paused:
+            return
+
+        try:
+            self._replay.poll()
+        except Exception as ex:
+            logger.error('Replay failed', exc_info=True)
+            self._replay.pause()
+            self._play_button.setChecked(False)
+            show_error('Replay error', 'Replay has been stopped', ex, self)
+
+        if self._replay.finished:
+            self._replay.pause()
+            self._play_button.setChecked(False)
+
+        self._update_status()
+
+    def _update_status(self):
+        if self._replay is None:
+            self._status_label.setText('Open a capture file to begin')
+            return
+
+        if not self._position_slider.isSliderDown():
+            self._position_slider.setValue(int(self.SLIDER_RESOLUTION * self._replay.position /
+                                               max(1, len(self._replay))))
+
+        self._status_label.setText('Frame %d of %d, replayed %d frames, %d transfers, %d errors%s' %
+                                   (self._replay.position, len(self._replay), self._replay.num_frames,
+                                    self._replay.num_transfers, self._replay.num_errors,
+                                    ' - finished' if self._replay.finished else ''))
+
+    def closeEvent(self, qcloseevent):
+        self._poll_timer.stop()
+        self._close_capture()
+        super(ReplayWindow, self).closeEvent(qcloseevent)
+
+    @staticmethod
+    def spawn(parent, node):
+        ReplayWindow(parent, node).show()
@@ -0,0 +1,289 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import math
+from collections import namedtuple
+
+import numpy
+
+
+class RingBuffer:
+    """
+    Fixed-capacity FIFO of rows of floats, or of scalars of the specified dtype if the number of columns is None,
+    e.g. structured records. When full, the oldest rows are overwritten.
+    Every row is stored twice, so that the contents are always available as a contiguous view without copying.
+    """
+
+    def __init__(self, capacity, num_columns, dtype=numpy.float64):
+        self._capacity = int(capacity)
+        shape = (2 * self._capacity,) if num_columns is None else (2 * self._capacity, num_columns)
+        self._buffer = numpy.zeros(shape, dtype=dtype)
+        self._head = 0                  # Total number of rows ever written
+        self._length = 0
+
+    def extend(self, rows):
+        """Accepts an array of shape (N, num_columns), or (N,) if the number of columns is None."""
+        skipped = max(0, len(rows) - self._capacity)    # Would be overwritten right away
+        rows = rows[skipped:]
+        self._head += skipped
+        if len(rows) == 0:
+            return
+        index = (self._head + numpy.arange(len(rows))) % self._capacity
+        self._buffer[index] = rows
+        self._buffer[index + self._capacity] = rows
+        self._head += len(rows)
+        self._length = min(self._length + len(rows), self._capacity)
+
+    def append(self, row):
+        """Cheaper than extend() for a single row."""
+        index = self._head % self._capacity
+        self._buffer[index] = row
+        self._buffer[index + self._capacity] = row
+        self._head += 1
+        self._length = min(self._length + 1, self._capacity)
+
+    def clear(self):
+        self._head = 0
+        self._length = 0
+
+    def set_capacity(self, capacity):
+        """Reallocates the buffer; the newest rows that fit into the new capacity are retained."""
+        rows = self.data[-int(capacity):].copy()
+        self._capacity = int(capacity)
+        self._buffer = numpy.zeros((2 * self._capacity,) + self._buffer.shape[1:], dtype=self._buffer.dtype)
+        self.clear()
+        self.extend(rows)
+
+    @property
+    def data(self):
+        """Rows from the oldest to the newest. This is a view; it is invalidated by subsequent modifications."""
+        start = (self._head - self._length) % self._capacity
+        return self._buffer[start:start + self._length]
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def overflowed(self):
+        """True if some rows have been overwritten."""
+        return self._head > self._length
+
+    @property
+    def num_written(self):
+        """Total number of rows written since the last clear(), including the overwritten ones."""
+        return self._head
+
+    def __len__(self):
+        return self._length
+
+
+SeriesStatistics = namedtuple('SeriesStatistics', ['count', 'mean', 'stddev', 'min', 'max'])
+
+
+class BlockStatistics:
+    """
+    Statistics of the newest samples of a series over any range of them, at a cost that does not depend on the length
+    of the range. The samples are summarised in blocks of a fixed size (mean, sum of squared deviations from the mean,
+    min, max); a range is made of whole blocks, which are merged using the parallel form of Welford's algorithm,
+    and of at most two partial blocks at the edges, which are computed from the samples themselves.
+    """
+    DEFAULT_BLOCK_SIZE = 256
+
+    def __init__(self, capacity, block_size=DEFAULT_BLOCK_SIZE):
+        self._block_size = int(block_size)
+        self._blocks = RingBuffer(max(1, capacity // self._block_size), 4)    # Columns: mean, M2, min, max
+        self._tail = numpy.empty(0, dtype=numpy.float64)                     # Samples that do not make a block yet
+
+    def extend(self, y):
+        y = numpy.concatenate((self._tail, y))
+        num_blocks = len(y) // self._block_size
+        if num_blocks:
+            blocks = y[:num_blocks * self._block_size].reshape(num_blocks, self._block_size)
+            mean = blocks.mean(axis=1)
+            m2 = numpy.square(blocks - mean[:, numpy.newaxis]).sum(axis=1)
+            self._blocks.extend(numpy.column_stack((mean, m2, blocks.min(axis=1), blocks.max(axis=1))))
+        self._tail = y[num_blocks * self._block_size:]
+
+    def clear(self):
+        self._blocks.clear()
+        self._tail = self._tail[:0]
+
+    def get(self, samples, first_index, begin, end):
+        """
+        Returns SeriesStatistics of samples[begin:end], or None if the range is empty. The samples are an array
+        of the newest y values and first_index is the number of the values that preceded them.
+        """
+        if begin >= end:
+            return None
+
+        size = self._block_size
+        oldest_block = self._blocks.num_written - len(self._blocks)
+        first_block = max(-(-(first_index + begin) // size), oldest_block)
+        last_block = (first_index + end) // size
+        if last_block > first_block:
+            blocks = self._blocks.data[first_block - oldest_block:last_block - oldest_block]
+            edges = samples[begin:first_block * size - first_index], samples[last_block * size - first_index:end]
+        else:
+            blocks = self._blocks.data[:0]
+            edges = samples[begin:end],
+
+        edges = [e for e in edges if len(e)]
+        counts = numpy.concatenate((numpy.full(len(blocks), size), [len(e) for e in edges]))
+        means = numpy.concatenate((blocks[:, 0], [e.mean() for e in edges]))
+        m2 = blocks[:, 1].sum() + sum(float(numpy.square(e - e.mean()).sum()) for e in edges)
+
+        minima = [e.min() for e in edges] + ([blocks[:, 2].min()] if len(blocks) else [])
+        maxima = [e.max() for e in edges] + ([blocks[:, 3].max()] if len(blocks) else [])
+
+        count = counts.sum()
+        mean = (counts * means).sum() / count
+        m2 += (counts * numpy.square(means - mean)).sum()
+        return SeriesStatistics(int(count), float(mean), math.sqrt(max(float(m2), 0.0) / count),
+                                float(min(minima)), float(max(maxima)))
+
+
+class DecimatingRingBuffer:
+    """
+    Ring buffer of (x, y) samples with non-decreasing x, such as a time series, that can be rendered cheaply
+    at any zoom level. Besides the raw samples, it keeps a pyramid of levels, where each entry of level K
+    holds the min and max of FACTOR consecutive entries of level K-1. By default, every level has the same capacity,
+    so the coarser levels reach further back in history; otherwise, the capacity of every level is FACTOR times
+    smaller than that of the level below, so that all levels span the same history as the raw samples and take
+    less memory than them. Appending costs amortised O(1) per sample.
+
+    get() selects the finest level that covers the requested range with at most the requested number of points;
+    min/max entries are rendered as two points each, so that the envelope of the signal is preserved.
+    If enabled, the statistics of y over any range of the raw samples are available from get_statistics().
+    """
+    DEFAULT_FACTOR = 4
+    DEFAULT_NUM_LEVELS = 6
+
+    def __init__(self, capacity, factor=DEFAULT_FACTOR, num_levels=DEFAULT_NUM_LEVELS, coarse_history=True,
+                 statistics=False):
+        self._factor = int(factor)
+        self._coarse_history = coarse_history
+        self._raw = RingBuffer(capacity, 2)
+        self._statistics = BlockStatistics(capacity) if statistics else None
+        if coarse_history:
+            level_capacities = [capacity] * num_levels
+        else:
+            # One entry less than the raw span, so that the pending entries of the finer levels fit in as well
+            level_capacities = [capacity // self._factor ** (k + 1) - 1 for k in range(num_levels)]
+            level_capacities = [c for c in level_capacities if c > 0]
+        self._levels = [RingBuffer(c, 3) for c in level_capacities]     # Columns: x, min(y), max(y)
+        num_levels = len(self._levels)
+        # Entries of the level below that are yet to be aggregated into the corresponding level
+        self._pending = [numpy.empty((0, 3), dtype=numpy.float64) for _ in range(num_levels)]
+
+    def extend(self, x, y):
+        x = numpy.asarray(x, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
+        if len(x) == 0:
+            return
+        self._raw.extend(numpy.column_stack((x, y)))
+        if self._statistics is not None:
+            self._statistics.extend(y)
+
+        entries = numpy.column_stack((x, y, y))
+        for level, ring in enumerate(self._levels):
+            combined = numpy.concatenate((self._pending[level], entries))
+            num_blocks = len(combined) // self._factor
+            blocks = combined[:num_blocks * self._factor].reshape(num_blocks, self._factor, 3)
+            self._pending[level] = combined[num_blocks * self._factor:]
+            if num_blocks == 0:
+                break
+            entries = numpy.column_stack((blocks[:, 0, 0], blocks[:, :, 1].min(axis=1), blocks[:, :, 2].max(axis=1)))
+            ring.extend(entries)
+
+    def append(self, x, y):
+        self.extend((x,), (y,))
+
+    def clear(self):
+        self._raw.clear()
+        if self._statistics is not None:
+            self._statistics.clear()
+        for ring in self._levels:
+            ring.clear()
+        self._pending = [p[:0] for p in self._pending]
+
+    def _get_tail(self, level):
+        """Entries that are newer than the last entry of the specified level, from the finer levels."""
+        return numpy.concatenate([self._pending[i] for i in range(level, -1, -1)])
+
+    @staticmethod
+    def _slice(data, x_min, x_max, tail=None):
+        """
+        Returns the rows of data followed by tail that fall into the range. The range is located in both arrays
+        before anything is copied, so the cost depends on the size of the output rather than on the size of data.
+        """
+        def locate(x, side):
+            index = int(numpy.searchsorted(data[:, 0], x, side=side))
+            if index == len(data) and tail is not None:
+                index += int(numpy.searchsorted(tail[:, 0], x, side=side))
+            return index
+
+        size = len(data) + (len(tail) if tail is not None else 0)
+        # One extra point on each side, so that the curve continues beyond the edges of the view
+        begin = 0 if x_min is None else max(0, locate(x_min, 'left') - 1)
+        end = size if x_max is None else min(size, locate(x_max, 'right') + 1)
+        if end <= len(data):
+            return data[begin:end]
+        if begin >= len(data):
+            return tail[begin - len(data):end - len(data)]
+        return numpy.concatenate((data[begin:], tail[:end - len(data)]))
+
+    def _covers(self, ring, data, x_min):
+        """Whether the data sliced from the ring is not missing anything that the coarser levels could show."""
+        if not self._coarse_history or not ring.overflowed:
+            return True
+        return x_min is not None and len(data) and data[0, 0] <= x_min
+
+    def get(self, x_min=None, x_max=None, max_points=None):
+        """Returns a tuple of arrays (x, y) covering the specified range, decimated if necessary."""
+        raw = self._slice(self._raw.data, x_min, x_max)
+        if self._covers(self._raw, raw, x_min) and (max_points is None or len(raw) <= max_points):
+            return raw[:, 0].copy(), raw[:, 1].copy()
+
+        data = None
+        for level, ring in enumerate(self._levels):
+            if len(ring) == 0:
+                break
+            data = self._slice(ring.data, x_min, x_max, tail=self._get_tail(level))
+            covers_range = self._covers(ring, data, x_min)
+            if covers_range and (max_points is None or 2 * len(data) <= max_points):
+                break
+
+        if data is None:
+            return raw[:, 0].copy(), raw[:, 1].copy()
+        return numpy.repeat(data[:, 0], 2), data[:, 1:].ravel()
+
+    def get_statistics(self, x_min=None, x_max=None):
+        """
+        Returns SeriesStatistics of y over the raw samples within the range, or None if there are none.
+        Requires the statistics to be enabled at construction.
+        """
+        raw = self._raw.data
+        begin = 0 if x_min is None else int(numpy.searchsorted(raw[:, 0], x_min))
+        end = len(raw) if x_max is None else int(numpy.searchsorted(raw[:, 0], x_max, side='right'))
+        return self._statistics.get(raw[:, 1], self._raw.num_written - len(raw), begin, end)
+
+    @property
+    def x_range(self):
+        """Tuple of the oldest and the newest x, or None if empty."""
+        if len(self._raw) == 0:
+            return None
+        oldest = self._raw.data[0, 0]
+        for ring in self._levels:
+            if len(ring):
+                oldest = min(oldest, ring.data[0, 0])
+        return oldest, self._raw.data[-1, 0]
+
+    def __len__(self):
+        """Number of raw samples retained."""
+        return len(self._raw)
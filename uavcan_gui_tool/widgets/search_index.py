@@ -0,0 +1,70 @@
+#
+# Copyright (C) 2016  UAVCAN Development Team  <uavcan.org>
+#
+# This software is distributed under the terms of the MIT License.
+#
+# Author: Pavel Kirienko <pavel.kirienko@zubax.com>
+#
+
+import re
+from array import array
+
+import numpy
+
+
+class TrigramIndex:
+    """
+    Inverted index that maps every trigram of the lowercased text to the keys of the texts that contain it.
+    A lookup returns a superset of the keys of the texts that contain the pattern, so the candidates must be verified.
+    Texts can be re-added under the same key when they change; stale postings only produce extra candidates.
+    """
+    N = 3
+
+    def __init__(self):
+        self._postings = {}             # Trigram : array of keys
+
+    def _trigrams(self, text):
+        text = text.lower()
+        return {text[i:i + self.N] for i in range(len(text) - self.N + 1)}
+
+    def add(self, key, text):
+        for t in self._trigrams(text):
+            try:
+                self._postings[t].append(key)
+            except KeyError:
+                self._postings[t] = array('q', [key])
+
+    def clear(self):
+        self._postings.clear()
+
+    @staticmethod
+    def get_literal(matcher):
+        """Returns the literal text the SearchMatcher looks for, or None if the pattern is not a literal."""
+        if matcher.inverse:
+            return None
+        if not matcher.use_regex or re.escape(matcher.pattern) == matcher.pattern:
+            return matcher.pattern
+
+    def lookup(self, matcher):
+        """
+        Returns a sorted array of keys that may match the SearchMatcher,
+        or None if the index cannot narrow down the search, e.g. if the pattern is a regular expression.
+        """
+        literal = self.get_literal(matcher)
+        if literal is None or len(literal) < self.N:
+            return None
+
+        postings = []
+        for t in self._trigrams(literal):
+            p = self._postings.get(t)
+            if p is None:
+                return numpy.empty(0, dtype=numpy.int64)
+            postings.append(p)
+
+        postings.sort(key=len)          # Intersecting the shortest lists first keeps the intermediate results small
+        out = numpy.unique(numpy.frombuffer(postings[0], dtype=numpy.int64))
+        for p in postings[1:]:
+            if len(out) == 0:
+                break
+            out = numpy.intersect1d(out, numpy.frombuffer(p, dtype=numpy.int64), assume_unique=False)
+        return out